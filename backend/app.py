@@ -6,13 +6,19 @@ Flask API Server with AI-powered log processing
 
 import os
 import sys
+import atexit
 import json
 import logging
 import threading
 import socket
 import time
-from datetime import datetime, timezone
-from typing import Dict, List, Optional, Any
+import zlib
+import queue
+import pickle
+import multiprocessing
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Any, Callable, Tuple
 
 from flask import Flask, request, jsonify, Response
 from flask_cors import CORS
@@ -20,6 +26,9 @@ import psutil
 import schedule
 from dotenv import load_dotenv
 
+from log_classifier import LogClassifier
+from log_compression import TemplateCodec
+
 # Load environment variables
 load_dotenv()
 
@@ -47,10 +56,16 @@ def get_clickhouse_client():
 try:
     from drain3 import TemplateMiner
     from drain3.template_miner_config import TemplateMinerConfig
+    from drain3.persistence_handler import PersistenceHandler
+    from drain3.drain import LogClusterCache
+    from drain3.masking import MaskingInstruction
 except ImportError:
     print("Drain3 not available. AI log parsing will be disabled.")
     TemplateMiner = None
     TemplateMinerConfig = None
+    PersistenceHandler = object
+    LogClusterCache = None
+    MaskingInstruction = None
 
 # Initialize Flask app
 app = Flask(__name__)
@@ -68,6 +83,8 @@ clickhouse_client = None
 template_miner = None
 metrics_thread = None
 syslog_thread = None
+log_writer_thread = None
+log_write_queue = None
 
 # Configuration
 CONFIG = {
@@ -92,13 +109,44 @@ CONFIG = {
     },
     'ai': {
         'enabled': os.getenv('AI_CLASSIFICATION_ENABLED', 'true').lower() == 'true',
-        'drain3_enabled': os.getenv('DRAIN3_ENABLED', 'true').lower() == 'true'
+        'drain3_enabled': os.getenv('DRAIN3_ENABLED', 'true').lower() == 'true',
+        # Template mining runs in shard processes; 0 leaves one core to the API
+        'drain3_shards': int(os.getenv('DRAIN3_SHARDS', 0)),
+        'drain3_shard_tokens': int(os.getenv('DRAIN3_SHARD_TOKENS', 2)),
+        'drain3_cache_size': int(os.getenv('DRAIN3_CACHE_SIZE', 50000)),
+        'drain3_queue_size': int(os.getenv('DRAIN3_QUEUE_SIZE', 10000)),
+        # Seconds a line waits for its shard before it is written with pattern id 0
+        'drain3_pending_timeout': float(os.getenv('DRAIN3_PENDING_TIMEOUT', 30)),
+        # One snapshot file per shard; empty disables persistence
+        'drain3_snapshot_dir': os.getenv('DRAIN3_SNAPSHOT_DIR', os.path.join(
+            os.path.dirname(os.path.abspath(__file__)), 'data', 'drain3')),
+        # log_classification.patterns drive classify_log_message; edits are picked up live
+        'config_path': os.getenv('AI_CONFIG_PATH', os.path.join(
+            os.path.dirname(os.path.abspath(__file__)), '..', 'config', 'ai_config.json')),
+        'config_reload_sec': float(os.getenv('AI_CONFIG_RELOAD_SEC', 5))
     },
     'alerts': {
         'enabled': os.getenv('ALERTS_ENABLED', 'true').lower() == 'true'
+    },
+    'log_writer': {
+        'batch_size': int(os.getenv('LOG_WRITE_BATCH_SIZE', 1000)),
+        'queue_size': int(os.getenv('LOG_WRITE_QUEUE_SIZE', 50000)),
+        'template_flush_sec': int(os.getenv('TEMPLATE_FLUSH_SEC', 30)),
+        # 'template' stores template hash + parameters instead of the message text
+        'storage_mode': os.getenv('LOG_STORAGE_MODE', 'raw')
     }
 }
 
+# Templates whose rows are rebuilt to search for a term spanning literal text and a parameter
+SPANNING_SEARCH_TEMPLATES = 1000
+
+# Columns of logs rows written by the log writer
+LOG_COLUMNS = (
+    'timestamp', 'level', 'source', 'host', 'service', 'message',
+    'raw_message', 'classification', 'ai_confidence', 'log_pattern_id',
+    'message_template', 'message_params'
+)
+
 def init_clickhouse():
     """Initialize ClickHouse connection with retry"""
     global clickhouse_client
@@ -130,6 +178,40 @@ def init_clickhouse():
                 logger.error("Failed to connect to ClickHouse after all retries")
                 return False
 
+def init_log_templates():
+    """Template catalog table and the log_pattern_id column on logs"""
+    try:
+        clickhouse_client.execute("""
+            CREATE TABLE IF NOT EXISTS log_templates (
+                template_id UInt64,
+                template SimpleAggregateFunction(anyLast, String),
+                first_seen SimpleAggregateFunction(min, DateTime),
+                last_seen SimpleAggregateFunction(max, DateTime),
+                count SimpleAggregateFunction(sum, UInt64)
+            ) ENGINE = AggregatingMergeTree()
+            ORDER BY template_id
+        """)
+        # Exact template texts of template-encoded rows, keyed by their hash
+        clickhouse_client.execute("""
+            CREATE TABLE IF NOT EXISTS log_template_texts (
+                template_hash UInt64,
+                template String
+            ) ENGINE = ReplacingMergeTree()
+            ORDER BY template_hash
+        """)
+        clickhouse_client.execute("ALTER TABLE logs ADD COLUMN IF NOT EXISTS log_pattern_id UInt64 DEFAULT 0")
+        clickhouse_client.execute("ALTER TABLE logs ADD COLUMN IF NOT EXISTS message_template UInt64 DEFAULT 0")
+        clickhouse_client.execute(
+            "ALTER TABLE logs ADD COLUMN IF NOT EXISTS message_params Array(String) CODEC(ZSTD(3))"
+        )
+        clickhouse_client.execute(
+            "ALTER TABLE logs ADD INDEX IF NOT EXISTS idx_log_pattern_id log_pattern_id TYPE bloom_filter GRANULARITY 4"
+        )
+        return True
+    except Exception as e:
+        logger.error(f"Failed to initialize log templates: {e}")
+        return False
+
 def init_ai_processing():
     """Initialize AI log processing with Drain3"""
     global template_miner
@@ -137,18 +219,439 @@ def init_ai_processing():
         return False
     
     try:
-        # Simple Drain3 config without loading from JSON
-        config = TemplateMinerConfig()
-        config.profiling_enabled = False
-        config.snapshot_interval_sec = 30
-        config.snapshot_compress = True
-        template_miner = TemplateMiner(config=config)
-        logger.info("AI log processing initialized with Drain3")
+        shards = CONFIG['ai']['drain3_shards'] or max(1, (os.cpu_count() or 2) - 1)
+        drain3_settings = load_drain3_settings(CONFIG['ai']['config_path'])
+        template_miner = ShardedTemplateMiner(
+            shards=shards,
+            shard_tokens=CONFIG['ai']['drain3_shard_tokens'],
+            cache_size=CONFIG['ai']['drain3_cache_size'],
+            queue_size=CONFIG['ai']['drain3_queue_size'],
+            pending_timeout=CONFIG['ai']['drain3_pending_timeout'],
+            snapshot_dir=CONFIG['ai']['drain3_snapshot_dir'] or None,
+            snapshot_interval=drain3_settings.get('snapshot_interval_sec', 30),
+            max_clusters=drain3_settings.get('max_clusters'),
+            drain3_settings=drain3_settings
+        )
+        template_miner.start()
+        logger.info(f"AI log processing initialized with Drain3 in {shards} shard processes")
         return True
     except Exception as e:
         logger.error(f"Failed to initialize AI processing: {e}")
         return False
 
+def load_drain3_settings(config_path: str) -> Dict[str, Any]:
+    """drain3_config section of ai_config.json, empty when unavailable"""
+    try:
+        with open(config_path, 'r') as f:
+            return json.load(f).get('drain3_config', {})
+    except (OSError, json.JSONDecodeError) as e:
+        logger.warning(f"Drain3 settings not loaded from {config_path}: {e}")
+        return {}
+
+# drain3_config keys in ai_config.json -> TemplateMinerConfig attributes
+DRAIN3_OPTIONS = {
+    'sim_th': 'drain_sim_th',
+    'depth': 'drain_depth',
+    'max_children': 'drain_max_children',
+    'extra_delimiters': 'drain_extra_delimiters',
+    'parametrize_numeric_tokens': 'parametrize_numeric_tokens',
+    'mask_prefix': 'mask_prefix',
+    'mask_suffix': 'mask_suffix',
+}
+
+def create_template_miner(drain3_settings: Optional[Dict[str, Any]] = None, max_clusters: Optional[int] = None):
+    """Drain3 miner built from the drain3_config section
+    
+    Snapshots are taken by the shard, not on every cluster change, so
+    profiling and persistence stay off whatever the section says.
+    """
+    drain3_settings = drain3_settings or {}
+    config = TemplateMinerConfig()
+    for key, attribute in DRAIN3_OPTIONS.items():
+        if key in drain3_settings:
+            setattr(config, attribute, drain3_settings[key])
+    # Same entries as the [MASKING] list of a drain3.ini
+    config.masking_instructions = [MaskingInstruction(instruction['regex_pattern'], instruction['mask_with'])
+                                   for instruction in drain3_settings.get('masking', [])]
+    config.profiling_enabled = False
+    # Past max_clusters the least recently used cluster is evicted
+    config.drain_max_clusters = max_clusters
+    return TemplateMiner(config=config)
+
+class AtomicFilePersistence(PersistenceHandler):
+    """Drain3 persistence handler: zlib-compressed snapshots replaced atomically
+    
+    The snapshot is written to a temporary file in the same directory, synced
+    and renamed over the previous one, so a crash never leaves a torn file.
+    """
+    
+    def __init__(self, file_path: str, compress_level: int = 3):
+        self.file_path = file_path
+        self.compress_level = compress_level
+    
+    def save_state(self, state: bytes):
+        os.makedirs(os.path.dirname(self.file_path) or '.', exist_ok=True)
+        tmp_path = f"{self.file_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(zlib.compress(state, self.compress_level))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.file_path)
+    
+    def load_state(self) -> Optional[bytes]:
+        if not os.path.exists(self.file_path):
+            return None
+        with open(self.file_path, 'rb') as f:
+            return zlib.decompress(f.read())
+
+SNAPSHOT_VERSION = 1
+# Pattern ids of one shard layout stay below 2**40; higher bits hold its epoch
+ID_EPOCH_BITS = 40
+
+def save_template_shard(miner, persistence: AtomicFilePersistence, shard: int, shards: int):
+    """Snapshot the Drain3 tree and clusters of one shard"""
+    drain = miner.drain
+    state = {
+        'version': SNAPSHOT_VERSION,
+        'shard': shard,
+        'shards': shards,
+        # Plain dict; the LRU cache is rebuilt with the configured size on restore
+        'clusters': dict(drain.id_to_cluster.items()),
+        'clusters_counter': drain.clusters_counter,
+        'root_node': drain.root_node
+    }
+    persistence.save_state(pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL))
+
+def restore_template_shard(miner, persistence: AtomicFilePersistence, shard: int, shards: int,
+                           max_clusters: Optional[int]) -> int:
+    """Load a shard snapshot written by this service; returns clusters restored"""
+    try:
+        state = persistence.load_state()
+        if state is None:
+            return 0
+        state = pickle.loads(state)
+    except Exception as e:
+        logger.error(f"Template shard {shard} snapshot unreadable, starting empty: {e}")
+        return 0
+    if state.get('version') != SNAPSHOT_VERSION or state.get('shards') != shards:
+        logger.warning(f"Template shard {shard} snapshot is for another layout, starting empty")
+        return 0
+    
+    clusters = state['clusters']
+    if max_clusters:
+        # Drain3's own cache: get() on a miss returns None and does not touch the LRU order
+        cache = LogClusterCache(maxsize=max_clusters)
+        cache.update(clusters)
+        clusters = cache
+    drain = miner.drain
+    drain.id_to_cluster = clusters
+    drain.clusters_counter = state['clusters_counter']
+    drain.root_node = state['root_node']
+    return len(clusters)
+
+def template_id_epochs(snapshot_dir: Optional[str], shards: int) -> List[int]:
+    """Pattern id epoch of each shard of this layout, persisted in ``snapshot_dir``
+    
+    Shard snapshots only restore under the layout that wrote them, so a
+    shard without a snapshot of this layout restarts its cluster counter; it
+    gets a new epoch, which keeps its ids apart from the ones already stored
+    in logs and log_templates. A shard that restores keeps its epoch.
+    """
+    if not snapshot_dir:
+        return [0] * shards
+    persistence = AtomicFilePersistence(os.path.join(snapshot_dir, 'drain3-layout.bin'))
+    try:
+        saved = persistence.load_state()
+        saved = json.loads(saved) if saved is not None else None
+    except Exception as e:
+        logger.error(f"Template shard layouts unreadable: {e}")
+        saved = None
+    
+    if saved is None:
+        # Snapshots of another layout mean ids were handed out before the layout file existed
+        current = f'-of-{shards}.bin'
+        older = os.path.isdir(snapshot_dir) and any(
+            name.startswith('drain3-shard-') and not name.endswith(current) for name in os.listdir(snapshot_dir))
+        saved = {'version': SNAPSHOT_VERSION, 'epochs': {}, 'next_epoch': 1 if older else 0}
+    elif saved['version'] != SNAPSHOT_VERSION:
+        # Snapshots of another version do not restore; every layout starts over
+        saved['version'], saved['epochs'] = SNAPSHOT_VERSION, {}
+    
+    epochs = saved['epochs'].get(str(shards)) or [None] * shards
+    changed = False
+    for shard in range(shards):
+        snapshot = os.path.join(snapshot_dir, f'drain3-shard-{shard}-of-{shards}.bin')
+        if epochs[shard] is None or not os.path.exists(snapshot):
+            epochs[shard] = saved['next_epoch']
+            saved['next_epoch'] += 1
+            changed = True
+    if changed:
+        saved['epochs'][str(shards)] = epochs
+        persistence.save_state(json.dumps(saved).encode('utf-8'))
+        logger.info(f"Template shards of a {shards} shard layout use pattern id epochs {epochs}")
+    return epochs
+
+def template_shard_worker(shard: int, inbox, outbox, shards: int = 1, snapshot_dir: Optional[str] = None,
+                          snapshot_interval: float = 30, max_clusters: Optional[int] = None,
+                          drain3_settings: Optional[Dict[str, Any]] = None):
+    """Drain3 shard process: mines the messages routed to it, answers in batches
+    
+    The snapshot is restored here, in the shard's own process, so startup and
+    the request path never wait on it; messages queue in the inbox meanwhile.
+    """
+    miner = create_template_miner(drain3_settings, max_clusters)
+    persistence = None
+    if snapshot_dir:
+        persistence = AtomicFilePersistence(os.path.join(snapshot_dir, f'drain3-shard-{shard}-of-{shards}.bin'))
+        started = time.monotonic()
+        restored = restore_template_shard(miner, persistence, shard, shards, max_clusters)
+        if restored:
+            logger.info(f"Template shard {shard} restored {restored} clusters "
+                        f"in {time.monotonic() - started:.2f}s")
+    saved_at = time.monotonic()
+    unsaved = 0
+    
+    while True:
+        try:
+            message = inbox.get(timeout=snapshot_interval if persistence else None)
+            batch = [message]
+        except queue.Empty:
+            message, batch = None, []
+        # Drain whatever else is waiting so results travel back together
+        while batch and message is not None:
+            try:
+                message = inbox.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(message)
+        stopping = bool(batch) and batch[-1] is None
+        
+        results = []
+        for message in batch:
+            if message is None:
+                continue
+            try:
+                result = miner.add_log_message(message)
+                results.append((message, result['cluster_id'], result['template_mined']))
+            except Exception as e:
+                logger.error(f"Error in template shard {shard}: {e}")
+                results.append((message, None, None))
+        if results:
+            outbox.put((shard, results))
+            unsaved += len(results)
+        
+        if persistence and unsaved and (stopping or time.monotonic() - saved_at >= snapshot_interval):
+            try:
+                save_template_shard(miner, persistence, shard, shards)
+                unsaved = 0
+            except Exception as e:
+                logger.error(f"Error saving template shard {shard} snapshot: {e}")
+            saved_at = time.monotonic()
+        if stopping:
+            return
+
+class ShardedTemplateMiner:
+    """Drain3 template mining in worker processes, off the request path.
+    
+    Messages are routed by a stable hash of their token count and first
+    tokens (digits masked, as Drain3's prefix tree does), so each shard owns
+    the same sub-tree for its whole life. Cluster ids come back through a
+    collector thread that calls the submitter's callback; an LRU front cache
+    of exact message -> (pattern id, template) answers repeated lines without
+    leaving the process. Pattern ids are ``cluster_id * shards + shard`` so
+    they stay unique across shards; shards snapshot their clusters to
+    ``snapshot_dir`` so the ids also survive restarts with the same layout.
+    A shard that starts without a snapshot of its layout gets a new id epoch
+    (the bits above ``ID_EPOCH_BITS``) so its restarted cluster counter
+    never reuses an id.
+    Messages whose shard died, that waited longer than ``pending_timeout``
+    or that are still queued at ``stop`` are answered with pattern id 0, so
+    their rows are written rather than lost.
+    """
+    
+    def __init__(self, shards: int, shard_tokens: int = 2, cache_size: int = 50000,
+                 queue_size: int = 10000, snapshot_dir: Optional[str] = None,
+                 snapshot_interval: float = 30, max_clusters: Optional[int] = None,
+                 pending_timeout: float = 30, drain3_settings: Optional[Dict[str, Any]] = None):
+        self.shards = shards
+        self.drain3_settings = drain3_settings or {}
+        # Drain3 splits on these as well as whitespace; routing must see the same tokens
+        self.delimiters = self.drain3_settings.get('extra_delimiters', [])
+        self.snapshot_dir = snapshot_dir
+        self.snapshot_interval = snapshot_interval
+        self.max_clusters = max_clusters
+        self.shard_tokens = shard_tokens
+        self.cache_size = cache_size
+        self.queue_size = queue_size
+        self.pending_timeout = pending_timeout
+        self.cache: OrderedDict = OrderedDict()
+        # message -> (shard, submitted at, callbacks) until its shard answers
+        self.pending: Dict[str, Tuple[int, float, List[Callable]]] = {}
+        # pattern id -> [template, first seen, last seen, hits] since the last flush
+        self.catalog: Dict[int, list] = {}
+        self.lock = threading.Lock()
+        self.id_bases: List[int] = []
+        self.inboxes = []
+        self.processes = []
+        self.outbox = None
+        self.collector = None
+        self.stats = {'cache_hits': 0, 'submitted': 0, 'mined': 0, 'shed': 0, 'errors': 0, 'expired': 0}
+    
+    def start(self):
+        self.id_bases = [epoch << ID_EPOCH_BITS for epoch in template_id_epochs(self.snapshot_dir, self.shards)]
+        self.outbox = multiprocessing.Queue()
+        for shard in range(self.shards):
+            inbox = multiprocessing.Queue(maxsize=self.queue_size)
+            process = multiprocessing.Process(
+                target=template_shard_worker,
+                args=(shard, inbox, self.outbox, self.shards, self.snapshot_dir,
+                      self.snapshot_interval, self.max_clusters, self.drain3_settings),
+                name=f'drain3-shard-{shard}',
+                daemon=True
+            )
+            process.start()
+            self.inboxes.append(inbox)
+            self.processes.append(process)
+        self.collector = threading.Thread(target=self.collect, name='drain3-collector', daemon=True)
+        self.collector.start()
+    
+    def stop(self):
+        for inbox, process in zip(self.inboxes, self.processes):
+            if process.is_alive():
+                inbox.put(None)
+        for process in self.processes:
+            process.join(timeout=5)
+        self.outbox.put(None)
+        self.collector.join(timeout=5)
+    
+    def shard_of(self, message: str) -> int:
+        for delimiter in self.delimiters:
+            message = message.replace(delimiter, ' ')
+        tokens = message.split()
+        key = [str(len(tokens))]
+        for token in tokens[:self.shard_tokens]:
+            key.append('<*>' if any(c.isdigit() for c in token) else token)
+        return zlib.crc32(' '.join(key).encode('utf-8', errors='ignore')) % self.shards
+    
+    def lookup(self, message: str) -> Optional[Tuple[int, str]]:
+        """(pattern id, template) of a message already mined, from the front cache"""
+        with self.lock:
+            entry = self.cache.get(message)
+            if entry is not None:
+                self.cache.move_to_end(message)
+                self.stats['cache_hits'] += 1
+                self.record(entry, 1)
+            return entry
+    
+    def record(self, entry: Tuple[int, str], hits: int):
+        """Count hits of a template for the next catalog flush (lock held)"""
+        now = datetime.now(timezone.utc)
+        row = self.catalog.get(entry[0])
+        if row is None:
+            self.catalog[entry[0]] = [entry[1], now, now, hits]
+        else:
+            row[0] = entry[1]
+            row[2] = now
+            row[3] += hits
+    
+    def take_catalog(self) -> List[tuple]:
+        """(template_id, template, first_seen, last_seen, count) deltas since the last call"""
+        with self.lock:
+            catalog, self.catalog = self.catalog, {}
+        return [(pattern_id, *row) for pattern_id, row in catalog.items()]
+    
+    def submit(self, message: str, callback: Callable[[int, str], None]) -> bool:
+        """Queue a message for its shard; ``callback(pattern_id, template)`` runs on the result
+        
+        Never blocks: when the shard's queue is full the message is shed.
+        """
+        shard = self.shard_of(message)
+        if not self.processes[shard].is_alive():
+            with self.lock:
+                self.stats['shed'] += 1
+            return False
+        with self.lock:
+            waiting = self.pending.get(message)
+            if waiting is not None:
+                waiting[2].append(callback)
+                return True
+            self.pending[message] = (shard, time.monotonic(), [callback])
+            self.stats['submitted'] += 1
+        try:
+            self.inboxes[shard].put_nowait(message)
+        except queue.Full:
+            with self.lock:
+                self.pending.pop(message, None)
+                self.stats['submitted'] -= 1
+                self.stats['shed'] += 1
+            return False
+        return True
+    
+    @staticmethod
+    def answer(callbacks: List[Callable], entry: Tuple[int, Optional[str]]):
+        for callback in callbacks:
+            try:
+                callback(*entry)
+            except Exception as e:
+                logger.error(f"Error annotating log with template: {e}")
+    
+    def expire(self, release_all: bool = False):
+        """Answer pending messages of dead shards or past ``pending_timeout`` with id 0"""
+        now = time.monotonic()
+        alive = [process.is_alive() for process in self.processes]
+        with self.lock:
+            expired = [message for message, (shard, submitted, _) in self.pending.items()
+                       if release_all or not alive[shard] or now - submitted >= self.pending_timeout]
+            waiting = [self.pending.pop(message)[2] for message in expired]
+            self.stats['expired'] += len(expired)
+        for callbacks in waiting:
+            self.answer(callbacks, (0, None))
+    
+    def collect(self):
+        """Collector thread: fill the front cache and hand results to the callbacks"""
+        swept_at = time.monotonic()
+        while True:
+            if time.monotonic() - swept_at >= 1:
+                swept_at = time.monotonic()
+                self.expire()
+            try:
+                item = self.outbox.get(timeout=1)
+            except queue.Empty:
+                continue
+            if item is None:
+                self.expire(release_all=True)
+                return
+            shard, results = item
+            for message, cluster_id, template in results:
+                with self.lock:
+                    callbacks = self.pending.pop(message, (shard, 0.0, []))[2]
+                    if cluster_id is None:
+                        # Rows are still written, just without a pattern id
+                        self.stats['errors'] += 1
+                        entry = (0, None)
+                    else:
+                        entry = (self.id_bases[shard] + cluster_id * self.shards + shard, template)
+                        self.cache[message] = entry
+                        if len(self.cache) > self.cache_size:
+                            self.cache.popitem(last=False)
+                        self.record(entry, max(1, len(callbacks)))
+                        self.stats['mined'] += 1
+                self.answer(callbacks, entry)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'shards': self.shards,
+            'snapshot_dir': self.snapshot_dir,
+            'max_clusters': self.max_clusters,
+            'id_epochs': [base >> ID_EPOCH_BITS for base in self.id_bases],
+            'alive_shards': sum(1 for process in self.processes if process.is_alive()),
+            'cache_entries': len(self.cache),
+            'catalog_pending': len(self.catalog),
+            'pending': len(self.pending),
+            'pending_timeout': self.pending_timeout,
+            **self.stats
+        }
+
 def collect_system_metrics():
     """Collect system metrics using psutil"""
     try:
@@ -265,8 +768,15 @@ def check_metric_thresholds(hostname: str, cpu: float, memory: float, disk: floa
             except Exception as e:
                 logger.error(f"Error inserting alert: {e}")
 
-def process_log_message(message: str, source: str, host: str = None) -> Dict[str, Any]:
-    """Process log message with AI classification"""
+def process_log_message(message: str, source: str, host: str = None,
+                        on_pattern: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+    """Process log message with AI classification
+    
+    ``log_pattern_id`` is set right away for lines seen before; otherwise the
+    template shard answers later. ``on_pattern(row)`` is called exactly once,
+    with the final id (0 if mining was unavailable); a late answer goes into
+    a copy, so the returned dict never changes after this returns.
+    """
     processed = {
         'timestamp': datetime.now(timezone.utc),
         'level': 'info',
@@ -276,38 +786,153 @@ def process_log_message(message: str, source: str, host: str = None) -> Dict[str
         'message': message,
         'raw_message': message,
         'classification': 'unknown',
-        'ai_confidence': 0.0
+        'ai_confidence': 0.0,
+        'log_pattern_id': 0,
+        'log_template': None
     }
+    pending = False
     
-    # AI processing with Drain3
+    # AI processing with Drain3; mining happens in the shard processes
     if template_miner and CONFIG['ai']['enabled']:
         try:
-            result = template_miner.add_log_message(message)
-            if result:
-                processed['log_pattern_id'] = result['cluster_id']
-                processed['classification'] = classify_log_message(message)
-                processed['ai_confidence'] = 0.8  # Placeholder confidence
+            processed['classification'] = classify_log_message(message)
+            processed['ai_confidence'] = 0.8  # Placeholder confidence
+            cached = template_miner.lookup(message)
+            if cached:
+                processed['log_pattern_id'], processed['log_template'] = cached
+            else:
+                def annotate(pattern_id, template):
+                    if on_pattern:
+                        on_pattern(dict(processed, log_pattern_id=pattern_id, log_template=template))
+                pending = template_miner.submit(message, annotate)
         except Exception as e:
             logger.error(f"Error in AI log processing: {e}")
     
+    if on_pattern and not pending:
+        on_pattern(processed)
     return processed
 
 def classify_log_message(message: str) -> str:
-    """Simple log classification based on keywords"""
-    message_lower = message.lower()
-    
-    if any(word in message_lower for word in ['error', 'exception', 'failed', 'failure']):
-        return 'error'
-    elif any(word in message_lower for word in ['warning', 'warn']):
-        return 'warning'
-    elif any(word in message_lower for word in ['login', 'logout', 'auth', 'sudo']):
-        return 'security'
-    elif any(word in message_lower for word in ['network', 'connection', 'tcp', 'udp']):
-        return 'network'
-    elif any(word in message_lower for word in ['system', 'kernel', 'hardware']):
-        return 'system'
-    else:
-        return 'application'
+    """Log classification based on the configured category keywords"""
+    return log_classifier.classify(message)
+
+log_classifier = LogClassifier(CONFIG['ai']['config_path'], CONFIG['ai']['config_reload_sec'])
+
+# Rows handed to the log writer, and rows dropped because its queue was full
+log_writer_stats = {'queued': 0, 'dropped': 0}
+log_writer_stats_lock = threading.Lock()
+
+def queue_log_row(processed: Dict[str, Any]):
+    """Hand a processed log to the log writer without blocking
+    
+    Called from the syslog loop, the ingest endpoint and the template
+    collector, none of which may wait on ClickHouse: when the writer is
+    behind and its queue is full the row is dropped and counted.
+    """
+    if log_write_queue is None:
+        return
+    try:
+        log_write_queue.put_nowait(processed)
+        counter = 'queued'
+    except queue.Full:
+        counter = 'dropped'
+    with log_writer_stats_lock:
+        log_writer_stats[counter] += 1
+
+template_codec = TemplateCodec()
+
+def log_values(processed: Dict[str, Any]) -> tuple:
+    """logs row in LOG_COLUMNS order; template storage blanks the text columns"""
+    row = dict(processed, message_template=0, message_params=[])
+    if CONFIG['log_writer']['storage_mode'] == 'template' and row['raw_message'] == row['message']:
+        encoded = template_codec.encode(row['log_template'], row['message'])
+        if encoded:
+            row['message_template'], row['message_params'] = encoded
+            row['message'] = row['raw_message'] = ''
+    return tuple(row[column] for column in LOG_COLUMNS)
+
+def insert_logs(client, rows: List[Dict[str, Any]]):
+    values = [log_values(row) for row in rows]
+    # Template texts go first so no reader sees a row it cannot rebuild
+    templates = template_codec.take_unsaved()
+    if templates:
+        try:
+            client.execute("INSERT INTO log_template_texts (template_hash, template) VALUES", templates)
+        except Exception:
+            template_codec.restore_unsaved(templates)
+            raise
+    client.execute(f"INSERT INTO logs ({', '.join(LOG_COLUMNS)}) VALUES", values)
+
+def fetch_logs(client, query: str, params: Dict[str, Any]) -> List[list]:
+    """Run a SELECT * over logs, rebuilding template-encoded messages"""
+    rows, columns = client.execute(query, params, with_column_types=True)
+    names = [name for name, _ in columns]
+    if 'message_template' not in names:
+        return rows
+    key_at, params_at = names.index('message_template'), names.index('message_params')
+    text_at = [names.index(name) for name in ('message', 'raw_message') if name in names]
+    
+    missing = template_codec.missing(row[key_at] for row in rows)
+    if missing:
+        template_codec.load(client.execute(
+            "SELECT template_hash, any(template) FROM log_template_texts "
+            "WHERE template_hash IN %(keys)s GROUP BY template_hash",
+            {'keys': missing}
+        ))
+    
+    result = []
+    for row in rows:
+        row = list(row)
+        if row[key_at]:
+            message = template_codec.decode(row[key_at], row[params_at])
+            if message is not None:
+                for i in text_at:
+                    row[i] = message
+        result.append(row)
+    return result
+
+def flush_log_templates(client):
+    """Write template hit deltas; log_templates aggregates them per template id"""
+    rows = template_miner.take_catalog() if template_miner else []
+    if rows:
+        client.execute(
+            "INSERT INTO log_templates (template_id, template, first_seen, last_seen, count) VALUES",
+            rows
+        )
+
+def log_writer():
+    """Batched INSERTs of processed logs plus periodic template catalog flushes"""
+    batch_size = CONFIG['log_writer']['batch_size']
+    flush_interval = CONFIG['log_writer']['template_flush_sec']
+    flushed_at = time.monotonic()
+    client = None
+    
+    while True:
+        batch = []
+        try:
+            batch.append(log_write_queue.get(timeout=1))
+            while len(batch) < batch_size and batch[-1] is not None:
+                batch.append(log_write_queue.get_nowait())
+        except queue.Empty:
+            pass
+        # None is the shutdown marker: write what came before it and stop
+        stopping = bool(batch) and batch[-1] is None
+        if stopping:
+            batch.pop()
+        
+        try:
+            if client is None:
+                client = get_clickhouse_client()
+            if batch:
+                insert_logs(client, batch)
+            if stopping or time.monotonic() - flushed_at >= flush_interval:
+                flushed_at = time.monotonic()
+                flush_log_templates(client)
+        except Exception as e:
+            logger.error(f"Error inserting {len(batch)} logs to ClickHouse: {e}")
+            client = None
+        if stopping:
+            return
 
 def syslog_server():
     """Simple syslog server"""
@@ -323,23 +948,8 @@ def syslog_server():
             data, addr = sock.recvfrom(1024)
             message = data.decode('utf-8', errors='ignore')
             
-            # Process the syslog message
-            processed = process_log_message(message, 'syslog', addr[0])
-            
-            # Insert to ClickHouse
-            if clickhouse_client:
-                try:
-                    clickhouse_client.execute("""
-                        INSERT INTO logs 
-                        (timestamp, level, source, host, service, message, raw_message, classification, ai_confidence) 
-                        VALUES
-                    """, [(
-                        processed['timestamp'], processed['level'], processed['source'],
-                        processed['host'], processed['service'], processed['message'],
-                        processed['raw_message'], processed['classification'], processed['ai_confidence']
-                    )])
-                except Exception as e:
-                    logger.error(f"Error inserting log to ClickHouse: {e}")
+            # Process the syslog message; it is written once its template is known
+            process_log_message(message, 'syslog', addr[0], on_pattern=queue_log_row)
                     
     except Exception as e:
         logger.error(f"Syslog server error: {e}")
@@ -394,6 +1004,126 @@ def api_health():
     """Health check endpoint for API"""
     return jsonify({'status': 'ok', 'timestamp': datetime.now(timezone.utc).isoformat()})
 
+@app.route('/api/ai/templates/status')
+def get_template_mining_status():
+    """Template mining shard and front cache counters"""
+    with log_writer_stats_lock:
+        writer = dict(log_writer_stats, backlog=log_write_queue.qsize() if log_write_queue is not None else 0)
+    if template_miner is None:
+        return jsonify({'enabled': False, 'log_writer': writer})
+    return jsonify({
+        'enabled': True,
+        **template_miner.get_stats(),
+        'storage': {'mode': CONFIG['log_writer']['storage_mode'], **template_codec.get_stats()},
+        'log_writer': writer
+    })
+
+@app.route('/api/ai/classification/status')
+def get_classification_status():
+    """Keyword classifier categories, automaton size and reload count"""
+    return jsonify(log_classifier.get_stats())
+
+@app.route('/api/templates/top')
+def get_top_templates():
+    """Most frequent log templates in the last N hours, counted on log_pattern_id"""
+    try:
+        hours = int(request.args.get('hours', 24))
+        limit = min(int(request.args.get('limit', 20)), 1000)
+        
+        client = get_clickhouse_client()
+        result = client.execute("""
+            SELECT l.log_pattern_id, l.hits, t.template
+            FROM (
+                SELECT log_pattern_id, count() AS hits
+                FROM logs
+                WHERE timestamp >= now() - toIntervalHour(%(hours)s) AND log_pattern_id != 0
+                GROUP BY log_pattern_id
+                ORDER BY hits DESC
+                LIMIT %(limit)s
+            ) AS l
+            LEFT JOIN (
+                SELECT template_id, anyLast(template) AS template
+                FROM log_templates
+                GROUP BY template_id
+            ) AS t ON l.log_pattern_id = t.template_id
+            ORDER BY l.hits DESC
+        """, {'hours': hours, 'limit': limit})
+        
+        return jsonify({
+            'templates': [
+                {'template_id': template_id, 'count': hits, 'template': template}
+                for template_id, hits, template in result
+            ],
+            'hours': hours
+        })
+        
+    except Exception as e:
+        logger.error(f"Error fetching top templates: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/templates/new')
+def get_new_templates():
+    """Templates first seen since ``since`` (ISO timestamp, default the last hour)"""
+    try:
+        since = request.args.get('since')
+        since = datetime.fromisoformat(since) if since else datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(hours=1)
+        limit = min(int(request.args.get('limit', 100)), 1000)
+    except ValueError as e:
+        return jsonify({'error': f'Invalid parameter: {e}'}), 400
+    
+    try:
+        client = get_clickhouse_client()
+        result = client.execute("""
+            SELECT template_id, anyLast(template) AS template, min(first_seen) AS first,
+                   max(last_seen) AS last, sum(count) AS total
+            FROM log_templates
+            GROUP BY template_id
+            HAVING first >= %(since)s
+            ORDER BY first DESC
+            LIMIT %(limit)s
+        """, {'since': since, 'limit': limit})
+        
+        return jsonify({
+            'templates': [
+                {'template_id': template_id, 'template': template, 'first_seen': first.isoformat(),
+                 'last_seen': last.isoformat(), 'count': total}
+                for template_id, template, first, last, total in result
+            ],
+            'since': since.isoformat()
+        })
+        
+    except Exception as e:
+        logger.error(f"Error fetching new templates: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/templates/<int:template_id>/logs')
+def get_template_logs(template_id: int):
+    """Logs of one template, newest first"""
+    try:
+        hours = int(request.args.get('hours', 24))
+        limit = min(int(request.args.get('limit', 100)), 1000)
+        offset = int(request.args.get('offset', 0))
+        
+        client = get_clickhouse_client()
+        result = fetch_logs(client, """
+            SELECT * FROM logs
+            WHERE log_pattern_id = %(template_id)s AND timestamp >= now() - toIntervalHour(%(hours)s)
+            ORDER BY timestamp DESC
+            LIMIT %(limit)s OFFSET %(offset)s
+        """, {'template_id': template_id, 'hours': hours, 'limit': limit, 'offset': offset})
+        
+        return jsonify({
+            'template_id': template_id,
+            'logs': result,
+            'total': len(result),
+            'limit': limit,
+            'offset': offset
+        })
+        
+    except Exception as e:
+        logger.error(f"Error fetching logs for template {template_id}: {e}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/logs')
 def get_logs():
     """Get logs with filtering and pagination"""
@@ -403,27 +1133,62 @@ def get_logs():
         level = request.args.get('level')
         host = request.args.get('host')
         source = request.args.get('source')
-        
-        query = "SELECT * FROM logs WHERE 1=1"
-        params = []
-        
-        if level:
-            query += " AND level = %s"
-            params.append(level)
-        if host:
-            query += " AND host = %s"
-            params.append(host)
-        if source:
-            query += " AND source = %s"
-            params.append(source)
-            
-        query += " ORDER BY timestamp DESC LIMIT %s OFFSET %s"
-        params.extend([limit, offset])
+        search = request.args.get('search')
         
         # Use new client for each request
         client = get_clickhouse_client()
         if client:
-            result = client.execute(query, params)
+            query = "SELECT * FROM logs WHERE 1=1"
+            params = {'limit': limit, 'offset': offset}
+            
+            if level:
+                query += " AND level = %(level)s"
+                params['level'] = level
+            if host:
+                query += " AND host = %(host)s"
+                params['host'] = host
+            if source:
+                query += " AND source = %(source)s"
+                params['source'] = source
+            if search:
+                # Raw text, then template texts, then template parameters
+                params['search'] = search
+                clauses = ["positionCaseInsensitive(message, %(search)s) > 0"]
+                templates = client.execute(
+                    "SELECT DISTINCT template_hash FROM log_template_texts "
+                    "WHERE positionCaseInsensitive(template, %(search)s) > 0",
+                    {'search': search}
+                )
+                if templates:
+                    clauses.append("message_template IN %(templates)s")
+                    params['templates'] = [key for key, in templates]
+                clauses.append("arrayExists(p -> positionCaseInsensitive(p, %(search)s) > 0, message_params)")
+                # A term running across a literal and a parameter is in neither; templates
+                # with a literal piece of it next to a wildcard get their rows rebuilt
+                spanning = client.execute(
+                    "SELECT template_hash, any(template) FROM log_template_texts "
+                    "WHERE arrayExists(p -> positionCaseInsensitive(template, concat(p, '<*>')) > 0, %(heads)s) "
+                    "OR arrayExists(s -> positionCaseInsensitive(template, concat('<*>', s)) > 0, %(tails)s) "
+                    "OR arrayExists(l -> l != '' AND positionCaseInsensitive(%(search)s, l) > 0, "
+                    "arraySlice(splitByString('<*>', template), 2, -1)) "
+                    "GROUP BY template_hash LIMIT %(max_templates)s",
+                    {'search': search, 'max_templates': SPANNING_SEARCH_TEMPLATES,
+                     'heads': [search[:i] for i in range(1, len(search))],
+                     'tails': [search[i:] for i in range(1, len(search))]}
+                ) if len(search) > 1 else []
+                if spanning:
+                    params['spanning_keys'] = [key for key, _ in spanning]
+                    params['spanning_texts'] = [template for _, template in spanning]
+                    clauses.append(
+                        "(message_template IN %(spanning_keys)s AND positionCaseInsensitive(arrayStringConcat("
+                        "arrayMap((l, p) -> concat(l, p), (splitByString('<*>', transform(message_template, "
+                        "%(spanning_keys)s, %(spanning_texts)s, '')) AS literals), "
+                        "arrayResize(message_params, length(literals), ''))), %(search)s) > 0)"
+                    )
+                query += f" AND ({' OR '.join(clauses)})"
+                
+            query += " ORDER BY timestamp DESC LIMIT %(limit)s OFFSET %(offset)s"
+            result = fetch_logs(client, query, params)
             return jsonify({
                 'logs': result,
                 'total': len(result),
@@ -542,25 +1307,14 @@ def ingest_log():
         if not data or 'message' not in data:
             return jsonify({'error': 'Message field required'}), 400
             
+        # Insert to ClickHouse through the log writer once the template is known
         processed = process_log_message(
             data['message'],
             data.get('source', 'api'),
-            data.get('host')
+            data.get('host'),
+            on_pattern=queue_log_row
         )
         
-        # Insert to ClickHouse using new client
-        client = get_clickhouse_client()
-        if client:
-            client.execute("""
-                INSERT INTO logs 
-                (timestamp, level, source, host, service, message, raw_message, classification, ai_confidence) 
-                VALUES
-            """, [(
-                processed['timestamp'], processed['level'], processed['source'],
-                processed['host'], processed['service'], processed['message'],
-                processed['raw_message'], processed['classification'], processed['ai_confidence']
-            )])
-        
         return jsonify({'status': 'success', 'processed': processed})
         
     except Exception as e:
@@ -574,18 +1328,27 @@ def ingest_log_simple():
 
 def initialize_services():
     """Initialize all services"""
-    global metrics_thread, syslog_thread
+    global metrics_thread, syslog_thread, log_writer_thread, log_write_queue
     
     logger.info("Starting MARSLOG services...")
     
     # Initialize ClickHouse
     if not init_clickhouse():
         logger.warning("ClickHouse initialization failed")
+    elif not init_log_templates():
+        logger.warning("Log template catalog initialization failed")
     
     # Initialize AI processing
     if not init_ai_processing():
         logger.warning("AI processing initialization failed")
     
+    # Start the batched log writer in background
+    if clickhouse_client:
+        log_write_queue = queue.Queue(maxsize=CONFIG['log_writer']['queue_size'])
+        log_writer_thread = threading.Thread(target=log_writer, daemon=True)
+        log_writer_thread.start()
+        logger.info("Log writer started")
+    
     # Start metrics collection in background
     if CONFIG['metrics']['enabled']:
         metrics_thread = threading.Thread(target=metrics_collector, daemon=True)
@@ -597,6 +1360,16 @@ def initialize_services():
         syslog_thread = threading.Thread(target=syslog_server, daemon=True)
         syslog_thread.start()
         logger.info("Syslog server started")
+    
+    atexit.register(shutdown_services)
+
+def shutdown_services():
+    """Answer lines still waiting on template shards, then let the log writer drain"""
+    if template_miner:
+        template_miner.stop()
+    if log_writer_thread is not None:
+        log_write_queue.put(None)
+        log_writer_thread.join(timeout=10)
 
 if __name__ == '__main__':
     # Initialize services
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Benchmark script for the MARSLOG log classifier
+Compares the keyword automaton against per-category substring scans as the
+keyword list grows, and checks both agree on every message
+
+Usage:
+    bench_classifier.py [messages] [max_keywords]
+"""
+
+import sys
+import time
+import random
+import string
+
+from log_classifier import KeywordAutomaton, NO_MATCH
+
+CATEGORIES = ['error', 'warning', 'security', 'network', 'system']
+TEMPLATES = [
+    'sshd[{n}]: Accepted password for admin from 10.0.{n}.4 port 51022 ssh2',
+    'kernel: [{n}.123] eth0: link up, 1000Mbps full duplex',
+    'GET /api/v1/items/{n} HTTP/1.1 200 512 "Mozilla/5.0"',
+    'app[{n}]: request completed in {n}ms user_id={n} status=ok',
+    'postgres[{n}]: duration: {n}.12 ms statement: SELECT * FROM orders WHERE id = {n}',
+    'cron[{n}]: (root) CMD (/usr/local/bin/backup.sh --incremental)',
+]
+
+
+def synthetic_keywords(count: int, rng: random.Random) -> dict:
+    """``count`` random lowercase keywords spread over the categories"""
+    keywords = {}
+    while len(keywords) < count:
+        word = ''.join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(4, 10)))
+        keywords.setdefault(word, rng.randrange(len(CATEGORIES)))
+    return keywords
+
+
+def synthetic_messages(count: int, keywords: dict, rng: random.Random) -> list:
+    """Mostly keyword-free lines with a keyword planted in one of four"""
+    words = list(keywords)
+    messages = []
+    for n in range(count):
+        message = rng.choice(TEMPLATES).format(n=n)
+        if n % 4 == 0:
+            message = f"{message} {rng.choice(words)}"
+        messages.append(message.lower())
+    return messages
+
+
+def scan_rank(message: str, by_category: list) -> int:
+    """Reference: one any(substring) scan per category, in priority order"""
+    for rank, words in enumerate(by_category):
+        if any(word in message for word in words):
+            return rank
+    return NO_MATCH
+
+
+def timed(fn, messages: list) -> tuple:
+    start = time.perf_counter()
+    ranks = [fn(message) for message in messages]
+    elapsed = time.perf_counter() - start
+    return ranks, elapsed / len(messages) * 1e6
+
+
+def main():
+    message_count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    max_keywords = int(sys.argv[2]) if len(sys.argv) > 2 else 4000
+    rng = random.Random(42)
+
+    print("⏱️  Log classifier benchmark")
+    print("=" * 60)
+    print(f"Messages: {message_count}")
+    print()
+    print(f"{'keywords':>10}{'states':>10}{'build ms':>10}{'scan us':>10}{'automaton us':>14}")
+
+    sizes = [size for size in (30, 250, 1000, 2000, 4000, 8000) if size <= max_keywords]
+    for size in sizes:
+        keywords = synthetic_keywords(size, rng)
+        messages = synthetic_messages(message_count, keywords, rng)
+        by_category = [[w for w, rank in keywords.items() if rank == i] for i in range(len(CATEGORIES))]
+
+        start = time.perf_counter()
+        automaton = KeywordAutomaton(keywords)
+        build_ms = (time.perf_counter() - start) * 1000
+
+        expected, scan_us = timed(lambda m: scan_rank(m, by_category), messages)
+        got, automaton_us = timed(automaton.best_rank, messages)
+        if got != expected:
+            mismatches = sum(1 for a, b in zip(got, expected) if a != b)
+            print(f"❌ {mismatches} messages classified differently at {size} keywords")
+            sys.exit(1)
+
+        print(f"{size:>10}{len(automaton):>10}{build_ms:>10.1f}{scan_us:>10.2f}{automaton_us:>14.2f}")
+
+    print()
+    print("✅ Automaton and substring scans agree on every message")
+
+
+if __name__ == "__main__":
+    main()
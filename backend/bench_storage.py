@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+Benchmark script for MARSLOG template log storage
+Compares raw message columns with template hash + parameter columns on a
+synthetic syslog dataset: compressed size, search speed and exact round trips
+
+Usage:
+    bench_storage.py [lines]                  offline (zlib stands in for column codecs)
+    bench_storage.py clickhouse [lines]       real tables in the configured ClickHouse
+"""
+
+import os
+import sys
+import time
+import zlib
+import random
+import struct
+
+from drain3 import TemplateMiner
+from drain3.template_miner_config import TemplateMinerConfig
+
+from log_compression import TemplateCodec
+
+SEARCHES = ['failed password', 'user17', '10.0.3.', 'disk', 'timeout']
+
+USERS = [f'user{n}' for n in range(200)]
+SERVICES = ['nginx', 'sshd', 'cron', 'postgres', 'kernel', 'app']
+TEMPLATES = [
+    lambda r: f"sshd[{r.randint(100, 99999)}]: Failed password for {r.choice(USERS)} from 10.0.{r.randint(0, 9)}.{r.randint(1, 254)} port {r.randint(1024, 65535)} ssh2",
+    lambda r: f"sshd[{r.randint(100, 99999)}]: Accepted publickey for {r.choice(USERS)} from 10.0.{r.randint(0, 9)}.{r.randint(1, 254)} port {r.randint(1024, 65535)}",
+    lambda r: f"nginx: 10.1.{r.randint(0, 9)}.{r.randint(1, 254)} GET /api/v1/items/{r.randint(1, 50000)} HTTP/1.1 {r.choice([200, 200, 200, 404, 500])} {r.randint(100, 90000)}",
+    lambda r: f"kernel: [{r.randint(1, 999999)}.{r.randint(100, 999)}] eth{r.randint(0, 3)}: link {r.choice(['up', 'down'])}",
+    lambda r: f"postgres[{r.randint(100, 99999)}]: duration: {r.randint(1, 5000)}.{r.randint(10, 99)} ms statement: SELECT * FROM orders WHERE id = {r.randint(1, 10**6)}",
+    lambda r: f"cron[{r.randint(100, 99999)}]: ({r.choice(USERS)}) CMD (/usr/local/bin/backup.sh --level {r.randint(0, 2)})",
+    lambda r: f"app[{r.randint(100, 99999)}]: request {r.randint(10**8, 10**9)} timeout after {r.randint(1, 30)}s on {r.choice(SERVICES)}",
+    lambda r: f"systemd[1]: disk /dev/sd{r.choice('abcd')}{r.randint(1, 4)} usage {r.randint(50, 99)}%",
+]
+
+
+def synthetic_lines(count: int, seed: int = 42) -> list:
+    rng = random.Random(seed)
+    return [rng.choice(TEMPLATES)(rng) for _ in range(count)]
+
+
+def encode_dataset(lines: list) -> tuple:
+    """Mine templates and encode every line; returns (codec, rows, seconds)"""
+    config = TemplateMinerConfig()
+    config.profiling_enabled = False
+    miner = TemplateMiner(config=config)
+    for line in lines:
+        miner.add_log_message(line)
+
+    codec = TemplateCodec()
+    start = time.perf_counter()
+    rows = []
+    for line in lines:
+        cluster = miner.match(line)
+        encoded = codec.encode(cluster.get_template() if cluster else None, line)
+        rows.append((0, [], line) if encoded is None else (encoded[0], encoded[1], ''))
+    return codec, rows, time.perf_counter() - start
+
+
+def column_bytes(values: list) -> int:
+    """Compressed size of a String column, length-prefixed like ClickHouse Native"""
+    return len(zlib.compress(b''.join(struct.pack('<I', len(v)) + v.encode() for v in values), 6))
+
+
+def timed_search(fn, repeat: int = 3) -> tuple:
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best * 1000
+
+
+def main_offline(count: int):
+    lines = synthetic_lines(count)
+    codec, rows, encode_s = encode_dataset(lines)
+
+    # Exact round trip for every encoded row
+    start = time.perf_counter()
+    for line, (key, params, message) in zip(lines, rows):
+        rebuilt = codec.decode(key, params) if key else message
+        if rebuilt != line:
+            print(f"❌ Round trip failed: {line!r} -> {rebuilt!r}")
+            sys.exit(1)
+    decode_s = time.perf_counter() - start
+
+    raw_bytes = column_bytes(lines)
+    keys = zlib.compress(b''.join(struct.pack('<Q', key) for key, _, _ in rows), 6)
+    params = column_bytes(['\x00'.join(p) for _, p, _ in rows])
+    leftovers = column_bytes([message for _, _, message in rows])
+    dictionary = column_bytes(list(codec.templates.values()))
+    template_bytes = len(keys) + params + leftovers + dictionary
+    stats = codec.get_stats()
+
+    print("⏱️  Template storage benchmark (offline, zlib-6 column estimate)")
+    print("=" * 60)
+    print(f"Lines: {count}, templates: {stats['templates']}, kept raw: {stats['raw']}")
+    print(f"Raw message column:     {raw_bytes:>12,} bytes")
+    print(f"Template columns:       {template_bytes:>12,} bytes "
+          f"(ids {len(keys):,}, params {params:,}, raw {leftovers:,}, dictionary {dictionary:,})")
+    print(f"Compression ratio:      {raw_bytes / template_bytes:>12.2f}x")
+    print(f"Encode: {count / encode_s:,.0f} lines/s, decode: {count / decode_s:,.0f} lines/s")
+    print()
+    print(f"{'search':<20}{'raw ms':>10}{'template ms':>14}{'matches':>10}")
+
+    # Both sides scan pre-lowered text; parameters are joined the way the column stores them
+    lowered = [line.lower() for line in lines]
+    lowered_rows = [(key, '\x00'.join(params).lower() if key else message.lower())
+                    for key, params, message in rows]
+    for term in SEARCHES:
+        needle = term.lower()
+
+        def raw_search():
+            return [i for i, line in enumerate(lowered) if needle in line]
+
+        def template_search():
+            # Template texts first; only rows of other templates scan their parameters
+            hits = {key for key, template in codec.templates.items() if needle in template.lower()}
+            return [i for i, (key, text) in enumerate(lowered_rows) if key in hits or needle in text]
+
+        expected, raw_ms = timed_search(raw_search)
+        got, template_ms = timed_search(template_search)
+        # Matches spanning a literal and a parameter are not found by template search
+        note = '' if set(got) <= set(expected) else ' ❌'
+        print(f"{term:<20}{raw_ms:>10.1f}{template_ms:>14.1f}{len(got):>10}{note}")
+        if len(got) != len(expected):
+            print(f"{'':<20}raw search found {len(expected)}")
+
+
+def main_clickhouse(count: int):
+    from clickhouse_driver import Client
+
+    client = Client(
+        host=os.getenv('CLICKHOUSE_HOST', 'localhost'),
+        port=int(os.getenv('CLICKHOUSE_PORT', 9000)),
+        database=os.getenv('CLICKHOUSE_DATABASE', 'marslog'),
+        user=os.getenv('CLICKHOUSE_USER', 'default'),
+        password=os.getenv('CLICKHOUSE_PASSWORD', '')
+    )
+    lines = synthetic_lines(count)
+    codec, rows, _ = encode_dataset(lines)
+
+    client.execute("DROP TABLE IF EXISTS bench_logs_raw")
+    client.execute("DROP TABLE IF EXISTS bench_logs_template")
+    client.execute("DROP TABLE IF EXISTS bench_template_texts")
+    client.execute("CREATE TABLE bench_logs_raw (n UInt32, message String) ENGINE = MergeTree ORDER BY n")
+    client.execute("""
+        CREATE TABLE bench_logs_template (
+            n UInt32, message String, message_template UInt64, message_params Array(String) CODEC(ZSTD(3))
+        ) ENGINE = MergeTree ORDER BY n
+    """)
+    client.execute("CREATE TABLE bench_template_texts (template_hash UInt64, template String) ENGINE = MergeTree ORDER BY template_hash")
+    client.execute("INSERT INTO bench_logs_raw (n, message) VALUES", list(enumerate(lines)))
+    client.execute("INSERT INTO bench_logs_template (n, message, message_template, message_params) VALUES",
+                   [(n, message, key, params) for n, (key, params, message) in enumerate(rows)])
+    client.execute("INSERT INTO bench_template_texts (template_hash, template) VALUES", list(codec.templates.items()))
+    for table in ('bench_logs_raw', 'bench_logs_template', 'bench_template_texts'):
+        client.execute(f"OPTIMIZE TABLE {table} FINAL")
+
+    sizes = dict(client.execute("""
+        SELECT table, sum(data_compressed_bytes) FROM system.columns
+        WHERE database = currentDatabase() AND table LIKE 'bench_%' AND name != 'n'
+        GROUP BY table
+    """))
+    raw_bytes = sizes.get('bench_logs_raw', 0)
+    template_bytes = sizes.get('bench_logs_template', 0) + sizes.get('bench_template_texts', 0)
+
+    print("⏱️  Template storage benchmark (ClickHouse)")
+    print("=" * 60)
+    print(f"Lines: {count}, templates: {len(codec.templates)}")
+    print(f"Raw message column:     {raw_bytes:>12,} bytes compressed")
+    print(f"Template columns:       {template_bytes:>12,} bytes compressed")
+    print(f"Compression ratio:      {raw_bytes / max(template_bytes, 1):>12.2f}x")
+    print()
+    print(f"{'search':<20}{'raw ms':>10}{'template ms':>14}{'matches':>10}")
+    for term in SEARCHES:
+        (raw_count,), raw_ms = timed_search(lambda: client.execute(
+            "SELECT count() FROM bench_logs_raw WHERE positionCaseInsensitive(message, %(q)s) > 0",
+            {'q': term})[0])
+
+        def template_count():
+            keys = [key for key, in client.execute(
+                "SELECT template_hash FROM bench_template_texts WHERE positionCaseInsensitive(template, %(q)s) > 0",
+                {'q': term})] or [0]
+            return client.execute("""
+                SELECT count() FROM bench_logs_template
+                WHERE (message_template != 0 AND message_template IN %(keys)s)
+                   OR arrayExists(p -> positionCaseInsensitive(p, %(q)s) > 0, message_params)
+                   OR (message_template = 0 AND positionCaseInsensitive(message, %(q)s) > 0)
+            """, {'q': term, 'keys': keys})[0]
+
+        (template_matches,), template_ms = timed_search(template_count)
+        print(f"{term:<20}{raw_ms:>10.1f}{template_ms:>14.1f}{template_matches:>10}")
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == 'clickhouse':
+        main_clickhouse(int(sys.argv[2]) if len(sys.argv) > 2 else 1000000)
+        return
+    main_offline(int(sys.argv[1]) if len(sys.argv) > 1 else 200000)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+MARSLOG - Log Classifier
+Keyword classification from log_classification in ai_config.json, matched in one pass
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+from collections import deque
+from typing import Dict, List, Optional, Any
+
+logger = logging.getLogger(__name__)
+
+# Used when the config file is missing or has no log_classification.patterns
+DEFAULT_CLASSIFICATION = {
+    'patterns': {
+        'error': ['error', 'exception', 'failed', 'failure'],
+        'warning': ['warning', 'warn'],
+        'security': ['login', 'logout', 'auth', 'sudo'],
+        'network': ['network', 'connection', 'tcp', 'udp'],
+        'system': ['system', 'kernel', 'hardware']
+    },
+    'priority': ['error', 'warning', 'security', 'network', 'system'],
+    'default': 'application'
+}
+
+NO_MATCH = 1 << 30
+
+
+class KeywordAutomaton:
+    """Aho-Corasick automaton over lowercase keywords, each tagged with a rank.
+
+    Failure links are folded into a full transition table, so scanning is
+    one dict lookup per character whatever the number of keywords. Every
+    state stores the best (lowest) rank of the keywords ending there or at
+    any of its suffixes; a scan stops early once rank 0 is seen.
+    """
+
+    def __init__(self, keywords: Dict[str, int]):
+        goto: List[Dict[str, int]] = [{}]
+        rank = [NO_MATCH]
+        for keyword, keyword_rank in keywords.items():
+            state = 0
+            for ch in keyword:
+                next_state = goto[state].get(ch)
+                if next_state is None:
+                    next_state = len(goto)
+                    goto[state][ch] = next_state
+                    goto.append({})
+                    rank.append(NO_MATCH)
+                state = next_state
+            rank[state] = min(rank[state], keyword_rank)
+
+        # Breadth-first: a state's failure target is always finished before it
+        delta: List[Dict[str, int]] = [None] * len(goto)
+        delta[0] = dict(goto[0])
+        fail = [0] * len(goto)
+        pending = deque()
+        for next_state in goto[0].values():
+            pending.append(next_state)
+        while pending:
+            state = pending.popleft()
+            rank[state] = min(rank[state], rank[fail[state]])
+            delta[state] = {**delta[fail[state]], **goto[state]}
+            for ch, next_state in goto[state].items():
+                fail[next_state] = delta[fail[state]].get(ch, 0)
+                pending.append(next_state)
+
+        self.delta = delta
+        self.rank = rank
+        self.keywords = len(keywords)
+
+    def __len__(self) -> int:
+        return len(self.delta)
+
+    def best_rank(self, text: str) -> int:
+        """Lowest rank of any keyword occurring in ``text``, NO_MATCH if none"""
+        delta, rank = self.delta, self.rank
+        state = 0
+        best = NO_MATCH
+        for ch in text:
+            state = delta[state].get(ch, 0)
+            if rank[state] < best:
+                best = rank[state]
+                if best == 0:
+                    break
+        return best
+
+
+def build_automaton(settings: Dict[str, Any]):
+    """(automaton, categories by rank) for a log_classification section"""
+    patterns = settings.get('patterns') or {}
+    categories = [c for c in settings.get('priority', []) if c in patterns]
+    categories += [c for c in patterns if c not in categories]
+
+    keywords: Dict[str, int] = {}
+    for category_rank, category in enumerate(categories):
+        for keyword in patterns[category]:
+            keyword = str(keyword).lower()
+            if keyword and keyword not in keywords:
+                keywords[keyword] = category_rank
+    return KeywordAutomaton(keywords), categories
+
+
+class LogClassifier:
+    """Classifies messages by the highest-priority category with a keyword in them.
+
+    Categories rank in ``priority`` order, then in ``patterns`` order; lines
+    without any keyword get ``default``. The config file is re-read when its
+    modification time changes, checked at most every ``reload_check_sec``.
+    """
+
+    def __init__(self, config_path: Optional[str] = None, reload_check_sec: float = 5):
+        self.config_path = config_path
+        self.reload_check_sec = reload_check_sec
+        self.config_mtime = None
+        self.checked = 0.0
+        self.lock = threading.Lock()
+        self.reloads = 0
+        self.classified = 0
+        self.reload()
+
+    def load_settings(self) -> Dict[str, Any]:
+        settings = dict(DEFAULT_CLASSIFICATION)
+        if not self.config_path or not os.path.exists(self.config_path):
+            self.config_mtime = None
+            return settings
+        try:
+            self.config_mtime = os.stat(self.config_path).st_mtime
+            with open(self.config_path, 'r') as f:
+                section = json.load(f).get('log_classification', {})
+            if section.get('patterns'):
+                settings.update(section)
+        except (json.JSONDecodeError, OSError) as e:
+            logger.error(f"Error loading log classification from {self.config_path}: {e}")
+        return settings
+
+    def reload(self):
+        settings = self.load_settings()
+        automaton, categories = build_automaton(settings)
+        # One tuple swap, so concurrent classify calls see old or new, never a mix
+        self.compiled = (automaton, categories, settings.get('default', 'application'))
+        self.reloads += 1
+        logger.info(f"Log classifier built from {automaton.keywords} keywords in {len(categories)} categories")
+
+    def maybe_reload(self):
+        now = time.monotonic()
+        if now - self.checked < self.reload_check_sec:
+            return
+        with self.lock:
+            if now - self.checked < self.reload_check_sec:
+                return
+            self.checked = now
+            try:
+                mtime = os.stat(self.config_path).st_mtime if self.config_path else None
+            except OSError:
+                mtime = None
+            if mtime != self.config_mtime:
+                self.reload()
+
+    def classify(self, message: str) -> str:
+        self.maybe_reload()
+        automaton, categories, default = self.compiled
+        self.classified += 1
+        best = automaton.best_rank(message.lower())
+        return categories[best] if best != NO_MATCH else default
+
+    def get_stats(self) -> Dict[str, Any]:
+        automaton, categories, default = self.compiled
+        return {
+            'config_path': self.config_path,
+            'categories': categories,
+            'default': default,
+            'keywords': automaton.keywords,
+            'states': len(automaton),
+            'reloads': self.reloads,
+            'classified': self.classified
+        }
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+MARSLOG - Log Compression
+Template + parameter encoding of log messages (CLP-style) with exact round trips
+"""
+
+import re
+import hashlib
+import threading
+from functools import lru_cache
+from typing import Dict, List, Optional, Any, Tuple
+
+WILDCARD = '<*>'
+
+
+def template_hash(template: str) -> int:
+    """Stable 64-bit id of a template text; 0 is reserved for raw rows"""
+    digest = hashlib.blake2b(template.encode('utf-8', errors='surrogatepass'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') or 1
+
+
+@lru_cache(maxsize=16384)
+def template_pattern(template: str):
+    """Anchored regex capturing the text under each wildcard of ``template``"""
+    literals = template.split(WILDCARD)
+    return re.compile('(.*?)'.join(re.escape(literal) for literal in literals) + r'\Z', re.DOTALL)
+
+
+def split_message(template: str, message: str) -> Optional[List[str]]:
+    """Parameters of ``message`` under ``template``, or None if it does not fit.
+
+    The pattern is anchored and literals are matched verbatim, so joining the
+    literals with the parameters gives back ``message`` exactly.
+    """
+    match = template_pattern(template).match(message)
+    return list(match.groups()) if match else None
+
+
+def rebuild_message(template: str, params: List[str]) -> str:
+    literals = template.split(WILDCARD)
+    if len(params) != len(literals) - 1:
+        raise ValueError(f"template has {len(literals) - 1} wildcards, got {len(params)} parameters")
+    parts = [literals[0]]
+    for param, literal in zip(params, literals[1:]):
+        parts.append(param)
+        parts.append(literal)
+    return ''.join(parts)
+
+
+class TemplateCodec:
+    """Encodes messages as (template hash, parameters) and decodes them back.
+
+    Templates are keyed by the hash of their exact text, not by Drain3
+    cluster id: a cluster's template keeps generalizing, but rows must be
+    rebuilt from the text they were split with. Texts are immutable once
+    written, so decoded templates are cached for the life of the process.
+    """
+
+    def __init__(self):
+        self.templates: Dict[int, str] = {}
+        self.unsaved: Dict[int, str] = {}
+        self.lock = threading.Lock()
+        self.stats = {'encoded': 0, 'raw': 0, 'message_bytes': 0, 'param_bytes': 0}
+
+    def encode(self, template: Optional[str], message: str) -> Optional[Tuple[int, List[str]]]:
+        """(template hash, parameters), or None when the message is kept raw"""
+        params = split_message(template, message) if template else None
+        if params is None:
+            self.stats['raw'] += 1
+            return None
+
+        key = template_hash(template)
+        with self.lock:
+            if key not in self.templates:
+                self.templates[key] = template
+                self.unsaved[key] = template
+        self.stats['encoded'] += 1
+        self.stats['message_bytes'] += len(message)
+        self.stats['param_bytes'] += sum(len(param) for param in params)
+        return key, params
+
+    def take_unsaved(self) -> List[Tuple[int, str]]:
+        """Templates first used since the last call; written before the rows using them"""
+        with self.lock:
+            unsaved, self.unsaved = self.unsaved, {}
+        return list(unsaved.items())
+
+    def restore_unsaved(self, templates: List[Tuple[int, str]]):
+        with self.lock:
+            self.unsaved.update(templates)
+
+    def missing(self, keys) -> List[int]:
+        return [key for key in set(keys) if key and key not in self.templates]
+
+    def load(self, templates: List[Tuple[int, str]]):
+        with self.lock:
+            self.templates.update(templates)
+
+    def decode(self, key: int, params: List[str]) -> Optional[str]:
+        template = self.templates.get(key)
+        return rebuild_message(template, params) if template is not None else None
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'templates': len(self.templates),
+            'unsaved_templates': len(self.unsaved),
+            **self.stats
+        }
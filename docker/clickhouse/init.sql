@@ -13,3 +13,24 @@ CREATE TABLE IF NOT EXISTS logs (
     raw_log String
 ) ENGINE = MergeTree()
 ORDER BY timestamp;
+
+-- Parsed logs of the AI parser; anomaly_indicators is an array from the start
+-- (older installs: migrations/parsed_logs_anomaly_array.sql)
+CREATE TABLE IF NOT EXISTS parsed_logs (
+    timestamp DateTime64(3),
+    raw_log String,
+    log_type String,
+    risk_score Int32,
+    anomaly_indicators Array(LowCardinality(String)),
+    confidence Float64,
+    parsed_fields String,
+    source_ip String,
+    dest_ip String,
+    user_agent String,
+    status_code Int32,
+    bytes_sent Int64,
+    created_at DateTime DEFAULT now()
+) ENGINE = MergeTree()
+ORDER BY (timestamp, log_type, risk_score)
+PARTITION BY toYYYYMM(timestamp)
+TTL timestamp + INTERVAL 90 DAY;
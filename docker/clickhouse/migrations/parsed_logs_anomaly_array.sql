@@ -0,0 +1,20 @@
+-- One-off migration (MARSLOG): parsed_logs.anomaly_indicators from a comma-joined
+-- String to Array(LowCardinality(String)). Fresh installs get the array from init.sql.
+--
+-- Run once, with the flask-api stopped so no insert lands between DROP and RENAME:
+--   docker compose stop flask-api
+--   docker compose exec -T clickhouse clickhouse-client --multiquery < docker/clickhouse/migrations/parsed_logs_anomaly_array.sql
+--   docker compose start flask-api
+--
+-- On a table already migrated the first statement fails (splitByChar needs a String)
+-- and clickhouse-client stops before changing anything.
+
+USE marslog;
+
+-- Backfill a new array column, then swap it in under the old name
+ALTER TABLE parsed_logs ADD COLUMN anomaly_indicators_array Array(LowCardinality(String))
+    DEFAULT arrayFilter(x -> x != '', splitByChar(',', anomaly_indicators)) AFTER anomaly_indicators;
+ALTER TABLE parsed_logs MATERIALIZE COLUMN anomaly_indicators_array SETTINGS mutations_sync = 2;
+ALTER TABLE parsed_logs MODIFY COLUMN anomaly_indicators_array REMOVE DEFAULT;
+ALTER TABLE parsed_logs DROP COLUMN anomaly_indicators;
+ALTER TABLE parsed_logs RENAME COLUMN anomaly_indicators_array TO anomaly_indicators;
@@ -0,0 +1,120 @@
+"""
+Access Logs for MARSLOG-ClickHouse
+Typed access_logs rows for Apache/nginx access lines, rolled up per client and minute
+"""
+
+import re
+import json
+import logging
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Any, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ACCESS_LOGS = {
+    'enabled': True,            # store access lines in access_logs instead of parsed_logs
+}
+
+ACCESS_LOG_TYPES = frozenset({'apache_access', 'nginx_access'})
+
+# Column order of access_logs rows built by access_log_row
+ACCESS_LOG_COLUMNS = (
+    'timestamp', 'log_type', 'client_ip', 'method', 'path', 'protocol', 'status', 'bytes',
+    'referer', 'user_agent', 'response_time_ms', 'risk_score', 'anomaly_indicators', 'raw_log',
+    'created_at'
+)
+
+# Paths kept per client and minute by the rollup; part of the table type
+TOP_PATHS = 10
+
+# Text after the quoted request: status, size, then the optional combined-format
+# referer and user agent and whatever a custom format appends
+_TAIL = re.compile(r'" \d{3} (?:\d+|-)(?: "(?P<referer>[^"]*)" "(?P<user_agent>[^"]*)")?(?P<rest>.*)$')
+# nginx $request_time (or rt=/request_time= keys): seconds with a fraction
+_RESPONSE_TIME = re.compile(r'(?:^|\s)(?:rt=|request_time=)?(\d+\.\d+)(?=\s|$)')
+
+
+def load_access_logs(config_path: Optional[Path] = None) -> Dict[str, Any]:
+    """Load the access log settings, falling back to the built-in defaults"""
+    settings = dict(DEFAULT_ACCESS_LOGS)
+    if config_path is None or not Path(config_path).exists():
+        return settings
+
+    try:
+        with open(config_path, 'r') as f:
+            settings.update(json.load(f).get('access_logs', {}))
+    except (json.JSONDecodeError, OSError) as e:
+        logger.error(f"Error loading access log settings from {config_path}: {e}")
+
+    return settings
+
+
+def split_request(request: str) -> Tuple[str, str, str]:
+    """(method, path, protocol) of a request line such as ``GET /x HTTP/1.1``"""
+    parts = request.split(' ')
+    if len(parts) >= 3:
+        return parts[0], ' '.join(parts[1:-1]), parts[-1]
+    if len(parts) == 2:
+        return parts[0], parts[1], ''
+    return '', request, ''
+
+
+def access_timestamp(clf_time: Optional[str], fallback: Any) -> datetime:
+    """Time of a ``10/Oct/2000:13:55:36 -0700`` field, else the parser's ISO timestamp"""
+    if clf_time:
+        try:
+            return datetime.strptime(clf_time, '%d/%b/%Y:%H:%M:%S %z')
+        except ValueError:
+            pass
+    if isinstance(fallback, datetime):
+        return fallback
+    if isinstance(fallback, str):
+        try:
+            return datetime.fromisoformat(fallback.replace('Z', '+00:00'))
+        except ValueError:
+            pass
+    return datetime.now()
+
+
+def _to_int(value: Any) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+def access_log_row(parsed_log: Dict[str, Any]) -> List[Any]:
+    """access_logs row (in ACCESS_LOG_COLUMNS order) for a parsed access line"""
+    fields = parsed_log['parsed_fields']
+    raw_log = parsed_log['raw_log']
+    method, path, protocol = split_request(fields.get('request', ''))
+
+    referer = user_agent = ''
+    response_time_ms = 0.0
+    tail = _TAIL.search(raw_log)
+    if tail:
+        referer = tail.group('referer') or ''
+        user_agent = tail.group('user_agent') or ''
+        response_time = _RESPONSE_TIME.search(tail.group('rest'))
+        if response_time:
+            response_time_ms = float(response_time.group(1)) * 1000
+
+    row = {
+        'timestamp': access_timestamp(fields.get('timestamp'), parsed_log.get('timestamp')),
+        'log_type': parsed_log['log_type'],
+        'client_ip': fields.get('client_ip', ''),
+        'method': method.upper(),
+        'path': path,
+        'protocol': protocol,
+        'status': min(_to_int(fields.get('status_code')), 65535),
+        'bytes': _to_int(fields.get('bytes_sent')),
+        'referer': '' if referer == '-' else referer,
+        'user_agent': '' if user_agent == '-' else user_agent,
+        'response_time_ms': response_time_ms,
+        'risk_score': parsed_log['risk_score'],
+        'anomaly_indicators': list(parsed_log['anomaly_indicators']),
+        'raw_log': raw_log,
+        'created_at': datetime.now(),
+    }
+    return [row[column] for column in ACCESS_LOG_COLUMNS]
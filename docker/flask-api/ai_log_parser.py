@@ -11,13 +11,35 @@ from datetime import datetime, timedelta
 from typing import Dict, List, Any, Tuple, Optional
 from flask import Blueprint, request, jsonify
 import logging
-from collections import defaultdict, Counter
+from collections import Counter
 import statistics
-from .utils import get_clickhouse_client
+from .utils import get_clickhouse_client, CONFIG_DIR, DEVICES_FILE_PATH
+from .risk_rules import RiskRuleMatcher, load_risk_scoring
+from .rule_safety import RuleSafetyGuard, load_rule_safety
+from .parse_cache import ParseResultCache, load_parse_cache, VOLATILE_FIELDS
+from .parse_plans import ParsePlanCache, load_parse_plans, create_template_miner
+from .rate_windows import WindowedStats, load_rate_windows
+from .sketches import PatternSketches, load_pattern_sketches
+from .baselines import TrafficBaselines, load_traffic_baselines
+from .cardinality import SourceCardinality, load_source_cardinality
+from .state_store import StateSnapshotter, load_state_snapshots
+from .shared_state import SharedPatternState, load_shared_state
+from .batch_scoring import BatchScorer, ScoringRecord, load_batch_scoring
+from .structured_logs import StructuredLogParser, load_structured_logs, TIMESTAMP_KEYS
+from .ip_enrichment import IPEnrichment, load_ip_enrichment
+from .vendor_packs import parse_asa_message, parse_panos
+from .access_logs import ACCESS_LOG_COLUMNS, ACCESS_LOG_TYPES, TOP_PATHS, access_log_row, load_access_logs
 
 ai_parser_bp = Blueprint('ai_parser', __name__)
 logger = logging.getLogger(__name__)
 
+# Column order of parsed_logs rows built by parsed_log_row
+PARSED_LOG_COLUMNS = (
+    'timestamp', 'raw_log', 'log_type', 'risk_score', 'anomaly_indicators',
+    'confidence', 'parsed_fields', 'source_ip', 'dest_ip', 'user_agent',
+    'status_code', 'bytes_sent', 'created_at'
+)
+
 class AILogParser:
     def __init__(self):
         self.patterns = {
@@ -78,7 +100,10 @@ class AILogParser:
             ]
         }
         
+        # Tried in order: vendor formats before the generic syslog shapes they also fit
         self.log_types = {
+            'cisco_asa': r'^(\w{3}\s+\d{1,2}\s+\d{2}:\d{2}:\d{2}) (\S+) %ASA-(\d)-(\d+): (.+)',
+            'palo_alto': r'^(\d{4}\/\d{2}\/\d{2}\s+\d{2}:\d{2}:\d{2}),([^,]+),([^,]+),([^,]+),(.+)',
             'apache_access': r'^(\S+) \S+ \S+ \[([^\]]+)\] "([^"]*)" (\d+) (\d+)',
             'apache_error': r'^\[([^\]]+)\] \[([^\]]+)\] \[([^\]]+)\] (.+)',
             'nginx_access': r'^(\S+) - \S+ \[([^\]]+)\] "([^"]*)" (\d+) (\d+)',
@@ -86,8 +111,6 @@ class AILogParser:
             'windows_event': r'^(\d{4}-\d{2}-\d{2}\s+\d{2}:\d{2}:\d{2})\s+(\S+)\s+(\S+)\s+(.+)',
             'firewall': r'^(\d{4}-\d{2}-\d{2}\s+\d{2}:\d{2}:\d{2})\s+(\S+)\s+(.+)\s+SRC=(\S+)\s+DST=(\S+)',
             'auth_log': r'^(\w{3}\s+\d{1,2}\s+\d{2}:\d{2}:\d{2}) (\S+) ([^:]+): (.+)',
-            'cisco_asa': r'^(\w{3}\s+\d{1,2}\s+\d{2}:\d{2}:\d{2}) (\S+) %ASA-(\d)-(\d+): (.+)',
-            'palo_alto': r'^(\d{4}\/\d{2}\/\d{2}\s+\d{2}:\d{2}:\d{2}),([^,]+),([^,]+),([^,]+),(.+)',
             'json_log': r'^\{.*\}$',
         }
         
@@ -100,9 +123,66 @@ class AILogParser:
             'rapid_request_threshold': 0.05,  # 50ms between requests
         }
         
+        # Per-source and per-user sliding windows for the rate thresholds
+        self.rate_windows = WindowedStats(**load_rate_windows(CONFIG_DIR / 'ai_config.json'))
+        
+        # HyperLogLog distinct sources per host and hour with a first-seen filter
+        self.source_cardinality = SourceCardinality(**load_source_cardinality(CONFIG_DIR / 'ai_config.json'))
+        
+        # Config-driven indicator rules compiled into a single-pass matcher
+        self.risk_scoring = load_risk_scoring(CONFIG_DIR / 'ai_config.json')
+        self.rule_matcher = RiskRuleMatcher(self.risk_scoring['rules'])
+        self.status_weights = {int(code): weight for code, weight in self.risk_scoring['status_weights'].items()}
+        
+        # Audit every regex rule once at load time; super-linear ones are
+        # bounded and time-limited, and lines are clipped to a scan budget
+        self.rule_safety = RuleSafetyGuard(**load_rule_safety(CONFIG_DIR / 'ai_config.json'))
+        self.compiled_patterns = {
+            field_type: [
+                self.rule_safety.compile(f'{field_type}[{index}]', pattern, re.IGNORECASE)
+                for index, pattern in enumerate(patterns)
+            ]
+            for field_type, patterns in self.patterns.items()
+        }
+        self.compiled_log_types = {
+            log_type: self.rule_safety.compile(log_type, pattern, re.IGNORECASE)
+            for log_type, pattern in self.log_types.items()
+        }
+        self.user_agent_rule = self.rule_safety.compile(
+            'user_agent', r'"([^"]*user-agent[^"]*)"', re.IGNORECASE
+        )
+        
+        # Repeated lines (health checks, identical denies, cron) reuse the
+        # timestamp-independent part of a previous extraction
+        self.parse_cache = ParseResultCache(**load_parse_cache(CONFIG_DIR / 'ai_config.json'))
+        
+        # Source/destination addresses are tagged from CIDR tables and devices.json
+        self.ip_enrichment = IPEnrichment(devices_path=DEVICES_FILE_PATH,
+                                          **load_ip_enrichment(CONFIG_DIR / 'ai_config.json'))
+        
+        # JSON lines are decoded and flattened instead of regex-scanned
+        self.structured_logs = StructuredLogParser(**load_structured_logs(CONFIG_DIR / 'ai_config.json'))
+        
+        # Lines of a known Drain3 template are extracted by token slicing
+        plan_settings, drain3_settings = load_parse_plans(CONFIG_DIR / 'ai_config.json')
+        self.template_miner = create_template_miner(drain3_settings) if plan_settings['enabled'] else None
+        self.parse_plans = ParsePlanCache(self.rule_safety, self.compiled_patterns,
+                                          self.template_miner, **plan_settings)
+        
         # ML-like features for pattern learning
-        self.learned_patterns = defaultdict(Counter)
-        self.baseline_metrics = {}
+        # Heavy-hitter sketches keep learned state at a fixed size per field
+        self.learned_patterns = PatternSketches(**load_pattern_sketches(CONFIG_DIR / 'ai_config.json'))
+        self.baseline_metrics = TrafficBaselines(**load_traffic_baselines(CONFIG_DIR / 'ai_config.json'))
+        
+        # Optional cluster-wide view of learned patterns across gunicorn workers
+        self.shared_state = SharedPatternState(**load_shared_state(CONFIG_DIR / 'ai_config.json'))
+        
+        # Chunks from the batch paths are scored by one vectorized model call
+        self.batch_scorer = BatchScorer([rule['id'] for rule in self.rule_matcher.rules],
+                                        **load_batch_scoring(CONFIG_DIR / 'ai_config.json'))
+        
+        # Apache/nginx access lines are stored as typed access_logs rows
+        self.access_logs = load_access_logs(CONFIG_DIR / 'ai_config.json')
         self.client = None
 
     def get_client(self):
@@ -113,15 +193,94 @@ class AILogParser:
 
     def detect_log_type(self, log_line: str) -> str:
         """Auto-detect log type using regex patterns"""
-        for log_type, pattern in self.log_types.items():
-            if re.search(pattern, log_line, re.IGNORECASE):
+        scan_line = self.rule_safety.clip(log_line)
+        for log_type, rule in self.compiled_log_types.items():
+            if self.rule_safety.search(rule, scan_line):
                 return log_type
         return 'unknown'
 
+    def extract_stable_fields(self, scan_line: str, log_type: str = None, log_line: str = None) -> Dict[str, Any]:
+        """Extract the part of a result that does not depend on timestamp digits.
+
+        The regex families see the clipped ``scan_line``; the linear indicator
+        scan covers the whole ``log_line`` so padding cannot hide keywords.
+        """
+        if not log_type:
+            log_type = self.detect_log_type(scan_line)
+        
+        matches_by_field = {}
+        for field_type, rules in self.compiled_patterns.items():
+            if field_type in VOLATILE_FIELDS:
+                continue
+            for rule in rules:
+                matches = self.rule_safety.findall(rule, scan_line)
+                if matches:
+                    matches_by_field[field_type] = matches
+        
+        return {
+            'log_type': log_type,
+            'matches': matches_by_field,
+            'hits': self.rule_matcher.scan(scan_line if log_line is None else log_line),
+        }
+
+    def extract_family_matches(self, scan_line: str, stable: Dict[str, Any]) -> Dict[str, list]:
+        """Run the field family rules, reusing the cached stable families"""
+        family_matches = {}
+        for field_type, rules in self.compiled_patterns.items():
+            if field_type not in VOLATILE_FIELDS:
+                if field_type in stable['matches']:
+                    family_matches[field_type] = stable['matches'][field_type]
+                continue
+            for rule in rules:
+                matches = self.rule_safety.findall(rule, scan_line)
+                if matches:
+                    family_matches[field_type] = matches
+        return family_matches
+
     def extract_fields(self, log_line: str, log_type: str = None) -> Dict[str, Any]:
         """Extract structured fields from log line"""
-        if not log_type:
-            log_type = self.detect_log_type(log_line)
+        return self.extract_record(log_line, log_type).fields
+
+    def extract_batch(self, log_lines: List[str]) -> List[Dict[str, Any]]:
+        """Extract a chunk of log lines and score it with the batch model"""
+        records = [self.extract_record(log_line) for log_line in log_lines if isinstance(log_line, str)]
+        self.batch_scorer.score(records)
+        return [record.fields for record in records]
+
+    def extract_record(self, log_line: str, log_type: str = None, now: Optional[float] = None) -> ScoringRecord:
+        """Extract fields and keep the parse context batch scoring needs.
+
+        ``now`` is the clock of the rate windows and baselines (epoch seconds,
+        default the current time); deferred parsing passes the ingest time.
+        """
+        scan_line = self.rule_safety.clip(log_line)
+        
+        # Structured lines skip Drain3 and the text regex families
+        structured = self.structured_logs.parse(scan_line)
+        if structured is not None:
+            return self.extract_structured(log_line, scan_line, structured, log_type, now)
+        
+        # A planned Drain3 template skips the regex cascade; otherwise run it
+        # and let the plan cache learn the template from this line
+        lookup = self.parse_plans.lookup(scan_line)
+        family_matches = self.parse_plans.apply(lookup, scan_line) if lookup else None
+        if family_matches is not None:
+            log_type = log_type or lookup.plan.log_type or self.detect_log_type(scan_line)
+            hits = self.rule_matcher.scan(log_line)
+        else:
+            # Keyed on the whole line: the cached hits cover text past the scan budget
+            cache_key = self.parse_cache.key(log_line, log_type) if self.parse_cache.admit() else None
+            stable = self.parse_cache.get(cache_key) if cache_key is not None else None
+            if stable is None:
+                stable = self.extract_stable_fields(scan_line, log_type, log_line)
+                if cache_key is not None:
+                    self.parse_cache.put(cache_key, stable)
+            
+            family_matches = self.extract_family_matches(scan_line, stable)
+            hits = stable['hits']
+            if lookup is not None:
+                self.parse_plans.learn(lookup, scan_line, None if log_type else stable['log_type'])
+            log_type = stable['log_type']
         
         fields = {
             'raw_log': log_line,
@@ -134,31 +293,57 @@ class AILogParser:
         }
         
         # Extract common patterns
-        for field_type, patterns in self.patterns.items():
-            for pattern in patterns:
-                matches = re.findall(pattern, log_line, re.IGNORECASE)
-                if matches:
-                    if field_type == 'timestamp':
-                        fields['timestamp'] = self.normalize_timestamp(matches[0])
-                    else:
-                        fields['parsed_fields'][field_type] = matches
+        for field_type, matches in family_matches.items():
+            if field_type == 'timestamp':
+                fields['timestamp'] = self.normalize_timestamp(matches[0])
+            else:
+                fields['parsed_fields'][field_type] = list(matches)
         
         # Type-specific parsing
         if log_type in self.log_types:
-            match = re.search(self.log_types[log_type], log_line, re.IGNORECASE)
+            match = self.rule_safety.search(self.compiled_log_types[log_type], scan_line)
             if match:
                 fields['parsed_fields'].update(self.parse_by_type(match, log_type))
                 fields['confidence'] = 0.9  # High confidence for known formats
         else:
             fields['confidence'] = 0.5  # Medium confidence for unknown formats
         
-        # Calculate risk score
-        fields['risk_score'] = self.calculate_risk_score(log_line, fields['parsed_fields'])
+        return self.score_fields(fields, hits, lookup.cluster_id if lookup is not None else -1, now)
+
+    def extract_structured(self, log_line: str, scan_line: str, structured: Dict[str, Any],
+                           log_type: str = None, now: Optional[float] = None) -> ScoringRecord:
+        """Build the result of a JSON line from its flattened fields"""
+        fields = {
+            'raw_log': log_line,
+            'log_type': log_type or 'json_log',
+            'timestamp': None,
+            'parsed_fields': structured,
+            'risk_score': 0,
+            'anomaly_indicators': [],
+            'confidence': 0.9
+        }
+        for key in TIMESTAMP_KEYS:
+            value = structured.get(key)
+            if isinstance(value, (str, int)) and not isinstance(value, bool):
+                fields['timestamp'] = self.normalize_timestamp(str(value))
+                break
+        
+        return self.score_fields(fields, self.rule_matcher.scan(log_line), -1, now)
+
+    def score_fields(self, fields: Dict[str, Any], hits, template_id: int,
+                     now: Optional[float] = None) -> ScoringRecord:
+        """Risk score and anomalies of extracted fields"""
+        # Calculate risk score (one indicator scan feeds scoring and anomalies)
+        fields['risk_score'] = self.calculate_risk_score(fields['raw_log'], fields['parsed_fields'], hits)
         
         # Detect anomalies
-        fields['anomaly_indicators'] = self.detect_anomalies(fields)
+        fields['anomaly_indicators'] = self.detect_anomalies(fields, hits, now)
         
-        return fields
+        source_ip = self.extract_source_ip(fields['parsed_fields'])
+        if self.ip_enrichment.enabled:
+            fields['enrichment'] = self.ip_enrichment.annotate(source_ip, self.extract_dest_ip(fields['parsed_fields']))
+        
+        return ScoringRecord(fields, hits, template_id, source_ip)
 
     def normalize_timestamp(self, timestamp_str: str) -> Optional[str]:
         """Normalize various timestamp formats to ISO format"""
@@ -238,68 +423,52 @@ class AILogParser:
                 'message_id': match.group(4),
                 'message': match.group(5)
             })
+            # Per-message-id extractor for addresses, ports, action and ACL
+            parsed.update(parse_asa_message(match.group(4), match.group(5)))
+        
+        elif log_type == 'palo_alto':
+            # Positional TRAFFIC/THREAT schema instead of the first four columns
+            parsed.update(parse_panos(match.group(0)) or {})
         
         elif log_type == 'json_log':
-            try:
-                json_data = json.loads(match.group(0))
-                parsed.update(json_data)
-            except json.JSONDecodeError:
-                pass
+            parsed.update(self.structured_logs.parse(match.group(0)) or {})
         
         return parsed
 
-    def calculate_risk_score(self, log_line: str, parsed_fields: Dict) -> int:
+    def calculate_risk_score(self, log_line: str, parsed_fields: Dict, hits=None) -> int:
         """Calculate risk score from 0-100 based on indicators"""
-        score = 0
-        
-        # Attack indicators (high weight)
-        for pattern in self.patterns['attack_indicators']:
-            if re.search(pattern, log_line, re.IGNORECASE):
-                score += 35
+        if hits is None:
+            hits = self.rule_matcher.scan(log_line)
+        scoring = self.risk_scoring
         
-        # Error indicators (medium weight)
-        for pattern in self.patterns['error_indicators']:
-            if re.search(pattern, log_line, re.IGNORECASE):
-                score += 20
+        # Keyword indicators (attack, error, privileged accounts, SQLi)
+        score = hits.weight
         
         # High-risk status codes
         if 'status_code' in parsed_fields:
             status = parsed_fields['status_code']
-            if status in [401, 403]:
-                score += 25  # Authentication/Authorization failures
-            elif status in [404, 500, 502, 503]:
-                score += 15  # Application errors
-            elif status in [429]:
-                score += 30  # Rate limiting (potential DoS)
-        
-        # Suspicious activity patterns
-        if re.search(r'(root|admin|administrator)', log_line, re.IGNORECASE):
-            score += 15
-        
-        if re.search(r'(failed|denied|unauthorized|blocked)', log_line, re.IGNORECASE):
-            score += 20
-        
-        # SQL injection patterns
-        if re.search(r'(union.*select|drop.*table|exec.*sp_|<script)', log_line, re.IGNORECASE):
-            score += 40
+            if isinstance(status, (int, float)):
+                score += self.status_weights.get(status, 0)
         
         # Network-based risks
         if 'ip_address' in parsed_fields:
             for ip in parsed_fields['ip_address']:
                 # Check for private IP ranges (lower risk)
-                if re.match(r'^(10\.|192\.168\.|172\.(1[6-9]|2[0-9]|3[01])\.)', ip):
-                    score -= 5  # Lower risk for internal IPs
+                if self.ip_enrichment.is_private(ip):
+                    score += scoring['internal_ip_weight']  # Lower risk for internal IPs
                 else:
-                    score += 10  # Higher risk for external IPs
+                    score += scoring['external_ip_weight']  # Higher risk for external IPs
         
         # Large data transfers
         if 'bytes_sent' in parsed_fields and parsed_fields['bytes_sent'] > self.anomaly_thresholds['large_transfer_threshold']:
-            score += 25
+            score += scoring['large_transfer_weight']
         
-        return min(score, 100)  # Cap at 100
+        return min(score, scoring['max_score'])
 
-    def detect_anomalies(self, fields: Dict) -> List[str]:
+    def detect_anomalies(self, fields: Dict, hits=None, now: Optional[float] = None) -> List[str]:
         """Detect anomalous patterns in log entry"""
+        if hits is None:
+            hits = self.rule_matcher.scan(fields['raw_log'])
         anomalies = []
         parsed = fields['parsed_fields']
         
@@ -308,11 +477,11 @@ class AILogParser:
             anomalies.append('high_risk_activity')
         
         # Multiple failed attempts
-        if re.search(r'failed.*(\d+).*times?', fields['raw_log'], re.IGNORECASE):
+        if 'multiple_failures' in hits.anomalies:
             anomalies.append('multiple_failures')
         
         # Brute force indicators
-        if re.search(r'(brute.*force|dictionary.*attack|password.*spray)', fields['raw_log'], re.IGNORECASE):
+        if 'brute_force_attempt' in hits.anomalies:
             anomalies.append('brute_force_attempt')
         
         # Unusual time patterns
@@ -329,47 +498,73 @@ class AILogParser:
         if 'bytes_sent' in parsed and parsed['bytes_sent'] > self.anomaly_thresholds['large_transfer_threshold']:
             anomalies.append('large_data_transfer')
         
-        # Rapid sequential requests
-        if hasattr(self, 'last_request_time'):
-            current_time = time.time()
-            if current_time - self.last_request_time < self.anomaly_thresholds['rapid_request_threshold']:
-                anomalies.append('rapid_requests')
-        self.last_request_time = time.time()
-        
-        # Suspicious user agents
-        user_agent_patterns = [
-            r'(sqlmap|nmap|nikto|dirb|gobuster|wfuzz)',
-            r'(bot|crawler|spider)(?!.*google)',
-            r'^$',  # Empty user agent
-        ]
-        for pattern in user_agent_patterns:
-            if re.search(pattern, fields['raw_log'], re.IGNORECASE):
-                anomalies.append('suspicious_user_agent')
-                break
+        # Rate windows: rapid requests per source, failed auth bursts per
+        # source or user
+        source_ip = self.extract_source_ip(parsed)
+        observation = self.rate_windows.observe(
+            source_ip,
+            self.extract_user(parsed),
+            self.is_failed_auth(parsed, hits),
+            now,
+        )
+        if observation.gap is not None and observation.gap < self.anomaly_thresholds['rapid_request_threshold']:
+            anomalies.append('rapid_requests')
+        if max(observation.source_failures, observation.user_failures) > self.anomaly_thresholds['failed_auth_threshold']:
+            anomalies.append('repeated_auth_failures')
+        
+        # First-seen sources and bursts of them per host and hour
+        if source_ip:
+            sources = self.source_cardinality.observe(self.extract_host(parsed), source_ip, now)
+            if sources.first_seen:
+                anomalies.append('first_seen_source')
+                if sources.new_sources > self.anomaly_thresholds['new_source_threshold']:
+                    anomalies.append('new_source_surge')
+        
+        # Event rate of this (log_type, host) against its hour/weekday baseline
+        traffic = self.baseline_metrics.observe(fields['log_type'], self.extract_host(parsed), now)
+        if traffic.z_score is not None and traffic.z_score > self.anomaly_thresholds['unusual_traffic']:
+            anomalies.append('unusual_traffic')
+        if traffic.closed_z_score is not None and traffic.closed_z_score < -self.anomaly_thresholds['unusual_traffic']:
+            anomalies.append('traffic_drop')
+        
+        # Suspicious user agents (scanner tools, non-Google crawlers, empty)
+        if 'suspicious_user_agent' in hits.anomalies:
+            anomalies.append('suspicious_user_agent')
         
         return anomalies
 
+    def parsed_log_row(self, parsed_log: Dict[str, Any]) -> Dict[str, Any]:
+        """parsed_logs row for one parsed log, keyed by PARSED_LOG_COLUMNS"""
+        return {
+            'timestamp': parsed_log.get('timestamp', datetime.now().isoformat()),
+            'raw_log': parsed_log['raw_log'],
+            'log_type': parsed_log['log_type'],
+            'risk_score': parsed_log['risk_score'],
+            'anomaly_indicators': parsed_log['anomaly_indicators'],
+            'confidence': parsed_log['confidence'],
+            'parsed_fields': json.dumps(parsed_log['parsed_fields']),
+            'source_ip': self.extract_source_ip(parsed_log['parsed_fields']),
+            'dest_ip': self.extract_dest_ip(parsed_log['parsed_fields']),
+            'user_agent': self.extract_user_agent(parsed_log['raw_log']),
+            'status_code': parsed_log['parsed_fields'].get('status_code', 0),
+            'bytes_sent': parsed_log['parsed_fields'].get('bytes_sent', 0),
+            'created_at': datetime.now().isoformat()
+        }
+
     def store_parsed_log(self, parsed_log: Dict[str, Any]) -> bool:
         """Store parsed log data in ClickHouse"""
         try:
             client = self.get_client()
             
+            if self.access_logs['enabled'] and parsed_log['log_type'] in ACCESS_LOG_TYPES:
+                client.execute(
+                    f"INSERT INTO access_logs ({', '.join(ACCESS_LOG_COLUMNS)}) VALUES",
+                    [access_log_row(parsed_log)]
+                )
+                return True
+            
             # Prepare data for insertion
-            log_data = {
-                'timestamp': parsed_log.get('timestamp', datetime.now().isoformat()),
-                'raw_log': parsed_log['raw_log'],
-                'log_type': parsed_log['log_type'],
-                'risk_score': parsed_log['risk_score'],
-                'anomaly_indicators': ','.join(parsed_log['anomaly_indicators']),
-                'confidence': parsed_log['confidence'],
-                'parsed_fields': json.dumps(parsed_log['parsed_fields']),
-                'source_ip': self.extract_source_ip(parsed_log['parsed_fields']),
-                'dest_ip': self.extract_dest_ip(parsed_log['parsed_fields']),
-                'user_agent': self.extract_user_agent(parsed_log['raw_log']),
-                'status_code': parsed_log['parsed_fields'].get('status_code', 0),
-                'bytes_sent': parsed_log['parsed_fields'].get('bytes_sent', 0),
-                'created_at': datetime.now().isoformat()
-            }
+            log_data = self.parsed_log_row(parsed_log)
             
             # Insert into parsed_logs table
             client.execute(
@@ -390,15 +585,32 @@ class AILogParser:
             return False
 
     def extract_source_ip(self, parsed_fields: Dict) -> str:
-        """Extract source IP from parsed fields"""
+        """Extract source IP from parsed fields (JSON logs may carry it as a number)"""
         if 'client_ip' in parsed_fields:
-            return parsed_fields['client_ip']
+            source_ip = parsed_fields['client_ip']
         elif 'source_ip' in parsed_fields:
-            return parsed_fields['source_ip']
+            source_ip = parsed_fields['source_ip']
         elif 'ip_address' in parsed_fields and parsed_fields['ip_address']:
-            return parsed_fields['ip_address'][0]
+            source_ip = parsed_fields['ip_address'][0]
+        else:
+            source_ip = None
+        return '' if source_ip is None else str(source_ip)
+
+    def extract_host(self, parsed_fields: Dict) -> str:
+        """Extract the reporting host, falling back to the source IP"""
+        return str(parsed_fields.get('hostname') or self.extract_source_ip(parsed_fields) or 'unknown')
+
+    def extract_user(self, parsed_fields: Dict) -> str:
+        """Extract the first user name from parsed fields"""
+        users = parsed_fields.get('user')
+        if isinstance(users, list) and users:
+            return users[0]
         return ''
 
+    def is_failed_auth(self, parsed_fields: Dict, hits) -> bool:
+        """Whether the entry records a failed authentication attempt"""
+        return 'auth_failure' in hits.rules or parsed_fields.get('status_code') == 401
+
     def extract_dest_ip(self, parsed_fields: Dict) -> str:
         """Extract destination IP from parsed fields"""
         if 'dest_ip' in parsed_fields:
@@ -409,7 +621,7 @@ class AILogParser:
 
     def extract_user_agent(self, raw_log: str) -> str:
         """Extract user agent from raw log"""
-        match = re.search(r'"([^"]*user-agent[^"]*)"', raw_log, re.IGNORECASE)
+        match = self.rule_safety.search(self.user_agent_rule, self.rule_safety.clip(raw_log))
         if match:
             return match.group(1)
         return ''
@@ -423,22 +635,45 @@ class AILogParser:
             for field, value in log_entry.get('parsed_fields', {}).items():
                 if isinstance(value, list):
                     for v in value:
-                        self.learned_patterns[f"{log_type}_{field}"][str(v)] += 1
+                        self.learned_patterns.add(f"{log_type}_{field}", str(v))
+                        self.shared_state.add(f"{log_type}_{field}", str(v))
                 else:
-                    self.learned_patterns[f"{log_type}_{field}"][str(value)] += 1
+                    self.learned_patterns.add(f"{log_type}_{field}", str(value))
+                    self.shared_state.add(f"{log_type}_{field}", str(value))
         
         logger.info(f"Learned patterns from {len(parsed_logs)} log entries")
 
+    def get_pattern_summary(self) -> Tuple[Dict[str, Dict[str, int]], str]:
+        """Top learned values per key, cluster-wide when shared state is enabled"""
+        if self.shared_state.enabled:
+            try:
+                return self.shared_state.get_summary(5), 'shared'
+            except Exception as e:
+                logger.error(f"Error reading shared learned patterns, using local ones: {e}")
+        return {
+            key: dict(top) for key, top in self.learned_patterns.most_common(5).items()
+        }, 'local'
+
     def get_parsing_stats(self) -> Dict[str, Any]:
         """Get parsing statistics and learned patterns"""
+        pattern_summary, pattern_scope = self.get_pattern_summary()
         return {
-            'total_patterns': len(self.learned_patterns),
-            'pattern_summary': {
-                key: dict(counter.most_common(5))
-                for key, counter in self.learned_patterns.items()
-            },
+            'total_patterns': len(pattern_summary),
+            'pattern_summary': pattern_summary,
+            'pattern_scope': pattern_scope,
+            'pattern_sketches': self.learned_patterns.get_stats(),
+            'shared_state': self.shared_state.get_stats(),
+            'batch_scoring': self.batch_scorer.get_stats(),
+            'structured_logs': self.structured_logs.get_stats(),
+            'ip_enrichment': self.ip_enrichment.get_stats(),
             'anomaly_thresholds': self.anomaly_thresholds,
-            'supported_log_types': list(self.log_types.keys())
+            'supported_log_types': list(self.log_types.keys()),
+            'rule_safety': self.rule_safety.get_stats(),
+            'parse_cache': self.parse_cache.get_stats(),
+            'parse_plans': self.parse_plans.get_stats(),
+            'rate_windows': self.rate_windows.get_stats(),
+            'traffic_baselines': self.baseline_metrics.get_stats(),
+            'source_cardinality': self.source_cardinality.get_stats()
         }
 
     def get_anomaly_summary(self, time_range: str = '1h') -> Dict[str, Any]:
@@ -448,36 +683,102 @@ class AILogParser:
             
             # Calculate time range
             hours = {'1h': 1, '6h': 6, '24h': 24, '7d': 168}.get(time_range, 1)
-            start_time = datetime.now() - timedelta(hours=hours)
+            now = datetime.now()
+            start_time = now - timedelta(hours=hours)
+            
+            # Whole closed hours come from the hourly rollups (fed by materialized
+            # views); only the partial first hour and the open hour scan parsed_logs
+            open_hour = now.replace(minute=0, second=0, microsecond=0)
+            first_hour = start_time.replace(minute=0, second=0, microsecond=0)
+            if first_hour < start_time:
+                first_hour += timedelta(hours=1)
+            bounds = [b.strftime('%Y-%m-%d %H:%M:%S') for b in (first_hour, open_hour)]
+            raw_bounds = [start_time.strftime('%Y-%m-%d %H:%M:%S')] + bounds
             
-            # Query for anomalies
+            # Query for anomalies; only per-type aggregates leave the server
             query = """
             SELECT 
                 log_type,
-                COUNT(*) as total_logs,
-                SUM(CASE WHEN risk_score > 60 THEN 1 ELSE 0 END) as high_risk_count,
-                SUM(CASE WHEN anomaly_indicators != '' THEN 1 ELSE 0 END) as anomaly_count,
-                AVG(risk_score) as avg_risk_score,
-                groupArray(anomaly_indicators) as all_anomalies
-            FROM parsed_logs 
-            WHERE timestamp >= %s
+                SUM(total_logs) as total_logs,
+                SUM(high_risk_count) as high_risk_count,
+                SUM(anomaly_count) as anomaly_count,
+                SUM(risk_sum) / SUM(total_logs) as avg_risk_score
+            FROM (
+                SELECT log_type, total_logs, high_risk_count, anomaly_count, risk_sum
+                FROM parsed_logs_hourly
+                WHERE hour >= %s AND hour < %s
+                UNION ALL
+                SELECT 
+                    log_type,
+                    COUNT(*) as total_logs,
+                    SUM(CASE WHEN risk_score > 60 THEN 1 ELSE 0 END) as high_risk_count,
+                    SUM(CASE WHEN notEmpty(anomaly_indicators) THEN 1 ELSE 0 END) as anomaly_count,
+                    SUM(risk_score) as risk_sum
+                FROM parsed_logs 
+                WHERE timestamp >= %s AND (timestamp < %s OR timestamp >= %s)
+                GROUP BY log_type
+                UNION ALL
+                SELECT 
+                    log_type,
+                    COUNT(*) as total_logs,
+                    SUM(CASE WHEN risk_score > 60 THEN 1 ELSE 0 END) as high_risk_count,
+                    SUM(CASE WHEN notEmpty(anomaly_indicators) THEN 1 ELSE 0 END) as anomaly_count,
+                    SUM(risk_score) as risk_sum
+                FROM access_logs 
+                WHERE timestamp >= %s AND (timestamp < %s OR timestamp >= %s)
+                GROUP BY log_type
+            )
             GROUP BY log_type
             ORDER BY high_risk_count DESC
             """
             
-            result = client.execute(query, [start_time.isoformat()])
+            # access_logs rows feed the same hourly rollups; only their raw edges are added here
+            result = client.execute(query, bounds + raw_bounds + raw_bounds)
+            
+            # Count anomaly types server-side
+            top_query = """
+            SELECT 
+                anomaly,
+                SUM(occurrences) as occurrences
+            FROM (
+                SELECT anomaly, occurrences
+                FROM parsed_logs_hourly_anomalies
+                WHERE hour >= %s AND hour < %s
+                UNION ALL
+                SELECT 
+                    anomaly,
+                    COUNT(*) as occurrences
+                FROM parsed_logs 
+                ARRAY JOIN anomaly_indicators AS anomaly
+                WHERE timestamp >= %s AND (timestamp < %s OR timestamp >= %s)
+                GROUP BY anomaly
+                UNION ALL
+                SELECT 
+                    anomaly,
+                    COUNT(*) as occurrences
+                FROM access_logs 
+                ARRAY JOIN anomaly_indicators AS anomaly
+                WHERE timestamp >= %s AND (timestamp < %s OR timestamp >= %s)
+                GROUP BY anomaly
+            )
+            GROUP BY anomaly
+            ORDER BY occurrences DESC
+            LIMIT 10
+            """
+            
+            top_anomalies = client.execute(top_query, bounds + raw_bounds + raw_bounds)
             
             summary = {
                 'time_range': time_range,
                 'log_type_stats': [],
-                'top_anomalies': Counter(),
+                'top_anomalies': {anomaly: occurrences for anomaly, occurrences in top_anomalies},
                 'total_logs': 0,
                 'total_high_risk': 0,
                 'total_anomalies': 0
             }
             
             for row in result:
-                log_type, total, high_risk, anomalies, avg_risk, all_anomalies = row
+                log_type, total, high_risk, anomalies, avg_risk = row
                 
                 summary['log_type_stats'].append({
                     'log_type': log_type,
@@ -490,15 +791,6 @@ class AILogParser:
                 summary['total_logs'] += total
                 summary['total_high_risk'] += high_risk
                 summary['total_anomalies'] += anomalies
-                
-                # Count anomaly types
-                for anomaly_list in all_anomalies:
-                    if anomaly_list:
-                        for anomaly in anomaly_list.split(','):
-                            if anomaly.strip():
-                                summary['top_anomalies'][anomaly.strip()] += 1
-            
-            summary['top_anomalies'] = dict(summary['top_anomalies'].most_common(10))
             
             return summary
             
@@ -506,9 +798,93 @@ class AILogParser:
             logger.error(f"Error getting anomaly summary: {e}")
             return {'error': str(e)}
 
+    def get_traffic_summary(self, time_range: str = '1h', client_ip: str = None) -> Dict[str, Any]:
+        """Web traffic per minute, top clients and top paths from the access_logs rollups"""
+        try:
+            client = self.get_client()
+            
+            hours = {'1h': 1, '6h': 6, '24h': 24, '7d': 168}.get(time_range, 1)
+            start_minute = (datetime.now() - timedelta(hours=hours)).replace(second=0, microsecond=0)
+            
+            # The materialized view aggregates each insert, so the rollup is
+            # current up to the last stored row and raw rows are never scanned
+            where = "minute >= %(start)s"
+            params = {'start': start_minute.strftime('%Y-%m-%d %H:%M:%S')}
+            if client_ip:
+                where += " AND client_ip = %(client_ip)s"
+                params['client_ip'] = client_ip
+            
+            timeline = client.execute(f"""
+            SELECT 
+                minute,
+                SUM(requests) as requests,
+                SUM(status_4xx) as status_4xx,
+                SUM(status_5xx) as status_5xx,
+                SUM(bytes) as bytes,
+                SUM(response_time_sum) / greatest(SUM(timed_requests), 1) as avg_response_ms
+            FROM access_logs_minutely
+            WHERE {where}
+            GROUP BY minute
+            ORDER BY minute
+            """, params)
+            
+            top_clients = client.execute(f"""
+            SELECT 
+                client_ip,
+                SUM(requests) as requests,
+                SUM(status_4xx) as status_4xx,
+                SUM(status_5xx) as status_5xx,
+                SUM(bytes) as bytes
+            FROM access_logs_minutely
+            WHERE {where}
+            GROUP BY client_ip
+            ORDER BY requests DESC
+            LIMIT 10
+            """, params)
+            
+            top_paths = client.execute(f"""
+            SELECT topKMerge({TOP_PATHS})(top_paths)
+            FROM access_logs_minutely
+            WHERE {where}
+            """, params)
+            
+            summary = {
+                'time_range': time_range,
+                'client_ip': client_ip,
+                'timeline': [
+                    {
+                        'minute': minute.isoformat() if isinstance(minute, datetime) else minute,
+                        'requests': requests,
+                        'status_4xx': status_4xx,
+                        'status_5xx': status_5xx,
+                        'bytes': bytes_total,
+                        'avg_response_ms': round(avg_response_ms, 2)
+                    }
+                    for minute, requests, status_4xx, status_5xx, bytes_total, avg_response_ms in timeline
+                ],
+                'top_clients': [
+                    {'client_ip': ip, 'requests': requests, 'status_4xx': status_4xx,
+                     'status_5xx': status_5xx, 'bytes': bytes_total}
+                    for ip, requests, status_4xx, status_5xx, bytes_total in top_clients
+                ],
+                'top_paths': list(top_paths[0][0]) if top_paths else []
+            }
+            summary['total_requests'] = sum(point['requests'] for point in summary['timeline'])
+            summary['total_bytes'] = sum(point['bytes'] for point in summary['timeline'])
+            
+            return summary
+            
+        except Exception as e:
+            logger.error(f"Error getting traffic summary: {e}")
+            return {'error': str(e)}
+
 # Global parser instance
 ai_parser = AILogParser()
 
+# Learned state is snapshotted per worker and restored on the next start;
+# the app starts it, so importing this module (e.g. in pool processes) does not
+state_snapshots = StateSnapshotter(ai_parser, **load_state_snapshots(CONFIG_DIR / 'ai_config.json'))
+
 @ai_parser_bp.route('/parse', methods=['POST'])
 def parse_logs():
     """Parse log entries using AI/ML techniques"""
@@ -521,15 +897,12 @@ def parse_logs():
         if not logs:
             return jsonify({'error': 'No logs provided'}), 400
         
-        results = []
-        for log_line in logs:
-            if isinstance(log_line, str):
-                parsed = ai_parser.extract_fields(log_line)
-                results.append(parsed)
-                
-                # Store in ClickHouse if requested
-                if store_results:
-                    ai_parser.store_parsed_log(parsed)
+        results = ai_parser.extract_batch(logs)
+        
+        # Store in ClickHouse if requested
+        if store_results:
+            for parsed in results:
+                ai_parser.store_parsed_log(parsed)
         
         # Learn from patterns if requested
         if learn_mode and results:
@@ -589,6 +962,16 @@ def analyze_logs():
         logger.error(f"Error analyzing logs: {e}")
         return jsonify({'error': str(e)}), 500
 
+@ai_parser_bp.route('/traffic', methods=['GET'])
+def get_traffic():
+    """Web traffic dashboard data, read from the per-minute access_logs rollups"""
+    try:
+        summary = ai_parser.get_traffic_summary(request.args.get('range', '1h'), request.args.get('client'))
+        return jsonify(summary)
+    except Exception as e:
+        logger.error(f"Error getting traffic summary: {e}")
+        return jsonify({'error': str(e)}), 500
+
 @ai_parser_bp.route('/patterns', methods=['GET'])
 def get_learned_patterns():
     """Get learned patterns and statistics"""
@@ -599,6 +982,29 @@ def get_learned_patterns():
         logger.error(f"Error getting patterns: {e}")
         return jsonify({'error': str(e)}), 500
 
+@ai_parser_bp.route('/sources', methods=['GET'])
+def get_source_cardinalities():
+    """Get distinct and first-seen source counts per host and window"""
+    try:
+        host = request.args.get('host')
+        return jsonify(ai_parser.source_cardinality.get_cardinalities(host))
+    except Exception as e:
+        logger.error(f"Error getting source cardinalities: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@ai_parser_bp.route('/enrichment', methods=['GET'])
+def get_ip_enrichment():
+    """Get site, VLAN, owner and device attributes of an IP address"""
+    try:
+        ip = request.args.get('ip', '')
+        attributes = ai_parser.ip_enrichment.enrich(ip)
+        if attributes is None:
+            return jsonify({'error': f'Invalid IP address: {ip}'}), 400
+        return jsonify(dict(attributes, ip=ip))
+    except Exception as e:
+        logger.error(f"Error enriching IP address: {e}")
+        return jsonify({'error': str(e)}), 500
+
 @ai_parser_bp.route('/train', methods=['POST'])
 def train_parser():
     """Train parser with sample data"""
@@ -609,17 +1015,17 @@ def train_parser():
         if not training_logs:
             return jsonify({'error': 'No training data provided'}), 400
         
-        parsed_logs = []
-        for log_line in training_logs:
-            parsed = ai_parser.extract_fields(log_line)
-            parsed_logs.append(parsed)
+        records = [ai_parser.extract_record(log_line) for log_line in training_logs]
+        parsed_logs = [record.fields for record in records]
         
         ai_parser.learn_patterns(parsed_logs)
+        model = ai_parser.batch_scorer.train(records)
         
         return jsonify({
             'message': 'Training completed',
             'trained_logs': len(parsed_logs),
-            'patterns_learned': len(ai_parser.learned_patterns)
+            'patterns_learned': len(ai_parser.learned_patterns),
+            'model': model
         })
         
     except Exception as e:
@@ -635,6 +1041,9 @@ def health_check():
             'status': 'healthy',
             'patterns_loaded': len(ai_parser.learned_patterns),
             'supported_log_types': len(ai_parser.log_types),
+            'parse_cache': ai_parser.parse_cache.get_stats(),
+            'parse_plans': ai_parser.parse_plans.get_stats(),
+            'state_snapshots': state_snapshots.get_stats(),
             'timestamp': datetime.now().isoformat()
         })
     except Exception as e:
@@ -29,7 +29,8 @@ from utils import (
     hash_password, verify_password, find_user_by_username,
     add_user_to_json, get_ip_info
 )
-from ai_log_parser import ai_parser_bp
+from ai_log_parser import ai_parser_bp, state_snapshots
+from access_logs import TOP_PATHS
 
 # Initialize Flask app
 app = Flask(__name__)
@@ -104,6 +105,223 @@ def get_redis_client():
             redis_client = None
     return redis_client
 
+def check_parsed_logs_anomalies(ch_client):
+    """Report a parsed_logs table still storing anomaly_indicators as a comma-joined String
+    
+    The conversion is a one-off, run once with the API stopped:
+    docker/clickhouse/migrations/parsed_logs_anomaly_array.sql. Workers only check.
+    """
+    result = ch_client.query(
+        "SELECT type FROM system.columns WHERE database = {db:String} "
+        "AND table = 'parsed_logs' AND name = 'anomaly_indicators'",
+        parameters={'db': CLICKHOUSE_DATABASE}
+    )
+    if result.result_rows and result.result_rows[0][0] == 'String':
+        app.logger.error("parsed_logs.anomaly_indicators is still a String column; parsed log inserts will fail "
+                         "until docker/clickhouse/migrations/parsed_logs_anomaly_array.sql is applied")
+
+def add_logs_network_columns(ch_client):
+    """Typed firewall columns filled at ingest by the parser packs, for tables created before them"""
+    table = f"{CLICKHOUSE_DATABASE}.logs"
+    for statement in (
+        f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS src_ip String AFTER parsed_fields",
+        f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS dst_ip String AFTER src_ip",
+        f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS src_port UInt16 AFTER dst_ip",
+        f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS dst_port UInt16 AFTER src_port",
+        f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS action LowCardinality(String) AFTER dst_port",
+        f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS rule_name LowCardinality(String) AFTER action",
+        f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS bytes UInt64 AFTER rule_name",
+        f"ALTER TABLE {table} ADD INDEX IF NOT EXISTS idx_src_ip src_ip TYPE bloom_filter GRANULARITY 4",
+        f"ALTER TABLE {table} ADD INDEX IF NOT EXISTS idx_dst_ip dst_ip TYPE bloom_filter GRANULARITY 4",
+    ):
+        ch_client.command(statement)
+
+def claim_once(ch_client, marker: str) -> bool:
+    """True for the one worker whose CREATE TABLE of ``marker`` succeeds
+    
+    CREATE TABLE without IF NOT EXISTS fails for everyone but the first
+    caller, so a one-time startup step runs once across workers and hosts.
+    The marker table stays as the record that the step ran.
+    """
+    try:
+        ch_client.command(f"CREATE TABLE {CLICKHOUSE_DATABASE}.{marker} (cutoff DateTime) ENGINE = Log")
+        return True
+    except clickhouse_connect.driver.exceptions.DatabaseError as e:
+        app.logger.info(f"Skipping {marker}, claimed by another worker: {e}")
+        return False
+
+def create_parsed_logs_rollups(ch_client):
+    """Hourly parsed_logs partials for incremental /api/ai-parser/analyze"""
+    db = CLICKHOUSE_DATABASE
+    ch_client.command(f"""
+        CREATE TABLE IF NOT EXISTS {db}.parsed_logs_hourly (
+            hour DateTime,
+            log_type LowCardinality(String),
+            total_logs UInt64,
+            high_risk_count UInt64,
+            anomaly_count UInt64,
+            risk_sum Int64
+        ) ENGINE = SummingMergeTree()
+        ORDER BY (hour, log_type)
+        PARTITION BY toYYYYMM(hour)
+        TTL hour + INTERVAL 90 DAY
+    """)
+    ch_client.command(f"""
+        CREATE TABLE IF NOT EXISTS {db}.parsed_logs_hourly_anomalies (
+            hour DateTime,
+            anomaly LowCardinality(String),
+            occurrences UInt64
+        ) ENGINE = SummingMergeTree()
+        ORDER BY (hour, anomaly)
+        PARTITION BY toYYYYMM(hour)
+        TTL hour + INTERVAL 90 DAY
+    """)
+    
+    existing = ch_client.query(
+        "SELECT count() FROM system.tables WHERE database = {db:String} "
+        "AND name IN ('parsed_logs_hourly_mv', 'parsed_logs_hourly_anomalies_mv')",
+        parameters={'db': db}
+    ).result_rows[0][0]
+    if existing == 2:
+        return
+    
+    # Rows stored before the views existed are backfilled once. The cutoff is
+    # taken before the views start counting and on the clock that stamps
+    # created_at (this process's datetime.now()), so no row is counted twice.
+    cutoff = datetime.now().replace(microsecond=0)
+    backfill = existing == 0 and claim_once(ch_client, 'parsed_logs_rollups_backfill')
+    ch_client.command(f"""
+        CREATE MATERIALIZED VIEW IF NOT EXISTS {db}.parsed_logs_hourly_mv
+        TO {db}.parsed_logs_hourly AS
+        SELECT
+            toStartOfHour(timestamp) AS hour,
+            log_type,
+            count() AS total_logs,
+            countIf(risk_score > 60) AS high_risk_count,
+            countIf(notEmpty(anomaly_indicators)) AS anomaly_count,
+            sum(risk_score) AS risk_sum
+        FROM {db}.parsed_logs
+        GROUP BY hour, log_type
+    """)
+    ch_client.command(f"""
+        CREATE MATERIALIZED VIEW IF NOT EXISTS {db}.parsed_logs_hourly_anomalies_mv
+        TO {db}.parsed_logs_hourly_anomalies AS
+        SELECT
+            toStartOfHour(timestamp) AS hour,
+            anomaly,
+            count() AS occurrences
+        FROM {db}.parsed_logs
+        ARRAY JOIN anomaly_indicators AS anomaly
+        GROUP BY hour, anomaly
+    """)
+    
+    if backfill:
+        app.logger.info("Backfilling hourly parsed_logs rollups")
+        ch_client.command(f"""
+            INSERT INTO {db}.parsed_logs_hourly
+            SELECT toStartOfHour(timestamp) AS hour, log_type, count(), countIf(risk_score > 60),
+                   countIf(notEmpty(anomaly_indicators)), sum(risk_score)
+            FROM {db}.parsed_logs
+            WHERE created_at < {{cutoff:DateTime}}
+            GROUP BY hour, log_type
+        """, parameters={'cutoff': cutoff})
+        ch_client.command(f"""
+            INSERT INTO {db}.parsed_logs_hourly_anomalies
+            SELECT toStartOfHour(timestamp) AS hour, anomaly, count()
+            FROM {db}.parsed_logs
+            ARRAY JOIN anomaly_indicators AS anomaly
+            WHERE created_at < {{cutoff:DateTime}}
+            GROUP BY hour, anomaly
+        """, parameters={'cutoff': cutoff})
+        ch_client.command(f"INSERT INTO {db}.parsed_logs_rollups_backfill VALUES ({{cutoff:DateTime}})",
+                          parameters={'cutoff': cutoff})
+
+def create_access_logs_tables(ch_client):
+    """Typed web access table with per-client minute rollups for the traffic dashboard"""
+    db = CLICKHOUSE_DATABASE
+    ch_client.command(f"""
+        CREATE TABLE IF NOT EXISTS {db}.access_logs (
+            timestamp DateTime64(3),
+            log_type LowCardinality(String),
+            client_ip String,
+            method LowCardinality(String),
+            path String,
+            protocol LowCardinality(String),
+            status UInt16,
+            bytes UInt64,
+            referer String,
+            user_agent LowCardinality(String),
+            response_time_ms Float32,
+            risk_score Int32,
+            anomaly_indicators Array(LowCardinality(String)),
+            raw_log String CODEC(ZSTD(3)),
+            created_at DateTime DEFAULT now(),
+            INDEX idx_client_ip client_ip TYPE bloom_filter GRANULARITY 4
+        ) ENGINE = MergeTree()
+        ORDER BY (timestamp, status)
+        PARTITION BY toYYYYMM(timestamp)
+        TTL timestamp + INTERVAL 90 DAY
+    """)
+    ch_client.command(f"""
+        CREATE TABLE IF NOT EXISTS {db}.access_logs_minutely (
+            minute DateTime,
+            client_ip String,
+            requests SimpleAggregateFunction(sum, UInt64),
+            status_4xx SimpleAggregateFunction(sum, UInt64),
+            status_5xx SimpleAggregateFunction(sum, UInt64),
+            bytes SimpleAggregateFunction(sum, UInt64),
+            response_time_sum SimpleAggregateFunction(sum, Float64),
+            timed_requests SimpleAggregateFunction(sum, UInt64),
+            top_paths AggregateFunction(topK({TOP_PATHS}), String)
+        ) ENGINE = AggregatingMergeTree()
+        ORDER BY (minute, client_ip)
+        PARTITION BY toYYYYMM(minute)
+        TTL minute + INTERVAL 90 DAY
+    """)
+    # Query strings are cut off so top paths group by route, not by request
+    ch_client.command(f"""
+        CREATE MATERIALIZED VIEW IF NOT EXISTS {db}.access_logs_minutely_mv
+        TO {db}.access_logs_minutely AS
+        SELECT
+            toStartOfMinute(timestamp) AS minute,
+            client_ip,
+            toUInt64(count()) AS requests,
+            toUInt64(countIf(status >= 400 AND status < 500)) AS status_4xx,
+            toUInt64(countIf(status >= 500)) AS status_5xx,
+            toUInt64(sum(bytes)) AS bytes,
+            toFloat64(sum(response_time_ms)) AS response_time_sum,
+            toUInt64(countIf(response_time_ms > 0)) AS timed_requests,
+            topKState({TOP_PATHS})(splitByChar('?', path)[1]) AS top_paths
+        FROM {db}.access_logs
+        GROUP BY minute, client_ip
+    """)
+    
+    # Access lines no longer reach parsed_logs, so they feed its hourly rollups directly
+    ch_client.command(f"""
+        CREATE MATERIALIZED VIEW IF NOT EXISTS {db}.access_logs_hourly_mv
+        TO {db}.parsed_logs_hourly AS
+        SELECT
+            toStartOfHour(timestamp) AS hour,
+            log_type,
+            count() AS total_logs,
+            countIf(risk_score > 60) AS high_risk_count,
+            countIf(notEmpty(anomaly_indicators)) AS anomaly_count,
+            sum(risk_score) AS risk_sum
+        FROM {db}.access_logs
+        GROUP BY hour, log_type
+    """)
+    ch_client.command(f"""
+        CREATE MATERIALIZED VIEW IF NOT EXISTS {db}.access_logs_hourly_anomalies_mv
+        TO {db}.parsed_logs_hourly_anomalies AS
+        SELECT
+            toStartOfHour(timestamp) AS hour,
+            anomaly,
+            count() AS occurrences
+        FROM {db}.access_logs
+        ARRAY JOIN anomaly_indicators AS anomaly
+        GROUP BY hour, anomaly
+    """)
+
 # Initialize database connections
 @app.before_first_request
 def initialize_connections():
@@ -129,7 +347,16 @@ def initialize_connections():
                     pid Int32,
                     raw_message String,
                     parsed_fields Map(String, String),
-                    created_at DateTime DEFAULT now()
+                    src_ip String,
+                    dst_ip String,
+                    src_port UInt16,
+                    dst_port UInt16,
+                    action LowCardinality(String),
+                    rule_name LowCardinality(String),
+                    bytes UInt64,
+                    created_at DateTime DEFAULT now(),
+                    INDEX idx_src_ip src_ip TYPE bloom_filter GRANULARITY 4,
+                    INDEX idx_dst_ip dst_ip TYPE bloom_filter GRANULARITY 4
                 ) ENGINE = MergeTree()
                 ORDER BY (timestamp, host, source)
                 PARTITION BY toYYYYMM(timestamp)
@@ -181,7 +408,7 @@ def initialize_connections():
                     raw_log String,
                     log_type String,
                     risk_score Int32,
-                    anomaly_indicators String,
+                    anomaly_indicators Array(LowCardinality(String)),
                     confidence Float64,
                     parsed_fields String,
                     source_ip String,
@@ -196,6 +423,11 @@ def initialize_connections():
                 TTL timestamp + INTERVAL 90 DAY
             """)
             
+            add_logs_network_columns(ch_client)
+            check_parsed_logs_anomalies(ch_client)
+            create_parsed_logs_rollups(ch_client)
+            create_access_logs_tables(ch_client)
+            
             app.logger.info("ClickHouse tables created successfully")
         except Exception as e:
             app.logger.error(f"Failed to create ClickHouse tables: {e}")
@@ -526,6 +758,9 @@ def health_check():
 # Register AI parser blueprint
 app.register_blueprint(ai_parser_bp, url_prefix="/api/ai-parser")
 
+# Restore and periodically snapshot the AI parser's learned state in this worker
+state_snapshots.start()
+
 # ================================
 # ERROR HANDLERS
 # ================================
@@ -0,0 +1,302 @@
+"""
+Traffic Baselines for MARSLOG-ClickHouse
+Incremental per-(log_type, host) event-rate baselines by hour of day and day of week
+"""
+
+import json
+import math
+import time
+import threading
+import logging
+from array import array
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, Any, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TRAFFIC_BASELINES = {
+    'bucket_seconds': 60,    # event rate is measured as events per bucket
+    'ewma_alpha': 0.05,      # weight of the newest bucket in the recent-level EWMA
+    'min_samples': 30,       # buckets a baseline needs before it is trusted
+    'max_keys': 2000,        # (log_type, host) pairs kept
+    'max_zero_fill': 64,     # EWMA steps replayed for an idle gap
+}
+
+WEEK_SLOTS = 7 * 24   # (day of week, hour of day)
+WEEK_SECONDS = 7 * 24 * 3600
+HOUR_SLOTS = 24       # hour of day across all days
+_FIELDS = 3           # n, mean, M2 per slot
+
+
+def load_traffic_baselines(config_path: Optional[Path] = None) -> Dict[str, Any]:
+    """Load the traffic baseline settings, falling back to the built-in defaults"""
+    settings = dict(DEFAULT_TRAFFIC_BASELINES)
+    if config_path is None or not Path(config_path).exists():
+        return settings
+
+    try:
+        with open(config_path, 'r') as f:
+            settings.update(json.load(f).get('traffic_baselines', {}))
+    except (json.JSONDecodeError, OSError) as e:
+        logger.error(f"Error loading traffic baseline settings from {config_path}: {e}")
+
+    return settings
+
+
+def _welford(stats: array, slot: int, value: float, count: int = 1) -> None:
+    """Fold ``count`` copies of ``value`` into slot ``slot`` (Chan's parallel update)"""
+    base = slot * _FIELDS
+    n, mean, m2 = stats[base], stats[base + 1], stats[base + 2]
+    total = n + count
+    delta = value - mean
+    stats[base] = total
+    stats[base + 1] = mean + delta * count / total
+    stats[base + 2] = m2 + delta * delta * n * count / total
+
+
+def _moments(stats: array, slot: int) -> Tuple[float, float, float]:
+    base = slot * _FIELDS
+    n, mean, m2 = stats[base], stats[base + 1], stats[base + 2]
+    variance = m2 / (n - 1) if n > 1 else 0.0
+    return n, mean, variance
+
+
+class RateBaseline:
+    """Baseline of one (log_type, host): Welford per week slot and hour, plus EWMA"""
+
+    __slots__ = ('bucket', 'count', 'week_slot', 'week', 'hours',
+                 'ewma_mean', 'ewma_var', 'ewma_n', 'last_seen')
+
+    def __init__(self):
+        self.bucket = None
+        self.count = 0
+        self.week_slot = 0
+        self.week = array('d', bytes(8 * _FIELDS * WEEK_SLOTS))
+        self.hours = array('d', bytes(8 * _FIELDS * HOUR_SLOTS))
+        self.ewma_mean = 0.0
+        self.ewma_var = 0.0
+        self.ewma_n = 0
+        self.last_seen = 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'bucket': self.bucket,
+            'count': self.count,
+            'week_slot': self.week_slot,
+            'week': list(self.week),
+            'hours': list(self.hours),
+            'ewma': [self.ewma_mean, self.ewma_var, self.ewma_n],
+            'last_seen': self.last_seen,
+        }
+
+    def merge(self, other: 'RateBaseline') -> None:
+        """Combine baselines of two shares of one stream (e.g. two workers).
+
+        The shares' rates add, so slot means and variances add (the shares
+        are treated as independent) and the sample count is the larger one.
+        """
+        for mine, theirs in ((self.week, other.week), (self.hours, other.hours)):
+            for base in range(0, len(mine), _FIELDS):
+                n_a, n_b = mine[base], theirs[base]
+                if not n_b:
+                    continue
+                n = max(n_a, n_b)
+                variance = (mine[base + 2] / (n_a - 1) if n_a > 1 else 0.0) + \
+                           (theirs[base + 2] / (n_b - 1) if n_b > 1 else 0.0)
+                mine[base] = n
+                mine[base + 1] += theirs[base + 1]
+                mine[base + 2] = variance * (n - 1) if n > 1 else 0.0
+
+        self.ewma_mean += other.ewma_mean
+        self.ewma_var += other.ewma_var
+        self.ewma_n = max(self.ewma_n, other.ewma_n)
+
+        if other.bucket is not None:
+            if self.bucket is None or other.bucket > self.bucket:
+                self.bucket, self.count, self.week_slot = other.bucket, other.count, other.week_slot
+            elif other.bucket == self.bucket:
+                self.count += other.count
+        self.last_seen = max(self.last_seen, other.last_seen)
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'RateBaseline':
+        baseline = cls()
+        baseline.bucket = data['bucket']
+        baseline.count = data['count']
+        baseline.week_slot = data['week_slot']
+        baseline.week = array('d', data['week'])
+        baseline.hours = array('d', data['hours'])
+        baseline.ewma_mean, baseline.ewma_var, baseline.ewma_n = data['ewma']
+        baseline.last_seen = data['last_seen']
+        return baseline
+
+
+class TrafficObservation:
+    """Deviation of the current bucket from its baseline"""
+
+    __slots__ = ('z_score', 'closed_z_score', 'baseline')
+
+    def __init__(self):
+        self.z_score = None          # running count of the open bucket
+        self.closed_z_score = None   # final count of a bucket closed by this event
+        self.baseline = None         # 'week_slot', 'hour' or 'ewma'
+
+
+class TrafficBaselines:
+    """Event-rate baselines updated in O(1) per parsed event.
+
+    Events are counted into fixed buckets. When a bucket closes its count
+    becomes one sample for the (day of week, hour) slot, the hour-of-day
+    slot and the EWMA of its key; empty buckets in between are folded in as
+    zeros, one step per hour slot they cover. The open bucket is scored against the most specific
+    baseline that has ``min_samples``, so spikes are flagged while they
+    happen and drops when the bucket closes.
+    """
+
+    def __init__(self, bucket_seconds: int = DEFAULT_TRAFFIC_BASELINES['bucket_seconds'],
+                 ewma_alpha: float = DEFAULT_TRAFFIC_BASELINES['ewma_alpha'],
+                 min_samples: int = DEFAULT_TRAFFIC_BASELINES['min_samples'],
+                 max_keys: int = DEFAULT_TRAFFIC_BASELINES['max_keys'],
+                 max_zero_fill: int = DEFAULT_TRAFFIC_BASELINES['max_zero_fill']):
+        self.bucket_seconds = bucket_seconds
+        self.ewma_alpha = ewma_alpha
+        self.min_samples = min_samples
+        self.max_keys = max_keys
+        self.max_zero_fill = max_zero_fill
+        self._keys: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    @staticmethod
+    def _week_slot(bucket_start: float) -> int:
+        moment = datetime.fromtimestamp(bucket_start)
+        return moment.weekday() * 24 + moment.hour
+
+    def _ewma(self, baseline: RateBaseline, value: float) -> None:
+        diff = value - baseline.ewma_mean
+        increment = self.ewma_alpha * diff
+        baseline.ewma_mean += increment
+        baseline.ewma_var = (1 - self.ewma_alpha) * (baseline.ewma_var + diff * increment)
+        baseline.ewma_n += 1
+
+    def _close(self, baseline: RateBaseline, bucket: int) -> None:
+        """Fold the finished bucket (and any empty ones after it) into the baseline"""
+        slot = baseline.week_slot
+        _welford(baseline.week, slot, baseline.count)
+        _welford(baseline.hours, slot % 24, baseline.count)
+        self._ewma(baseline, baseline.count)
+
+        empty = bucket - baseline.bucket - 1
+        if empty > 0:
+            self._fill_gap(baseline, bucket - empty, bucket)
+            for _ in range(min(empty, self.max_zero_fill)):
+                self._ewma(baseline, 0.0)
+
+        baseline.bucket = bucket
+        baseline.count = 0
+        baseline.week_slot = self._week_slot(bucket * self.bucket_seconds)
+
+    def _fill_gap(self, baseline: RateBaseline, first: int, end: int) -> None:
+        """Fold empty buckets ``first``..``end - 1`` as zeros into the slots they fall in.
+
+        Only the last week of a longer gap is folded; every slot has seen
+        its share of it by then.
+        """
+        first = max(first, end - max(1, WEEK_SECONDS // self.bucket_seconds))
+        while first < end:
+            moment = datetime.fromtimestamp(first * self.bucket_seconds)
+            slot = moment.weekday() * 24 + moment.hour
+            next_hour = (moment.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)).timestamp()
+            stop = min(end, max(first + 1, -int(-next_hour // self.bucket_seconds)))
+            _welford(baseline.week, slot, 0.0, stop - first)
+            _welford(baseline.hours, slot % 24, 0.0, stop - first)
+            first = stop
+
+    def _score(self, baseline: RateBaseline, value: float) -> Tuple[Optional[float], Optional[str]]:
+        """Z-score of ``value`` against the most specific trusted baseline"""
+        slot = baseline.week_slot
+        for name, stats, index in (('week_slot', baseline.week, slot),
+                                   ('hour', baseline.hours, slot % 24)):
+            n, mean, variance = _moments(stats, index)
+            if n >= self.min_samples:
+                break
+        else:
+            if baseline.ewma_n < self.min_samples:
+                return None, None
+            name, mean, variance = 'ewma', baseline.ewma_mean, baseline.ewma_var
+
+        # Counts are at least Poisson-noisy; never trust a tighter spread
+        std = max(math.sqrt(variance), math.sqrt(max(mean, 1.0)))
+        return (value - mean) / std, name
+
+    def observe(self, log_type: str, host: str, now: Optional[float] = None) -> TrafficObservation:
+        """Count one event for (log_type, host) and score its bucket"""
+        now = time.time() if now is None else now
+        bucket = int(now // self.bucket_seconds)
+        key = (log_type, host)
+        observation = TrafficObservation()
+
+        with self._lock:
+            baseline = self._keys.get(key)
+            if baseline is None:
+                baseline = self._keys[key] = RateBaseline()
+                baseline.bucket = bucket
+                baseline.week_slot = self._week_slot(bucket * self.bucket_seconds)
+                while len(self._keys) > self.max_keys:
+                    self._keys.popitem(last=False)
+                    self.evictions += 1
+            else:
+                self._keys.move_to_end(key)
+
+            if bucket > baseline.bucket:
+                observation.closed_z_score, _ = self._score(baseline, baseline.count)
+                self._close(baseline, bucket)
+
+            baseline.count += 1
+            baseline.last_seen = now
+            observation.z_score, observation.baseline = self._score(baseline, baseline.count)
+
+        return observation
+
+    def snapshot(self) -> Dict[str, Any]:
+        """JSON-serialisable state, restorable without re-reading history"""
+        with self._lock:
+            return {
+                'bucket_seconds': self.bucket_seconds,
+                'keys': [[log_type, host, baseline.to_dict()]
+                         for (log_type, host), baseline in self._keys.items()],
+            }
+
+    def restore(self, state: Dict[str, Any]) -> None:
+        if state.get('bucket_seconds') != self.bucket_seconds:
+            logger.warning("Traffic baseline snapshot uses a different bucket size; ignored")
+            return
+        with self._lock:
+            self._keys.clear()
+            for log_type, host, data in state.get('keys', [])[-self.max_keys:]:
+                self._keys[(log_type, host)] = RateBaseline.from_dict(data)
+
+    def merge(self, other: 'TrafficBaselines') -> None:
+        """Fold another worker's baselines into this one"""
+        if other.bucket_seconds != self.bucket_seconds:
+            raise ValueError("Traffic baselines with different bucket sizes cannot be merged")
+        with self._lock:
+            for key, baseline in list(other._keys.items()):
+                mine = self._keys.get(key)
+                if mine is None:
+                    mine = self._keys[key] = RateBaseline()
+                mine.merge(baseline)
+            while len(self._keys) > self.max_keys:
+                self._keys.popitem(last=False)
+                self.evictions += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'keys': len(self._keys),
+            'max_keys': self.max_keys,
+            'evictions': self.evictions,
+            'bucket_seconds': self.bucket_seconds,
+            'min_samples': self.min_samples,
+        }
@@ -0,0 +1,262 @@
+"""
+Batch Scoring for MARSLOG-ClickHouse
+NumPy feature matrices for chunks of parsed logs scored by a pluggable outlier model
+"""
+
+import json
+import ipaddress
+import threading
+import logging
+from datetime import datetime
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List, Any, Optional
+
+try:
+    import numpy as np
+except ImportError:  # batch scoring is optional
+    np = None
+
+try:
+    from sklearn.ensemble import IsolationForest
+except ImportError:
+    IsolationForest = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SCORING = {
+    'enabled': True,
+    'model': 'isolation_forest',
+    'min_training_rows': 200,       # /train batches smaller than this leave the model as is
+    'max_training_rows': 100000,
+    'outlier_threshold': 0.0,       # model scores above this flag model_outlier
+    'n_estimators': 100,
+    'contamination': 'auto',
+    'random_state': 42,
+}
+
+# Anomaly names produced by detect_anomalies, one indicator column each
+ANOMALY_FEATURES = [
+    'high_risk_activity', 'multiple_failures', 'brute_force_attempt', 'off_hours_activity',
+    'large_data_transfer', 'rapid_requests', 'repeated_auth_failures', 'first_seen_source',
+    'new_source_surge', 'unusual_traffic', 'traffic_drop', 'suspicious_user_agent',
+]
+NUMERIC_FEATURES = [
+    'risk_score', 'status_class', 'log_bytes', 'source_private', 'source_missing',
+    'hour_sin', 'hour_cos', 'template_id',
+]
+
+
+def load_batch_scoring(config_path: Optional[Path] = None) -> Dict[str, Any]:
+    """Load the batch scoring settings, falling back to the built-in defaults"""
+    settings = dict(DEFAULT_BATCH_SCORING)
+    if config_path is None or not Path(config_path).exists():
+        return settings
+
+    try:
+        with open(config_path, 'r') as f:
+            settings.update(json.load(f).get('batch_scoring', {}))
+    except (json.JSONDecodeError, OSError) as e:
+        logger.error(f"Error loading batch scoring settings from {config_path}: {e}")
+
+    return settings
+
+
+@lru_cache(maxsize=65536)
+def _privacy(ip: str) -> float:
+    """1.0 for a private address, 0.0 for a public one, -1.0 when missing or invalid"""
+    try:
+        return 1.0 if ipaddress.ip_address(ip).is_private else 0.0
+    except ValueError:
+        return -1.0
+
+
+def _hour(timestamp: Optional[str]) -> int:
+    """Hour of a normalized (ISO) timestamp, -1 when unknown"""
+    if timestamp and len(timestamp) >= 13 and timestamp[11:13].isdigit():
+        return int(timestamp[11:13])
+    return -1
+
+
+class ScoringRecord:
+    """A parsed log plus the parse-time context the feature matrix needs"""
+
+    __slots__ = ('fields', 'hits', 'template_id', 'source_ip')
+
+    def __init__(self, fields: Dict[str, Any], hits, template_id: int, source_ip: str):
+        self.fields = fields
+        self.hits = hits
+        self.template_id = template_id
+        self.source_ip = source_ip
+
+
+class IsolationForestModel:
+    """scikit-learn IsolationForest; higher scores are more anomalous"""
+
+    name = 'isolation_forest'
+
+    def __init__(self, n_estimators: int = DEFAULT_BATCH_SCORING['n_estimators'],
+                 contamination=DEFAULT_BATCH_SCORING['contamination'],
+                 random_state: int = DEFAULT_BATCH_SCORING['random_state'], **_):
+        if IsolationForest is None:
+            raise RuntimeError("scikit-learn is not installed")
+        self.estimator = IsolationForest(n_estimators=n_estimators, contamination=contamination,
+                                         random_state=random_state)
+
+    def fit(self, matrix) -> None:
+        self.estimator.fit(matrix)
+
+    def score(self, matrix):
+        return -self.estimator.decision_function(matrix)
+
+
+# Models selectable through batch_scoring.model; register_model adds more
+MODELS = {
+    IsolationForestModel.name: IsolationForestModel,
+}
+
+
+def register_model(name: str, model_class) -> None:
+    """Make ``model_class`` (``fit(matrix)``/``score(matrix)``) selectable by name"""
+    MODELS[name] = model_class
+
+
+class BatchScorer:
+    """Scores chunks of parsed logs with one vectorized model call.
+
+    Rows are reduced to one float32 feature matrix: fired risk rules and
+    anomaly indicators as 0/1 columns, then risk score, status class, log
+    bytes, private/public source, cyclic hour and Drain3 template id. The
+    model is trained on demand (``/train``) and swapped in atomically, so
+    scoring never waits for training.
+    """
+
+    def __init__(self, rule_ids: List[str], enabled: bool = DEFAULT_BATCH_SCORING['enabled'],
+                 model: str = DEFAULT_BATCH_SCORING['model'],
+                 min_training_rows: int = DEFAULT_BATCH_SCORING['min_training_rows'],
+                 max_training_rows: int = DEFAULT_BATCH_SCORING['max_training_rows'],
+                 outlier_threshold: float = DEFAULT_BATCH_SCORING['outlier_threshold'],
+                 **model_settings):
+        if enabled and np is None:
+            logger.warning("Batch scoring requested but numpy is not installed")
+            enabled = False
+        self.enabled = enabled
+        self.model_name = model
+        self.min_training_rows = min_training_rows
+        self.max_training_rows = max_training_rows
+        self.outlier_threshold = outlier_threshold
+        self.model_settings = model_settings
+        self.rule_ids = list(rule_ids)
+        self.feature_names = ([f'rule_{rule_id}' for rule_id in self.rule_ids] +
+                              [f'anomaly_{name}' for name in ANOMALY_FEATURES] + NUMERIC_FEATURES)
+        self._rule_columns = {rule_id: i for i, rule_id in enumerate(self.rule_ids)}
+        self._anomaly_columns = {name: len(self.rule_ids) + i for i, name in enumerate(ANOMALY_FEATURES)}
+
+        self.model = None
+        self.model_version = 0          # bumped on every swap, so copies elsewhere can refresh
+        self._train_lock = threading.Lock()
+        self.trained_rows = 0
+        self.last_trained = None
+        self.batches_scored = 0
+        self.rows_scored = 0
+        self.outliers = 0
+
+    def featurize(self, records: List[ScoringRecord]):
+        """Feature matrix of shape (len(records), len(feature_names))"""
+        n = len(records)
+        indicators = np.zeros((n, len(self.rule_ids) + len(ANOMALY_FEATURES)), dtype=np.float32)
+        rule_columns, anomaly_columns = self._rule_columns, self._anomaly_columns
+        rows, columns = [], []
+        for row, record in enumerate(records):
+            for rule_id in record.hits.rules:
+                column = rule_columns.get(rule_id)
+                if column is not None:
+                    rows.append(row)
+                    columns.append(column)
+            for name in record.fields['anomaly_indicators']:
+                column = anomaly_columns.get(name)
+                if column is not None:
+                    rows.append(row)
+                    columns.append(column)
+        indicators[rows, columns] = 1.0
+
+        # Raw per-row values are gathered once; everything after is array math
+        parsed = [record.fields['parsed_fields'] for record in records]
+        risk = np.fromiter((record.fields['risk_score'] for record in records), np.float32, n)
+        status = np.fromiter((p['status_code'] if isinstance(p.get('status_code'), int) else 0
+                              for p in parsed), np.float32, n)
+        sent = np.fromiter((p['bytes_sent'] if isinstance(p.get('bytes_sent'), int) else 0
+                            for p in parsed), np.float64, n)
+        privacy = np.fromiter((_privacy(record.source_ip) for record in records), np.float32, n)
+        hour = np.fromiter((_hour(record.fields['timestamp']) for record in records), np.float32, n)
+        template = np.fromiter((record.template_id for record in records), np.float32, n)
+
+        angle = hour * (2 * np.pi / 24)
+        known_hour = hour >= 0
+        numeric = np.column_stack((
+            risk,
+            np.floor_divide(status, 100),
+            np.log1p(np.maximum(sent, 0)),
+            privacy == 1.0,
+            privacy < 0,
+            np.where(known_hour, np.sin(angle), 0.0),
+            np.where(known_hour, np.cos(angle), 0.0),
+            template,
+        )).astype(np.float32)
+        return np.hstack((indicators, numeric))
+
+    def train(self, records: List[ScoringRecord]) -> Dict[str, Any]:
+        """Fit a fresh model on ``records`` and swap it in"""
+        if not self.enabled:
+            return {'trained': False, 'reason': 'batch scoring disabled'}
+        if len(records) < self.min_training_rows:
+            return {'trained': False, 'reason': f'need at least {self.min_training_rows} rows'}
+
+        model_class = MODELS.get(self.model_name)
+        if model_class is None:
+            return {'trained': False, 'reason': f'unknown model {self.model_name}'}
+
+        with self._train_lock:
+            try:
+                model = model_class(**self.model_settings)
+                model.fit(self.featurize(records[-self.max_training_rows:]))
+            except Exception as e:
+                logger.error(f"Error training batch scoring model: {e}")
+                return {'trained': False, 'reason': str(e)}
+            self.model = model
+            self.model_version += 1
+            self.trained_rows = min(len(records), self.max_training_rows)
+            self.last_trained = datetime.now().isoformat()
+        return {'trained': True, 'model': self.model_name, 'rows': self.trained_rows}
+
+    def score(self, records: List[ScoringRecord]):
+        """Score ``records`` in one model call; adds model_score and model_outlier"""
+        model = self.model
+        if not self.enabled or model is None or not records:
+            return None
+
+        scores = model.score(self.featurize(records))
+        outliers = scores > self.outlier_threshold
+        for record, score, outlier in zip(records, scores.tolist(), outliers.tolist()):
+            record.fields['model_score'] = round(score, 4)
+            if outlier:
+                record.fields['anomaly_indicators'].append('model_outlier')
+
+        self.batches_scored += 1
+        self.rows_scored += len(records)
+        self.outliers += int(outliers.sum())
+        return scores
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'enabled': self.enabled,
+            'model': self.model_name,
+            'trained': self.model is not None,
+            'model_version': self.model_version,
+            'trained_rows': self.trained_rows,
+            'last_trained': self.last_trained,
+            'features': len(self.feature_names),
+            'batches_scored': self.batches_scored,
+            'rows_scored': self.rows_scored,
+            'outliers': self.outliers,
+        }
@@ -0,0 +1,544 @@
+#!/usr/bin/env python3
+"""
+Benchmark script for MARSLOG AI Log Parser
+Stress-tests parse latency with adversarial inputs against the rule safety guard,
+times each parser stage on synthetic corpora and checks results against a golden file
+
+Usage:
+    bench_ai_parser.py [size] [rounds]          adversarial stress test
+    bench_ai_parser.py batch [rows]             per-line vs batch model scoring
+    bench_ai_parser.py stages [lines_per_type]  per-stage lines/s and allocations
+    bench_ai_parser.py vendors [lines]          vendor parser pack throughput and field coverage
+    bench_ai_parser.py cache [lines_per_type]   end-to-end lines/s with the parse cache and plans on/off
+    bench_ai_parser.py golden [path] [--update] compare (or rewrite) golden output
+
+Run it as a script from any directory, e.g. ``python docker/flask-api/bench_ai_parser.py golden``;
+the golden check exits non-zero when the output differs from bench_golden.jsonl.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import types
+import statistics
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+
+# The parser modules import each other package-relatively and this directory's
+# name is not a valid module name, so it is registered as the package flask_api
+_PACKAGE = types.ModuleType('flask_api')
+_PACKAGE.__path__ = [str(Path(__file__).resolve().parent)]
+sys.modules.setdefault('flask_api', _PACKAGE)
+
+import flask_api.utils
+
+
+def bench_clickhouse_client():
+    """ClickHouse client for the parser's get_client, connected only if something stores rows"""
+    import clickhouse_connect
+    return clickhouse_connect.get_client(
+        host=os.getenv('CLICKHOUSE_HOST', 'clickhouse'),
+        port=int(os.getenv('CLICKHOUSE_PORT', 9000)),
+        username=os.getenv('CLICKHOUSE_USER', 'default'),
+        password=os.getenv('CLICKHOUSE_PASSWORD', ''),
+        database=os.getenv('CLICKHOUSE_DATABASE', 'marslog')
+    )
+
+
+# ai_log_parser imports get_clickhouse_client from utils, which does not define
+# it; the benchmark never stores rows, so it supplies its own
+flask_api.utils.get_clickhouse_client = bench_clickhouse_client
+
+from flask_api.ai_log_parser import AILogParser
+from flask_api.vendor_packs import VENDOR_PACKS, typed_columns
+
+MAX_MESSAGE = 65535  # store_log keeps messages up to this many characters
+
+GOLDEN_PATH = Path(__file__).with_name('bench_golden.jsonl')
+GOLDEN_LINES_PER_TYPE = 20
+
+# Anomalies that depend on wall-clock rates or on earlier lines, and the
+# model score (depends on what was trained); left out of golden output
+STATEFUL_ANOMALIES = {
+    'rapid_requests', 'repeated_auth_failures', 'first_seen_source', 'new_source_surge',
+    'unusual_traffic', 'traffic_drop', 'model_outlier',
+}
+
+
+def adversarial_lines(size: int = MAX_MESSAGE) -> dict:
+    """Crafted lines that drive backtracking regexes towards their worst case"""
+    return {
+        'identifier_run': 'a' * size,                                    # process name rule
+        'email_dots': 'a.' * (size // 2),                                # email rule
+        'brute_repeat': 'brute ' * (size // 6),                          # brute.*force
+        'failed_digits': 'failed 1 ' * (size // 9),                      # failed.*(\d+).*times?
+        'crawler_google': 'bot ' * (size // 4) + 'google',               # (bot|...)(?!.*google)
+        'union_repeat': 'union ' * (size // 6),                          # union.*select
+        'path_segments': '/' + 'a/' * (size // 2),                       # file_path rule
+        'firewall_spaces': '2025-07-11 14:55:35 DROP x' + ' ' * (size - 30),  # firewall type
+        'open_quote': '"' + 'x' * (size - 1),                            # user agent rule
+        'whitespace': ' ' * size,
+    }
+
+
+def percentile(samples: list, pct: float) -> float:
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def run_stress(parser: AILogParser, size: int = MAX_MESSAGE, rounds: int = 20) -> dict:
+    """Time extract_fields on every adversarial line and report latency in ms"""
+    results = {}
+    for name, line in adversarial_lines(size).items():
+        samples = []
+        for _ in range(rounds):
+            start = time.perf_counter()
+            parser.extract_fields(line)
+            samples.append((time.perf_counter() - start) * 1000)
+        results[name] = {
+            'p50_ms': round(statistics.median(samples), 2),
+            'p99_ms': round(percentile(samples, 99), 2),
+            'max_ms': round(max(samples), 2),
+        }
+    return results
+
+
+def sample_lines(count: int, seed: int = 7) -> list:
+    """Realistic mixed traffic: access, auth, firewall and app lines"""
+    rng = random.Random(seed)
+    templates = [
+        lambda: (f'{rng.choice(["10.0.0.", "192.168.1.", "203.0.113."])}{rng.randint(1, 254)} - - '
+                 f'[11/Jul/2025:{rng.randint(0, 23):02d}:55:23 +0000] "GET /page/{rng.randint(1, 50)} HTTP/1.1" '
+                 f'{rng.choice([200, 200, 200, 301, 404, 401, 500])} {rng.randint(0, 20000)}'),
+        lambda: (f'Jul 11 {rng.randint(0, 23):02d}:55:26 webapp-0{rng.randint(1, 4)} sshd[{rng.randint(100, 9999)}]: '
+                 f'{rng.choice(["Failed", "Accepted"])} password for {rng.choice(["root", "admin", "bob"])} '
+                 f'from 192.168.1.{rng.randint(1, 254)} port 22 ssh2'),
+        lambda: (f'Jul 11 14:55:28 firewall-01 kernel: iptables: DROPPED: SRC=198.51.100.{rng.randint(1, 254)} '
+                 f'DST=10.0.0.1 PROTO=TCP SPT={rng.randint(1024, 65535)} DPT={rng.choice([22, 80, 443])}'),
+        lambda: (f'2025-07-11T{rng.randint(0, 23):02d}:55:36.123Z {rng.choice(["INFO", "ERROR"])} payment-svc '
+                 f'user={rng.choice(["alice", "carol"])} src=10.1.1.{rng.randint(1, 254)} dst=10.2.2.2'),
+    ]
+    return [rng.choice(templates)() for _ in range(count)]
+
+
+def run_batch_scoring(parser: AILogParser, count: int = 20000) -> dict:
+    """Throughput of the per-line risk scorer versus featurize + one model call"""
+    records = [parser.extract_record(line) for line in sample_lines(count)]
+    scorer = parser.batch_scorer
+    scorer.min_training_rows = 0
+    scorer.train(records)
+
+    start = time.perf_counter()
+    for record in records:
+        parser.calculate_risk_score(record.fields['raw_log'], record.fields['parsed_fields'])
+    per_line = time.perf_counter() - start
+
+    start = time.perf_counter()
+    matrix = scorer.featurize(records)
+    featurize = time.perf_counter() - start
+    start = time.perf_counter()
+    scorer.model.score(matrix)
+    model = time.perf_counter() - start
+
+    return {
+        'rows': count,
+        'features': matrix.shape[1],
+        'per_line_rows_per_sec': round(count / per_line),
+        'batch_rows_per_sec': round(count / (featurize + model)),
+        'featurize_ms': round(featurize * 1000, 1),
+        'model_ms': round(model * 1000, 1),
+    }
+
+
+def _ip(rng: random.Random) -> str:
+    return rng.choice([f'10.0.{rng.randint(0, 255)}.{rng.randint(1, 254)}',
+                       f'192.168.{rng.randint(0, 10)}.{rng.randint(1, 254)}',
+                       f'203.0.113.{rng.randint(1, 254)}',
+                       f'{rng.randint(1, 223)}.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(1, 254)}'])
+
+
+def _clock(rng: random.Random) -> str:
+    return f'{rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}:{rng.randint(0, 59):02d}'
+
+
+def _syslog_time(rng: random.Random) -> str:
+    return f'{rng.choice(["Jan", "Mar", "Jul", "Nov"])} {rng.randint(1, 28):2d} {_clock(rng)}'
+
+
+def _iso_date(rng: random.Random, sep: str = '-') -> str:
+    return f'2025{sep}{rng.randint(1, 12):02d}{sep}{rng.randint(1, 28):02d}'
+
+
+def _access(rng: random.Random) -> str:
+    method = rng.choice(['GET', 'GET', 'POST', 'PUT', 'DELETE'])
+    path = rng.choice(['/', '/index.php', '/api/users', '/admin/login.php', '/static/app.js',
+                       '/../../etc/passwd', '/search?q=1 union select password from users'])
+    status = rng.choice([200, 200, 200, 204, 301, 304, 401, 403, 404, 500, 503])
+    return (f'{_ip(rng)} - {rng.choice(["-", "bob", "admin"])} [{rng.randint(1, 28):02d}/Jul/2025:{_clock(rng)} +0000] '
+            f'"{method} {path} HTTP/1.1" {status} {rng.randint(0, 90000)} "-" '
+            f'"{rng.choice(["Mozilla/5.0", "curl/8.0", "sqlmap/1.5", "Googlebot/2.1"])}"')
+
+
+# One generator per supported log_type (nginx_access lines share the
+# combined format, so they are detected as apache_access like in production)
+CORPUS_GENERATORS = {
+    'apache_access': _access,
+    'nginx_access': _access,
+    'apache_error': lambda rng: (
+        f'[{rng.randint(1, 28):02d}/Jul/2025:{_clock(rng)} +0000] [{rng.choice(["error", "warn", "notice"])}] '
+        f'[client {_ip(rng)}] {rng.choice(["File does not exist: /var/www/html/x.bak", "script not found", "timeout"])}'),
+    'syslog': lambda rng: (
+        f'{_syslog_time(rng)} {rng.choice(["web-01", "db-02", "cache-03"])} '
+        f'{rng.choice(["cron", "systemd", "kernel", "nginx"])}[{rng.randint(1, 65535)}]: '
+        f'{rng.choice(["session opened for user root", "Started daily cleanup", "Out of memory: kill process"])}'),
+    'windows_event': lambda rng: (
+        f'{_iso_date(rng)} {_clock(rng)} {rng.choice(["DC01", "WS-114"])} '
+        f'{rng.choice(["Security", "System"])} EventID={rng.choice([4624, 4625, 4672, 7036])} '
+        f'user={rng.choice(["alice", "administrator", "svc_backup"])}'),
+    'firewall': lambda rng: (
+        f'{_iso_date(rng)} {_clock(rng)} {rng.choice(["DROP", "ACCEPT", "REJECT"])} '
+        f'{rng.choice(["TCP", "UDP"])} in SRC={_ip(rng)} DST={_ip(rng)}'),
+    'auth_log': lambda rng: (
+        f'{_syslog_time(rng)} {rng.choice(["bastion", "web-01"])} sshd[{rng.randint(100, 65535)}]: '
+        f'{rng.choice(["Failed", "Accepted"])} password for {rng.choice(["root", "admin", "deploy"])} '
+        f'from {_ip(rng)} port {rng.randint(1024, 65535)} ssh2'),
+    'cisco_asa': lambda rng: (
+        f'{_syslog_time(rng)} fw01 %ASA-{rng.randint(1, 6)}-{rng.choice([106023, 302013, 113019, 605005])}: '
+        f'Deny tcp src outside:{_ip(rng)}/{rng.randint(1024, 65535)} dst inside:{_ip(rng)}/443 by access-group "OUT"'),
+    'palo_alto': lambda rng: (
+        f'{_iso_date(rng, "/")} {_clock(rng)},0018010{rng.randint(10000, 99999)},'
+        f'{rng.choice(["TRAFFIC", "THREAT"])},{rng.choice(["end", "drop", "url"])},2049,'
+        f'{_iso_date(rng, "/")} {_clock(rng)},{_ip(rng)},{_ip(rng)}'),
+    'json_log': lambda rng: json.dumps({
+        'timestamp': f'{_iso_date(rng)}T{_clock(rng)}.{rng.randint(0, 999):03d}Z',
+        'level': rng.choice(['info', 'warn', 'error']),
+        'msg': rng.choice(['request served', 'login failed', 'payment declined', 'union select attempt']),
+        'http': {'status': rng.choice([200, 401, 500]), 'bytes_sent': rng.randint(0, 5000)},
+        'client': {'ip': _ip(rng), 'geo': {'country': rng.choice(['US', 'DE', 'BR'])}},
+    }),
+    'unknown': lambda rng: ' '.join(rng.choice([
+        'heartbeat', 'ok', 'queue', 'depth', str(rng.randint(0, 999)), 'worker', 'restarted',
+        'failed', 'denied', 'admin', _ip(rng), 'user=bob', 'brute', 'force', '-', '/var/log/app.log',
+    ]) for _ in range(rng.randint(3, 14))),
+    'adversarial': lambda rng: rng.choice(list(adversarial_lines(rng.randint(256, 4096)).values())),
+}
+
+
+def _asa(rng: random.Random) -> str:
+    src, dst = f'outside:{_ip(rng)}/{rng.randint(1024, 65535)}', f'inside:{_ip(rng)}/{rng.choice([22, 53, 443])}'
+    session = rng.randint(10**5, 10**7)
+    body = rng.choice([
+        ('4-106023', f'Deny tcp src {src} dst {dst} by access-group "OUTSIDE_IN" [0x0, 0x0]'),
+        ('6-106100', f'access-list inside_in permitted tcp inside/{_ip(rng)}({rng.randint(1024, 65535)}) -> '
+                     f'outside/{_ip(rng)}(443) hit-cnt 1 first hit [0x1, 0x0]'),
+        ('6-302013', f'Built inbound TCP connection {session} for {src} ({src.split(":")[1]}) to {dst} ({dst.split(":")[1]})'),
+        ('6-302014', f'Teardown TCP connection {session} for {src} to {dst} duration 0:00:{rng.randint(10, 59)} '
+                     f'bytes {rng.randint(0, 10**7)} TCP FINs'),
+        ('6-302016', f'Teardown UDP connection {session} for {src} to {dst} duration 0:02:01 bytes {rng.randint(0, 9999)}'),
+        ('5-111008', f'User \'enable_15\' executed the \'write memory\' command.'),
+    ])
+    return f'{_syslog_time(rng)} fw01 %ASA-{body[0]}: {body[1]}'
+
+
+def _panos(rng: random.Random) -> str:
+    kind = rng.choice(['TRAFFIC', 'THREAT'])
+    when = f'{_iso_date(rng, "/")} {_clock(rng)}'
+    common = [when, f'0018010{rng.randint(10000, 99999)}', kind, rng.choice(['end', 'drop', 'url']), '2049', when,
+              _ip(rng), _ip(rng), '', '', rng.choice(['allow-web', 'deny-all', 'dns']), '', '',
+              rng.choice(['web-browsing', 'ssl', 'dns']), 'vsys1', 'trust', 'untrust', 'ethernet1/1', 'ethernet1/2',
+              'fwd', when, str(rng.randint(1, 10**6)), '1', str(rng.randint(1024, 65535)),
+              str(rng.choice([53, 80, 443])), '0', '0', '0x19', rng.choice(['tcp', 'udp']),
+              rng.choice(['allow', 'deny', 'drop'])]
+    if kind == 'TRAFFIC':
+        sent, received = rng.randint(0, 10**6), rng.randint(0, 10**7)
+        rest = [str(sent + received), str(sent), str(received), '12', when, '3', 'any', '0',
+                str(rng.randint(1, 10**9)), '0x0', 'US', 'US', '0', '6', '6', 'aged-out']
+    else:
+        rest = [f'"www.example.com/search?q={rng.randint(0, 999)},x"', '(9999)', 'search-engines', 'informational',
+                'client-to-server', str(rng.randint(1, 10**9)), '0x0', 'US', 'US', '0', 'text/html', '0', '', '', '1',
+                '"Mozilla/5.0 (X11, Linux x86_64)"', '', '', '']
+    return ','.join(common + rest)
+
+
+VENDOR_GENERATORS = {
+    'cisco_asa': _asa,
+    'palo_alto': _panos,
+}
+
+
+def synthetic_corpus(lines_per_type: int, seed: int = 11) -> dict:
+    """Deterministic synthetic lines keyed by the log_type they imitate"""
+    rng = random.Random(seed)
+    return {name: [generate(rng) for _ in range(lines_per_type)]
+            for name, generate in CORPUS_GENERATORS.items()}
+
+
+def _stage_inputs(parser: AILogParser, lines: list) -> list:
+    """Per-line inputs for each stage, from one untimed full extraction"""
+    inputs = []
+    for line in lines:
+        scan_line = parser.rule_safety.clip(line)
+        log_type = parser.detect_log_type(scan_line)
+        record = parser.extract_record(line, log_type)
+        inputs.append((line, scan_line, log_type, record.fields, record.hits))
+    return inputs
+
+
+def _stages(parser: AILogParser) -> dict:
+    """Each stage as a function of one stage input tuple"""
+    def extract_families(item):
+        line, scan_line, log_type, fields, hits = item
+        parser.extract_family_matches(scan_line, parser.extract_stable_fields(scan_line, log_type))
+
+    def parse_by_type(item):
+        line, scan_line, log_type, fields, hits = item
+        if log_type in parser.log_types:
+            match = parser.rule_safety.search(parser.compiled_log_types[log_type], scan_line)
+            if match:
+                parser.parse_by_type(match, log_type)
+
+    return {
+        'detect_log_type': lambda item: parser.detect_log_type(item[0]),
+        'field_extraction': extract_families,
+        'parse_by_type': parse_by_type,
+        'calculate_risk_score': lambda item: parser.calculate_risk_score(item[0], item[3]['parsed_fields']),
+        'detect_anomalies': lambda item: parser.detect_anomalies(item[3], item[4]),
+        'extract_fields (end to end)': lambda item: parser.extract_fields(item[0]),
+    }
+
+
+def run_stages(parser: AILogParser, lines: list, alloc_sample: int = 2000) -> dict:
+    """Lines/s and allocated bytes per line for every parser stage"""
+    inputs = _stage_inputs(parser, lines)
+    sample = inputs[:alloc_sample]
+    results = {}
+    for name, stage in _stages(parser).items():
+        start = time.perf_counter()
+        for item in inputs:
+            stage(item)
+        elapsed = time.perf_counter() - start
+
+        # Peak traced memory above the level before each call
+        tracemalloc.start()
+        allocated = 0
+        for item in sample:
+            before, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            stage(item)
+            allocated += tracemalloc.get_traced_memory()[1] - before
+        tracemalloc.stop()
+
+        results[name] = {
+            'lines_per_sec': round(len(inputs) / elapsed) if elapsed else 0,
+            'us_per_line': round(elapsed / len(inputs) * 1e6, 1),
+            'peak_alloc_bytes_per_line': round(allocated / max(len(sample), 1)),
+        }
+    return results
+
+
+def main_stages():
+    lines_per_type = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    corpus = synthetic_corpus(lines_per_type)
+    lines = [line for group in corpus.values() for line in group]
+    random.Random(3).shuffle(lines)
+
+    parser = AILogParser()
+    print("⏱️  AI Log Parser per-stage benchmark")
+    print("=" * 60)
+    print(f"Corpus: {len(lines)} lines, {lines_per_type} per type "
+          f"({', '.join(corpus)})")
+    print()
+
+    results = run_stages(parser, lines)
+    print(f"{'stage':<30}{'lines/s':>12}{'us/line':>10}{'peak B/line':>14}")
+    for name, timing in results.items():
+        print(f"{name:<30}{timing['lines_per_sec']:>12}{timing['us_per_line']:>10}"
+              f"{timing['peak_alloc_bytes_per_line']:>14}")
+
+
+def run_vendors(parser: AILogParser, count: int = 50000) -> dict:
+    """Lines/s of the header regex alone and of each vendor pack, with typed-column coverage"""
+    rng = random.Random(5)
+    results = {}
+    for vendor, generate in VENDOR_GENERATORS.items():
+        lines = [generate(rng) for _ in range(count)]
+        rule = parser.compiled_log_types[vendor]
+        extract = VENDOR_PACKS[vendor]
+
+        start = time.perf_counter()
+        for line in lines:
+            parser.rule_safety.search(rule, line)
+        regex_elapsed = time.perf_counter() - start
+
+        start = time.perf_counter()
+        parsed = [extract(line) for line in lines]
+        pack_elapsed = time.perf_counter() - start
+
+        columns = [typed_columns(fields) for fields in parsed]
+        results[vendor] = {
+            'lines': count,
+            'regex_lines_per_sec': round(count / regex_elapsed),
+            'pack_lines_per_sec': round(count / pack_elapsed),
+            'fields_per_line': round(sum(len(fields or {}) for fields in parsed) / count, 1),
+            'typed_src_dst': round(sum(1 for c in columns if c['src_ip'] and c['dst_ip']) / count * 100, 1),
+            'typed_action': round(sum(1 for c in columns if c['action']) / count * 100, 1),
+        }
+    return results
+
+
+def main_vendors():
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 50000
+    parser = AILogParser()
+    print("⏱️  Vendor parser pack benchmark")
+    print("=" * 60)
+    print(f"{'vendor':<12}{'regex lines/s':>15}{'pack lines/s':>14}{'fields':>8}{'src+dst %':>11}{'action %':>10}")
+    for vendor, result in run_vendors(parser, count).items():
+        print(f"{vendor:<12}{result['regex_lines_per_sec']:>15}{result['pack_lines_per_sec']:>14}"
+              f"{result['fields_per_line']:>8}{result['typed_src_dst']:>11}{result['typed_action']:>10}")
+    print()
+    print("regex: the log_types header pattern alone (old capture); pack: full vendor extraction")
+
+
+def golden_view(fields: dict) -> dict:
+    """The deterministic part of an extract_fields result"""
+    view = dict(fields)
+    view.pop('model_score', None)
+    view['anomaly_indicators'] = [a for a in fields['anomaly_indicators'] if a not in STATEFUL_ANOMALIES]
+    # Year-less timestamps (syslog) are completed with the current year
+    year = str(datetime.now().year)
+    if view['timestamp'] and view['timestamp'].startswith(year):
+        view['timestamp'] = 'YYYY' + view['timestamp'][len(year):]
+    return view
+
+
+def golden_results(parser: AILogParser) -> list:
+    corpus = synthetic_corpus(GOLDEN_LINES_PER_TYPE)
+    return [golden_view(parser.extract_fields(line)) for group in corpus.values() for line in group]
+
+
+def check_golden(parser: AILogParser, path: Path = GOLDEN_PATH) -> list:
+    """Indexes and (expected, actual) pairs of lines whose result changed"""
+    with open(path, 'r') as f:
+        expected = [json.loads(line) for line in f if line.strip()]
+    actual = [json.loads(json.dumps(result, sort_keys=True, default=str)) for result in golden_results(parser)]
+    if len(expected) != len(actual):
+        return [(-1, f'{len(expected)} lines', f'{len(actual)} lines')]
+    return [(i, want, got) for i, (want, got) in enumerate(zip(expected, actual)) if want != got]
+
+
+def main_golden():
+    args = [arg for arg in sys.argv[2:] if arg != '--update']
+    path = Path(args[0]) if args else GOLDEN_PATH
+    parser = AILogParser()
+
+    if '--update' in sys.argv:
+        with open(path, 'w') as f:
+            for result in golden_results(parser):
+                f.write(json.dumps(result, sort_keys=True, default=str) + '\n')
+        print(f"Golden output written to {path}")
+        return
+
+    mismatches = check_golden(parser, path)
+    if not mismatches:
+        print(f"✅ Golden output matches {path}")
+        return
+    print(f"❌ {len(mismatches)} result(s) differ from {path}")
+    for index, want, got in mismatches[:5]:
+        print(f"  line {index}:")
+        print(f"    expected: {json.dumps(want, sort_keys=True)[:300]}")
+        print(f"    actual:   {json.dumps(got, sort_keys=True)[:300]}")
+    sys.exit(1)
+
+
+def run_cache(lines: list) -> dict:
+    """End-to-end lines/s of a fresh parser with the parse cache and parse plans toggled"""
+    results = {}
+    for cache in (False, True):
+        for plans in (False, True):
+            parser = AILogParser()
+            if not cache:
+                parser.parse_cache.max_bytes = 0
+            parser.parse_plans.enabled = plans and parser.parse_plans.enabled
+            start = time.perf_counter()
+            for line in lines:
+                parser.extract_fields(line)
+            elapsed = time.perf_counter() - start
+            results[(cache, plans)] = {
+                'lines_per_sec': round(len(lines) / elapsed),
+                'cache': parser.parse_cache.get_stats(),
+            }
+    return results
+
+
+def main_cache():
+    lines_per_type = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    corpus = synthetic_corpus(lines_per_type)
+    unique = [line for group in corpus.values() for line in group]
+    random.Random(3).shuffle(unique)
+    # Health checks and repeated denies: a few lines per type, many times each
+    repeated = [line for group in corpus.values() for line in group[:max(lines_per_type // 20, 1)]] * 20
+    random.Random(3).shuffle(repeated)
+
+    print("⏱️  AI Log Parser parse cache benchmark")
+    print("=" * 60)
+    print(f"{'corpus':<12}{'cache':>7}{'plans':>7}{'lines/s':>10}{'hit ratio':>11}{'bypassed':>10}")
+    for name, lines in (('unique', unique), ('repeated', repeated)):
+        for (cache, plans), timing in run_cache(lines).items():
+            stats = timing['cache']
+            print(f"{name:<12}{'on' if cache else 'off':>7}{'on' if plans else 'off':>7}"
+                  f"{timing['lines_per_sec']:>10}{stats['hit_ratio']:>11}{stats.get('bypassed', 0):>10}")
+
+
+def main_batch():
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+    parser = AILogParser()
+    if not parser.batch_scorer.enabled:
+        print("Batch scoring is disabled (numpy missing or batch_scoring.enabled false)")
+        return
+
+    print("⏱️  AI Log Parser batch scoring benchmark")
+    print("=" * 60)
+    results = run_batch_scoring(parser, count)
+    print(f"Rows: {results['rows']}, features: {results['features']}, model: {parser.batch_scorer.model_name}")
+    print(f"Per-line risk scorer: {results['per_line_rows_per_sec']:>10} rows/s")
+    print(f"Batch featurize+score: {results['batch_rows_per_sec']:>9} rows/s "
+          f"(featurize {results['featurize_ms']} ms, model {results['model_ms']} ms)")
+
+
+def main():
+    modes = {'batch': main_batch, 'stages': main_stages, 'golden': main_golden, 'vendors': main_vendors,
+             'cache': main_cache}
+    if len(sys.argv) > 1 and sys.argv[1] in modes:
+        modes[sys.argv[1]]()
+        return
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else MAX_MESSAGE
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+    parser = AILogParser()
+    safety = parser.rule_safety.get_stats()
+
+    print("⏱️  AI Log Parser adversarial stress benchmark")
+    print("=" * 60)
+    print(f"Line size: {size} chars, rounds: {rounds}")
+    print(f"Scan budget: {safety['max_scan_length']} chars, "
+          f"max repeat: {safety['max_repeat']}, timeout: {safety['match_timeout']}")
+    print(f"Flagged rules: {', '.join(safety['flagged_rules']) or 'none'}")
+    print()
+
+    results = run_stress(parser, size, rounds)
+    print(f"{'input':<20}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for name, timing in results.items():
+        print(f"{name:<20}{timing['p50_ms']:>10}{timing['p99_ms']:>10}{timing['max_ms']:>10}")
+
+    overall = max(timing['p99_ms'] for timing in results.values())
+    print()
+    print(f"Worst p99: {overall} ms")
+    print(f"Budget exceeded: {parser.rule_safety.get_stats()['budget_exceeded'] or 'never'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,288 @@
+"""
+Source Cardinality for MARSLOG-ClickHouse
+HyperLogLog distinct-source counts per host and window with a first-seen filter
+"""
+
+import json
+import math
+import time
+import hashlib
+import threading
+import logging
+from collections import OrderedDict, deque
+from pathlib import Path
+from typing import Dict, List, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SOURCE_CARDINALITY = {
+    'precision': 10,               # 2**10 one-byte registers per HLL (~3% error)
+    'window_seconds': 3600,        # matches new_source_threshold (per hour)
+    'history_windows': 24,         # closed window estimates kept per host
+    'max_hosts': 1000,
+    'seen_capacity': 1000000,      # sources per filter generation
+    'seen_error_rate': 0.01,
+}
+
+
+def load_source_cardinality(config_path: Optional[Path] = None) -> Dict[str, Any]:
+    """Load the source cardinality settings, falling back to the built-in defaults"""
+    settings = dict(DEFAULT_SOURCE_CARDINALITY)
+    if config_path is None or not Path(config_path).exists():
+        return settings
+
+    try:
+        with open(config_path, 'r') as f:
+            settings.update(json.load(f).get('source_cardinality', {}))
+    except (json.JSONDecodeError, OSError) as e:
+        logger.error(f"Error loading source cardinality settings from {config_path}: {e}")
+
+    return settings
+
+
+def _hash64(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode('utf-8', 'surrogatepass'), digest_size=8).digest(), 'little')
+
+
+class HyperLogLog:
+    """Distinct-count estimate in 2**precision one-byte registers.
+
+    The harmonic sum and the number of empty registers are maintained on
+    every register change, so ``count`` is O(1) on the parse path.
+    """
+
+    __slots__ = ('precision', 'registers', '_inverse_sum', '_zeros')
+
+    def __init__(self, precision: int = DEFAULT_SOURCE_CARDINALITY['precision']):
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+        self._inverse_sum = float(len(self.registers))
+        self._zeros = len(self.registers)
+
+    def add_hash(self, hashed: int) -> None:
+        index = hashed >> (64 - self.precision)
+        rest = hashed & ((1 << (64 - self.precision)) - 1)
+        rank = (64 - self.precision) - rest.bit_length() + 1
+        current = self.registers[index]
+        if rank > current:
+            self.registers[index] = rank
+            self._inverse_sum += 2.0 ** -rank - 2.0 ** -current
+            if current == 0:
+                self._zeros -= 1
+
+    def add(self, value: str) -> None:
+        self.add_hash(_hash64(value))
+
+    def count(self) -> int:
+        size = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / size)
+        estimate = alpha * size * size / self._inverse_sum
+        if estimate <= 2.5 * size and self._zeros:
+            estimate = size * math.log(size / self._zeros)  # linear counting for small sets
+        return int(round(estimate))
+
+    def merge(self, other: 'HyperLogLog') -> None:
+        if self.precision != other.precision:
+            raise ValueError("HyperLogLogs of different precision cannot be merged")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        self._recount()
+
+    def _recount(self) -> None:
+        self._inverse_sum = sum(2.0 ** -register for register in self.registers)
+        self._zeros = self.registers.count(0)
+
+
+class SeenFilter:
+    """Compact "seen before" test: two rotating Bloom filter generations.
+
+    Lookups check both generations. Once the current generation has taken
+    ``capacity`` inserts it becomes the previous one and a fresh generation
+    starts, so memory stays fixed and sources unseen for two generations are
+    eventually treated as new again.
+    """
+
+    def __init__(self, capacity: int = DEFAULT_SOURCE_CARDINALITY['seen_capacity'],
+                 error_rate: float = DEFAULT_SOURCE_CARDINALITY['seen_error_rate']):
+        self.capacity = capacity
+        self.bits = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hashes = max(1, int(round(self.bits / capacity * math.log(2))))
+        self.current = bytearray((self.bits + 7) // 8)
+        self.previous = bytearray((self.bits + 7) // 8)
+        self.inserted = 0
+        self.rotations = 0
+
+    def _positions(self, hashed: int) -> List[int]:
+        first, step = hashed & 0xFFFFFFFF, (hashed >> 32) | 1
+        return [(first + i * step) % self.bits for i in range(self.hashes)]
+
+    @staticmethod
+    def _contains(bits: bytearray, positions: List[int]) -> bool:
+        return all(bits[p >> 3] & (1 << (p & 7)) for p in positions)
+
+    def check_and_add(self, hashed: int) -> bool:
+        """Return True when ``hashed`` was (probably) seen before; record it either way"""
+        positions = self._positions(hashed)
+        if self._contains(self.current, positions):
+            return True
+        seen = self._contains(self.previous, positions)
+
+        if self.inserted >= self.capacity:
+            self.previous, self.current = self.current, bytearray(len(self.current))
+            self.inserted = 0
+            self.rotations += 1
+        for p in positions:
+            self.current[p >> 3] |= 1 << (p & 7)
+        self.inserted += 1
+        return seen
+
+    def merge(self, other: 'SeenFilter') -> None:
+        """Union with another filter of the same shape, generation by generation"""
+        if (self.bits, self.hashes) != (other.bits, other.hashes):
+            raise ValueError("Seen filters of different shape cannot be merged")
+        size = len(self.current)
+        for name in ('current', 'previous'):
+            union = int.from_bytes(getattr(self, name), 'little') | int.from_bytes(getattr(other, name), 'little')
+            setattr(self, name, bytearray(union.to_bytes(size, 'little')))
+        self.inserted = min(self.capacity, self.inserted + other.inserted)
+
+
+class HostWindow:
+    """Distinct sources of one host in the open window plus closed-window history"""
+
+    __slots__ = ('window', 'sources', 'new_sources', 'history')
+
+    def __init__(self, window: int, precision: int, history_windows: int):
+        self.window = window
+        self.sources = HyperLogLog(precision)
+        self.new_sources = 0
+        self.history = deque(maxlen=history_windows)
+
+
+class SourceObservation:
+    __slots__ = ('first_seen', 'distinct_sources', 'new_sources')
+
+    def __init__(self, first_seen: bool, distinct_sources: int, new_sources: int):
+        self.first_seen = first_seen
+        self.distinct_sources = distinct_sources
+        self.new_sources = new_sources
+
+
+class SourceCardinality:
+    """Per-host, per-window distinct and first-seen source counts in fixed memory"""
+
+    def __init__(self, precision: int = DEFAULT_SOURCE_CARDINALITY['precision'],
+                 window_seconds: int = DEFAULT_SOURCE_CARDINALITY['window_seconds'],
+                 history_windows: int = DEFAULT_SOURCE_CARDINALITY['history_windows'],
+                 max_hosts: int = DEFAULT_SOURCE_CARDINALITY['max_hosts'],
+                 seen_capacity: int = DEFAULT_SOURCE_CARDINALITY['seen_capacity'],
+                 seen_error_rate: float = DEFAULT_SOURCE_CARDINALITY['seen_error_rate']):
+        self.precision = precision
+        self.window_seconds = window_seconds
+        self.history_windows = history_windows
+        self.max_hosts = max_hosts
+        self.seen = SeenFilter(seen_capacity, seen_error_rate)
+        self._hosts: OrderedDict = OrderedDict()
+        self._all = HostWindow(int(time.time() // window_seconds), precision, history_windows)
+        self._lock = threading.Lock()
+
+    def _roll(self, host_window: HostWindow, window: int) -> None:
+        if window > host_window.window:
+            host_window.history.append({
+                'window_start': host_window.window * self.window_seconds,
+                'distinct_sources': host_window.sources.count(),
+                'new_sources': host_window.new_sources,
+            })
+            host_window.window = window
+            host_window.sources = HyperLogLog(self.precision)
+            host_window.new_sources = 0
+
+    def observe(self, host: str, source: str, now: Optional[float] = None) -> SourceObservation:
+        """Record ``source`` seen by ``host``; report first-seen and window counts"""
+        now = time.time() if now is None else now
+        window = int(now // self.window_seconds)
+        hashed = _hash64(source)
+
+        with self._lock:
+            host_window = self._hosts.get(host)
+            if host_window is None:
+                host_window = self._hosts[host] = HostWindow(window, self.precision, self.history_windows)
+                while len(self._hosts) > self.max_hosts:
+                    self._hosts.popitem(last=False)
+            else:
+                self._hosts.move_to_end(host)
+            self._roll(host_window, window)
+            self._roll(self._all, window)
+
+            first_seen = not self.seen.check_and_add(hashed)
+            for tracked in (host_window, self._all):
+                tracked.sources.add_hash(hashed)
+                if first_seen:
+                    tracked.new_sources += 1
+
+            return SourceObservation(first_seen, host_window.sources.count(), host_window.new_sources)
+
+    def _merge_window(self, mine: HostWindow, theirs: HostWindow) -> None:
+        history = {entry['window_start']: entry for entry in theirs.history}
+        if theirs.window > mine.window:
+            self._roll(mine, theirs.window)
+        if theirs.window == mine.window:
+            mine.sources.merge(theirs.sources)
+            mine.new_sources += theirs.new_sources
+        else:
+            # Their open window is already closed here; keep it as history
+            history[theirs.window * self.window_seconds] = {
+                'window_start': theirs.window * self.window_seconds,
+                'distinct_sources': theirs.sources.count(),
+                'new_sources': theirs.new_sources,
+            }
+        history.update((entry['window_start'], entry) for entry in mine.history)
+        mine.history = deque(sorted(history.values(), key=lambda entry: entry['window_start']),
+                             maxlen=self.history_windows)
+
+    def merge(self, other: 'SourceCardinality') -> None:
+        """Fold another worker's sources into this one (e.g. restored from a snapshot)"""
+        if (self.precision, self.window_seconds) != (other.precision, other.window_seconds):
+            raise ValueError("Source cardinalities with different precision or window cannot be merged")
+        with self._lock:
+            self.seen.merge(other.seen)
+            for host, theirs in list(other._hosts.items()):
+                mine = self._hosts.get(host)
+                if mine is None:
+                    mine = self._hosts[host] = HostWindow(theirs.window, self.precision, self.history_windows)
+                self._merge_window(mine, theirs)
+            while len(self._hosts) > self.max_hosts:
+                self._hosts.popitem(last=False)
+            self._merge_window(self._all, other._all)
+
+    def _describe(self, host_window: HostWindow) -> Dict[str, Any]:
+        return {
+            'window_start': host_window.window * self.window_seconds,
+            'distinct_sources': host_window.sources.count(),
+            'new_sources': host_window.new_sources,
+            'history': list(host_window.history),
+        }
+
+    def get_cardinalities(self, host: Optional[str] = None) -> Dict[str, Any]:
+        """Current and recent per-window distinct source counts"""
+        with self._lock:
+            window = int(time.time() // self.window_seconds)
+            hosts = [host] if host else list(self._hosts)
+            result = {'window_seconds': self.window_seconds, 'hosts': {}}
+            for name in hosts:
+                host_window = self._hosts.get(name)
+                if host_window is not None:
+                    self._roll(host_window, window)
+                    result['hosts'][name] = self._describe(host_window)
+            self._roll(self._all, window)
+            result['all_hosts'] = self._describe(self._all)
+            return result
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'hosts': len(self._hosts),
+            'max_hosts': self.max_hosts,
+            'precision': self.precision,
+            'bytes_per_window': 1 << self.precision,
+            'seen_filter_bytes': 2 * len(self.seen.current),
+            'seen_filter_rotations': self.seen.rotations,
+        }
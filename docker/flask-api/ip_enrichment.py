@@ -0,0 +1,273 @@
+"""
+IP Enrichment for MARSLOG-ClickHouse
+CIDR attribute tables (special ranges, sites, devices) in a sorted interval index
+"""
+
+import os
+import json
+import time
+import bisect
+import ipaddress
+import threading
+import logging
+from array import array
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List, Any, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_IP_ENRICHMENT = {
+    'enabled': True,
+    'cache_size': 65536,        # addresses whose lookup result is kept
+    'reload_check_sec': 30,     # how often devices.json is checked for changes
+    # Site map: [{"cidr": "10.1.0.0/16", "site": "hq", "vlan": 10, "owner": "netops"}, ...]
+    'sites': [],
+}
+
+# Special-purpose ranges; more specific entries (sites, devices) add to these
+SPECIAL_RANGES = [
+    ('10.0.0.0/8', 'private'),
+    ('172.16.0.0/12', 'private'),
+    ('192.168.0.0/16', 'private'),
+    ('100.64.0.0/10', 'shared'),
+    ('127.0.0.0/8', 'loopback'),
+    ('169.254.0.0/16', 'link_local'),
+    ('224.0.0.0/4', 'multicast'),
+    ('0.0.0.0/8', 'reserved'),
+    ('240.0.0.0/4', 'reserved'),
+    ('::1/128', 'loopback'),
+    ('fc00::/7', 'private'),
+    ('fe80::/10', 'link_local'),
+    ('ff00::/8', 'multicast'),
+]
+
+DEVICE_ATTRIBUTES = ('site', 'vlan', 'owner', 'location', 'type')
+
+_PUBLIC = {'network': 'public'}
+
+
+def load_ip_enrichment(config_path: Optional[Path] = None) -> Dict[str, Any]:
+    """Load the IP enrichment settings, falling back to the built-in defaults"""
+    settings = dict(DEFAULT_IP_ENRICHMENT)
+    if config_path is None or not Path(config_path).exists():
+        return settings
+
+    try:
+        with open(config_path, 'r') as f:
+            settings.update(json.load(f).get('ip_enrichment', {}))
+    except (json.JSONDecodeError, OSError) as e:
+        logger.error(f"Error loading IP enrichment settings from {config_path}: {e}")
+
+    return settings
+
+
+def parse_ip(value: str) -> Optional[Tuple[int, int]]:
+    """(version, integer) of an address; dotted quads avoid the ipaddress module"""
+    parts = value.split('.')
+    if len(parts) == 4:
+        number = 0
+        for part in parts:
+            if not part.isdigit() or len(part) > 3:
+                return None
+            octet = int(part)
+            if octet > 255:
+                return None
+            number = (number << 8) | octet
+        return 4, number
+    if ':' in value:
+        try:
+            return 6, int(ipaddress.IPv6Address(value.split('%', 1)[0]))
+        except ValueError:
+            return None
+    return None
+
+
+class IntervalIndex:
+    """Disjoint [start, end] integer intervals with attributes, searched by bisect.
+
+    CIDR blocks are either nested or disjoint, so the input is flattened
+    into non-overlapping segments in one sweep; each segment carries the
+    attributes of all blocks covering it, the most specific winning.
+    """
+
+    def __init__(self, ranges: List[Tuple[int, int, Dict[str, Any]]], typecode: Optional[str] = None):
+        starts, ends, values = [], [], []
+
+        def emit(start, end, attrs):
+            if start <= end:
+                if values and values[-1] is attrs and ends[-1] + 1 == start:
+                    ends[-1] = end
+                else:
+                    starts.append(start)
+                    ends.append(end)
+                    values.append(attrs)
+
+        stack: List[Tuple[int, Dict[str, Any]]] = []
+        cursor = 0
+        for start, end, attrs in sorted(ranges, key=lambda r: (r[0], -r[1])):
+            while stack and stack[-1][0] < start:
+                top_end, top_attrs = stack.pop()
+                emit(cursor, top_end, top_attrs)
+                cursor = max(cursor, top_end + 1)
+            if stack:
+                emit(cursor, start - 1, stack[-1][1])
+            merged = {**stack[-1][1], **attrs} if stack else attrs
+            stack.append((end, merged))
+            cursor = start
+        while stack:
+            top_end, top_attrs = stack.pop()
+            emit(cursor, top_end, top_attrs)
+            cursor = max(cursor, top_end + 1)
+
+        # IPv4 bounds fit machine words; IPv6 stays in Python ints
+        self.starts = array(typecode, starts) if typecode else starts
+        self.ends = array(typecode, ends) if typecode else ends
+        self.values = values
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def find(self, number: int) -> Optional[Dict[str, Any]]:
+        i = bisect.bisect_right(self.starts, number) - 1
+        if i >= 0 and number <= self.ends[i]:
+            return self.values[i]
+        return None
+
+
+class IPEnrichment:
+    """Annotates addresses with network class, site, VLAN, owner and device.
+
+    Tables are special-purpose ranges, the configured site map and the
+    devices of ``devices.json``; they are compiled into one interval index
+    per address family and answered through an LRU cache. devices.json is
+    re-read when its modification time changes.
+    """
+
+    def __init__(self, enabled: bool = DEFAULT_IP_ENRICHMENT['enabled'],
+                 cache_size: int = DEFAULT_IP_ENRICHMENT['cache_size'],
+                 reload_check_sec: float = DEFAULT_IP_ENRICHMENT['reload_check_sec'],
+                 sites: Optional[List[Dict[str, Any]]] = None,
+                 devices_path: Optional[Path] = None):
+        self.enabled = enabled
+        self.cache_size = cache_size
+        self.reload_check_sec = reload_check_sec
+        self.sites = list(sites or [])
+        self.devices_path = Path(devices_path) if devices_path else None
+        self._devices_mtime = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+        self.reloads = 0
+        self.invalid_entries = 0
+        self.build()
+
+    def _load_devices(self) -> List[Dict[str, Any]]:
+        if self.devices_path is None or not self.devices_path.exists():
+            self._devices_mtime = None
+            return []
+        try:
+            self._devices_mtime = os.stat(self.devices_path).st_mtime
+            with open(self.devices_path, 'r') as f:
+                devices = json.load(f)
+            return devices if isinstance(devices, list) else []
+        except (json.JSONDecodeError, OSError) as e:
+            logger.error(f"Error loading devices for IP enrichment from {self.devices_path}: {e}")
+            return []
+
+    def _tables(self) -> List[Tuple[str, Dict[str, Any]]]:
+        """(cidr, attributes) rows, least specific source first"""
+        rows = [('0.0.0.0/0', _PUBLIC), ('::/0', _PUBLIC)]
+        rows += [(cidr, {'network': network}) for cidr, network in SPECIAL_RANGES]
+        for site in self.sites:
+            attrs = {key: value for key, value in site.items() if key != 'cidr'}
+            rows.append((site.get('cidr', ''), attrs))
+        for device in self._load_devices():
+            if not isinstance(device, dict) or not device.get('ip'):
+                continue
+            attrs = {'device': device.get('name') or device.get('hostname') or device.get('ip')}
+            if device.get('id'):
+                attrs['device_id'] = device['id']
+            attrs.update({key: device[key] for key in DEVICE_ATTRIBUTES if device.get(key) not in (None, '')})
+            rows.append((str(device['ip']), attrs))
+        return rows
+
+    def build(self) -> None:
+        """Compile the tables into interval indexes and reset the cache"""
+        ranges = {4: [], 6: []}
+        invalid = 0
+        for cidr, attrs in self._tables():
+            try:
+                network = ipaddress.ip_network(cidr, strict=False)
+            except ValueError:
+                invalid += 1
+                continue
+            ranges[network.version].append(
+                (int(network.network_address), int(network.broadcast_address), attrs))
+
+        indexes = {4: IntervalIndex(ranges[4], 'Q'), 6: IntervalIndex(ranges[6])}
+        cached = lru_cache(maxsize=self.cache_size)(self._lookup)
+        with self._lock:
+            self._indexes = indexes
+            self._cached = cached
+            self.invalid_entries = invalid
+            self.reloads += 1
+        if invalid:
+            logger.warning(f"IP enrichment skipped {invalid} invalid CIDR entries")
+
+    def _lookup(self, ip: str) -> Optional[Dict[str, Any]]:
+        parsed = parse_ip(ip)
+        if parsed is None:
+            return None
+        version, number = parsed
+        return self._indexes[version].find(number) or _PUBLIC
+
+    def lookup(self, ip: str) -> Optional[Dict[str, Any]]:
+        return self._cached(ip)
+
+    def _maybe_reload(self) -> None:
+        now = time.monotonic()
+        if now - self._checked < self.reload_check_sec:
+            return
+        self._checked = now
+        try:
+            mtime = os.stat(self.devices_path).st_mtime if self.devices_path else None
+        except OSError:
+            mtime = None
+        if mtime != self._devices_mtime:
+            self.build()
+
+    def enrich(self, ip: Any) -> Optional[Dict[str, Any]]:
+        """Attributes of ``ip`` (shared, do not modify) or None if it is not an address"""
+        if not self.enabled or not isinstance(ip, str) or not ip:
+            return None
+        self._maybe_reload()
+        return self.lookup(ip)
+
+    def is_private(self, ip: str) -> bool:
+        attrs = self.lookup(ip) if isinstance(ip, str) else None
+        return attrs is not None and attrs.get('network') == 'private'
+
+    def annotate(self, source_ip: Any, dest_ip: Any) -> Dict[str, Dict[str, Any]]:
+        """Enrichment of the source and destination of one event"""
+        annotations = {}
+        source = self.enrich(source_ip)
+        if source is not None:
+            annotations['source'] = dict(source, ip=source_ip)
+        destination = self.enrich(dest_ip)
+        if destination is not None:
+            annotations['destination'] = dict(destination, ip=dest_ip)
+        return annotations
+
+    def get_stats(self) -> Dict[str, Any]:
+        cache = self._cached.cache_info()
+        return {
+            'enabled': self.enabled,
+            'ipv4_intervals': len(self._indexes[4]),
+            'ipv6_intervals': len(self._indexes[6]),
+            'sites': len(self.sites),
+            'reloads': self.reloads,
+            'invalid_entries': self.invalid_entries,
+            'cache_hits': cache.hits,
+            'cache_misses': cache.misses,
+            'cache_size': cache.currsize,
+        }
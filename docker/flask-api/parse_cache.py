@@ -0,0 +1,177 @@
+"""
+Parse Result Cache for MARSLOG-ClickHouse
+Byte-bounded LRU of extraction results keyed on timestamp-normalized log lines
+"""
+
+import json
+import re
+import sys
+import threading
+import logging
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PARSE_CACHE = {
+    'max_bytes': 32 * 1024 * 1024,  # 0 disables the cache
+    'min_hit_ratio': 0.1,           # below this over a probe the cache is bypassed
+    'probe_lookups': 2048,          # lookups per hit ratio probe
+    'bypass_lines': 32768,          # lines that skip the cache before the next probe
+}
+
+_MONTHS = r'(?:Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)'
+
+# Whitespace-delimited timestamps whose digits are masked before hashing.
+# Only digit values change, so log type detection, the indicator keywords and
+# the IP/severity/facility/url/email families give the same result for every
+# line sharing a key. Families that can capture the digit values themselves
+# (VOLATILE_FIELDS) are recomputed on every hit.
+VOLATILE_TIMESTAMPS = re.compile(
+    r'(?<!\S)(?:'
+    r'\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}:\d{2}Z?'
+    r'|' + _MONTHS + r'\s+\d{1,2}\s+\d{2}:\d{2}:\d{2}'
+    r'|\[\d{2}/' + _MONTHS + r'/\d{4}:\d{2}:\d{2}:\d{2} [+-]\d{4}\]'
+    r'|\d{10}'
+    r')(?!\S)',
+    re.IGNORECASE,
+)
+VOLATILE_FIELDS = ('timestamp', 'user', 'process', 'network', 'file_path')
+_MASK_DIGITS = str.maketrans('0123456789', '0000000000')
+
+
+def normalize_line(line: str) -> str:
+    """Mask the digits of timestamps so repeated events share one key"""
+    return VOLATILE_TIMESTAMPS.sub(lambda m: m.group(0).translate(_MASK_DIGITS), line)
+
+
+def load_parse_cache(config_path: Optional[Path] = None) -> Dict[str, Any]:
+    """Load the parse cache settings, falling back to the built-in defaults"""
+    settings = dict(DEFAULT_PARSE_CACHE)
+    if config_path is None or not Path(config_path).exists():
+        return settings
+
+    try:
+        with open(config_path, 'r') as f:
+            settings.update(json.load(f).get('parse_cache', {}))
+    except (json.JSONDecodeError, OSError) as e:
+        logger.error(f"Error loading parse cache settings from {config_path}: {e}")
+
+    return settings
+
+
+def _deep_sizeof(value) -> int:
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(_deep_sizeof(k) + _deep_sizeof(v) for k, v in value.items())
+    elif isinstance(value, (list, tuple)):
+        size += sum(_deep_sizeof(v) for v in value)
+    return size
+
+
+class ParseResultCache:
+    """Thread-safe LRU whose capacity is a byte budget rather than an entry count.
+
+    Keying and sizing a line costs more than a hit saves when lines rarely
+    repeat, so the hit ratio is probed every ``probe_lookups`` lookups and a
+    probe below ``min_hit_ratio`` bypasses the cache for ``bypass_lines``.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_PARSE_CACHE['max_bytes'],
+                 min_hit_ratio: float = DEFAULT_PARSE_CACHE['min_hit_ratio'],
+                 probe_lookups: int = DEFAULT_PARSE_CACHE['probe_lookups'],
+                 bypass_lines: int = DEFAULT_PARSE_CACHE['bypass_lines']):
+        self.max_bytes = max_bytes
+        self.min_hit_ratio = min_hit_ratio
+        self.probe_lookups = probe_lookups
+        self.bypass_lines = bypass_lines
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self._probe_hits = 0
+        self._probe_lookups = 0
+        self._bypass_left = 0
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bypassed = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def admit(self) -> bool:
+        """Whether the next line should be looked up; False while bypassed"""
+        if not self.enabled:
+            return False
+        with self._lock:
+            if self._bypass_left:
+                self._bypass_left -= 1
+                self.bypassed += 1
+                return False
+        return True
+
+    def _probe(self, hit: bool) -> None:
+        self._probe_lookups += 1
+        self._probe_hits += hit
+        if self._probe_lookups >= self.probe_lookups:
+            if self._probe_hits < self.min_hit_ratio * self._probe_lookups:
+                self._bypass_left = self.bypass_lines
+            self._probe_hits = self._probe_lookups = 0
+
+    @staticmethod
+    def key(line: str, log_type: Optional[str] = None) -> int:
+        return hash((log_type, normalize_line(line)))
+
+    def get(self, key: int) -> Optional[Dict[str, Any]]:
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            self._probe(entry is not None)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: int, value: Dict[str, Any]) -> None:
+        if not self.enabled:
+            return
+        size = _deep_sizeof(value)
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.bytes -= previous[1]
+            self._entries[key] = (value, size)
+            self.bytes += size
+
+            while self.bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            'enabled': self.enabled,
+            'entries': len(self._entries),
+            'bytes': self.bytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+            'min_hit_ratio': self.min_hit_ratio,
+            'bypassed': self.bypassed,
+        }
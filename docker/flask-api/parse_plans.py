@@ -0,0 +1,449 @@
+"""
+Template Parse Plans for MARSLOG-ClickHouse
+Per-template extraction plans keyed by Drain3 cluster id
+"""
+
+import json
+import re
+import threading
+import logging
+from bisect import bisect_right
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Any, Optional, Tuple
+
+from .rule_safety import consumable_chars, whitespace_gaps
+
+# Drain3 is optional; without it every line takes the full regex cascade
+try:
+    from drain3 import TemplateMiner
+    from drain3.template_miner_config import TemplateMinerConfig
+except ImportError:
+    TemplateMiner = None
+    TemplateMinerConfig = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PARSE_PLANS = {
+    'enabled': True,
+    'max_plans': 5000,
+    'max_verdicts': 65536,  # cached prefilter results per distinct token
+}
+
+# Applied when drain3_config leaves them out; Drain3 itself keeps every cluster
+DEFAULT_DRAIN3_SETTINGS = {
+    'max_clusters': DEFAULT_PARSE_PLANS['max_plans'],
+}
+
+# drain3_config keys in ai_config.json -> TemplateMinerConfig attributes
+DRAIN3_OPTIONS = {
+    'profiling_enabled': 'profiling_enabled',
+    'profiling_report_sec': 'profiling_report_sec',
+    'sim_th': 'drain_sim_th',
+    'depth': 'drain_depth',
+    'max_children': 'drain_max_children',
+    'max_clusters': 'drain_max_clusters',
+    'extra_delimiters': 'drain_extra_delimiters',
+}
+
+_TOKEN = re.compile(r'\S+')
+_WHITESPACE = frozenset(c for c in range(128) if chr(c).isspace())
+
+
+def load_parse_plans(config_path: Optional[Path] = None) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """Load the parse plan settings and the Drain3 section of ai_config.json"""
+    settings = dict(DEFAULT_PARSE_PLANS)
+    drain3_settings: Dict[str, Any] = {}
+    if config_path is None or not Path(config_path).exists():
+        return settings, drain3_settings
+
+    try:
+        with open(config_path, 'r') as f:
+            config = json.load(f)
+        settings.update(config.get('parse_plans', {}))
+        drain3_settings = config.get('drain3_config', {})
+    except (json.JSONDecodeError, OSError) as e:
+        logger.error(f"Error loading parse plan settings from {config_path}: {e}")
+
+    return settings, drain3_settings
+
+
+def create_template_miner(drain3_settings: Dict[str, Any]):
+    """Build a Drain3 template miner from the drain3_config section"""
+    if TemplateMiner is None:
+        logger.warning("Drain3 not available; template parse plans disabled")
+        return None
+
+    settings = dict(DEFAULT_DRAIN3_SETTINGS, **drain3_settings)
+    config = TemplateMinerConfig()
+    for key, attribute in DRAIN3_OPTIONS.items():
+        if key in settings:
+            setattr(config, attribute, settings[key])
+    return TemplateMiner(config=config)
+
+
+class ParsePlan:
+    """Where each field family sits in the token sequence of one template.
+
+    ``fields`` maps a field type to its winning rule and an ordered list of
+    token segments ``(first, last, values)``. ``values`` is the stored match
+    list when the segment only covers constant template tokens, otherwise
+    None and the rule is re-run on the sliced segment. ``checks`` pairs a
+    prefilter of the rules a variable token must not match with the tokens it
+    guards, so a slot changing shape falls back to the full parse.
+
+    Rules that can consume a token delimiter may match across tokens, so
+    they are never checked token by token. A winning one keeps constant
+    segments only if it does not match near the variable tokens, otherwise
+    it is re-run on the whole line. ``window_checks`` pairs a prefilter of
+    the other spanning rules with the number of words of context they can
+    reach (None for the whole line); it is run over the words around every
+    run of adjacent variable tokens in ``runs``.
+    """
+
+    __slots__ = ('template', 'log_type', 'fields', 'checks', 'window_checks', 'runs', 'applied', 'fallbacks')
+
+    def __init__(self, template: Tuple[str, ...], log_type: Optional[str],
+                 fields: Dict[str, tuple], checks: List[tuple], window_checks: List[tuple] = (),
+                 runs: List[Tuple[int, int]] = ()):
+        self.template = template
+        self.log_type = log_type
+        self.fields = fields
+        self.checks = checks
+        self.window_checks = window_checks
+        self.runs = runs
+        self.applied = 0
+        self.fallbacks = 0
+
+
+class PlanLookup:
+    """Cluster assignment of one line, as returned by ``ParsePlanCache.lookup``"""
+
+    __slots__ = ('cluster_id', 'template', 'spans', 'plan')
+
+    def __init__(self, cluster_id: int, template: Tuple[str, ...],
+                 spans: List[Tuple[int, int]], plan: Optional[ParsePlan]):
+        self.cluster_id = cluster_id
+        self.template = template
+        self.spans = spans
+        self.plan = plan
+
+
+class ParsePlanCache:
+    """Per-cluster parse plans built from one full extraction of the template.
+
+    The first line of a template goes through the full regex cascade and the
+    winning rule of every field family is mapped back onto Drain3's tokens.
+    Later lines of the same template re-run each rule only on its token
+    slice. A plan is dropped whenever Drain3 reports the template changed.
+    """
+
+    UNPLANNABLE = object()
+
+    def __init__(self, guard, compiled_patterns: Dict[str, list], template_miner=None,
+                 enabled: bool = DEFAULT_PARSE_PLANS['enabled'],
+                 max_plans: int = DEFAULT_PARSE_PLANS['max_plans'],
+                 max_verdicts: int = DEFAULT_PARSE_PLANS['max_verdicts']):
+        self.guard = guard
+        self.compiled_patterns = compiled_patterns
+        self.template_miner = template_miner
+        self.max_plans = max_plans
+        self.max_verdicts = max_verdicts
+        self.enabled = enabled and template_miner is not None
+
+        delimiters = template_miner.config.drain_extra_delimiters if template_miner else []
+        self._delimiters = str.maketrans({d: ' ' for d in delimiters if len(d) == 1})
+        split_chars = _WHITESPACE | {ord(d) for d in delimiters if len(d) == 1}
+        self._rule_names = frozenset(rule.name for rules in compiled_patterns.values() for rule in rules)
+        self._spanning = frozenset(rule.name for rules in compiled_patterns.values() for rule in rules
+                                   if consumable_chars(rule.source) & split_chars)
+        self._reach = {rule.name: whitespace_gaps(rule.source)
+                       for rules in compiled_patterns.values() for rule in rules if rule.name in self._spanning}
+        self._plans: OrderedDict = OrderedDict()
+        self._prefilters: Dict[frozenset, Any] = {}
+        self._verdicts: Dict[Any, Dict[str, bool]] = {}
+        self._lock = threading.Lock()
+        self._settled = 0.0  # moving share of lines that left the templates unchanged
+
+        self.matched = 0
+        self.applied = 0
+        self.built = 0
+        self.fallbacks = 0
+        self.unplannable = 0
+        self.invalidations = 0
+
+    def tokenize(self, line: str) -> List[Tuple[int, int]]:
+        """Character spans of the tokens Drain3 sees for ``line``"""
+        return [match.span() for match in _TOKEN.finditer(line.translate(self._delimiters))]
+
+    def lookup(self, line: str) -> Optional[PlanLookup]:
+        """Assign ``line`` to its Drain3 cluster and fetch that cluster's plan.
+
+        Masking runs outside the lock. Inside it, a read-only match against
+        the known templates comes first; only a line no template covers is
+        added to the tree, which may create or widen a cluster. While most
+        lines do change the tree (templates still being learned) the match
+        would be a wasted second search, so it is skipped.
+        """
+        if not self.enabled:
+            return None
+
+        masked = self.template_miner.masker.mask(line)
+        drain = self.template_miner.drain
+        with self._lock:
+            cluster = drain.match(masked) if self._settled >= 0.5 else None
+            if cluster is not None:
+                # What add_log_message does for an unchanged template
+                cluster.size += 1
+                drain.id_to_cluster[cluster.cluster_id]
+                change_type = 'none'
+                self.matched += 1
+            else:
+                cluster, change_type = drain.add_log_message(masked)
+            self._settled += ((change_type == 'none') - self._settled) / 256
+            cluster_id = cluster.cluster_id
+            template = tuple(cluster.log_template_tokens)
+            if change_type != 'none' and self._plans.pop(cluster_id, None) is not None:
+                self.invalidations += 1
+            plan = self._plans.get(cluster_id)
+            if plan is not None:
+                self._plans.move_to_end(cluster_id)
+
+        spans = self.tokenize(line)
+        if len(spans) != len(template):
+            return None
+        if plan is self.UNPLANNABLE:
+            plan = None
+        return PlanLookup(cluster_id, template, spans, plan)
+
+    def apply(self, lookup: PlanLookup, line: str) -> Optional[Dict[str, list]]:
+        """Field family matches for ``line`` from its plan, or None to fall back"""
+        plan = lookup.plan
+        if plan is None:
+            return None
+        spans = lookup.spans
+
+        for prefilter, indexes in plan.checks:
+            if self._matches(prefilter, [line[spans[index][0]:spans[index][1]] for index in indexes]):
+                self._fallback(plan)
+                return None
+        if plan.window_checks:
+            words = [match.span() for match in _TOKEN.finditer(line)]
+            starts = [start for start, _ in words]
+            for prefilter, context in plan.window_checks:
+                if context is None:
+                    matched = prefilter.search(line) is not None
+                else:
+                    matched = self._matches(prefilter, self._window_texts(line, spans, words, starts,
+                                                                          plan.runs, context))
+                if matched:
+                    self._fallback(plan)
+                    return None
+
+        matches = {}
+        for field_type, (rule, segments) in plan.fields.items():
+            found = []
+            for first, last, values in segments:
+                if values is None:
+                    values = self.guard.findall(rule, line[spans[first][0]:spans[last][1]])
+                    if not values:
+                        self._fallback(plan)
+                        return None
+                found.extend(values)
+            matches[field_type] = found
+
+        plan.applied += 1
+        self.applied += 1
+        return matches
+
+    def _matches(self, prefilter, texts: List[str]) -> bool:
+        """Whether ``prefilter`` matches any of ``texts``"""
+        # Variable values repeat (hosts, users, addresses), so verdicts are cached
+        verdicts = self._verdicts[prefilter]
+        for text in texts:
+            matched = verdicts.get(text)
+            if matched is None:
+                matched = prefilter.search(text) is not None
+                if len(verdicts) >= self.max_verdicts:
+                    verdicts.clear()
+                verdicts[text] = matched
+            if matched:
+                return True
+        return False
+
+    @staticmethod
+    def _window_texts(line: str, spans: List[Tuple[int, int]], words: List[Tuple[int, int]], starts: List[int],
+                      runs: List[Tuple[int, int]], context: Optional[int]) -> List[str]:
+        """Text of the words around each variable run, ``context`` words either side"""
+        if context is None:
+            return [line]
+        texts = []
+        for first, last in runs:
+            low = max(bisect_right(starts, spans[first][0]) - 1 - context, 0)
+            high = min(bisect_right(starts, spans[last][1] - 1) - 1 + context, len(words) - 1)
+            texts.append(line[words[low][0]:words[high][1]])
+        return texts
+
+    def _fallback(self, plan: ParsePlan) -> None:
+        plan.fallbacks += 1
+        self.fallbacks += 1
+
+    def learn(self, lookup: PlanLookup, line: str, log_type: Optional[str]) -> None:
+        """Build and store the plan for ``lookup``'s cluster from a fully parsed line"""
+        # An occasional odd line does not replace a plan that mostly applies
+        if lookup.plan is not None and lookup.plan.fallbacks <= lookup.plan.applied:
+            return
+
+        plan = self._build(lookup, line, log_type)
+        if plan is None:
+            self.unplannable += 1
+        else:
+            self.built += 1
+
+        with self._lock:
+            self._plans[lookup.cluster_id] = plan if plan is not None else self.UNPLANNABLE
+            self._plans.move_to_end(lookup.cluster_id)
+            while len(self._plans) > self.max_plans:
+                self._plans.popitem(last=False)
+
+    def _token_at(self, spans: List[Tuple[int, int]], position: int) -> Optional[int]:
+        for index, (start, end) in enumerate(spans):
+            if start <= position < end:
+                return index
+            if position < start:
+                return None
+        return None
+
+    @staticmethod
+    def _runs(variable: List[bool]) -> List[Tuple[int, int]]:
+        """Token ranges of the runs of adjacent variable tokens"""
+        runs: List[Tuple[int, int]] = []
+        for index, is_variable in enumerate(variable):
+            if not is_variable:
+                continue
+            if runs and runs[-1][1] == index - 1:
+                runs[-1] = (runs[-1][0], index)
+            else:
+                runs.append((index, index))
+        return runs
+
+    def _segments(self, winner, values: list, line: str,
+                  spans: List[Tuple[int, int]]) -> Optional[List[list]]:
+        """Consecutive matches of ``winner`` grouped by the token segment that contains them"""
+        occurrences = self.guard.finditer(winner, line)
+        if len(occurrences) != len(values):
+            return None
+
+        segments: List[list] = []
+        for occurrence, value in zip(occurrences, values):
+            if occurrence.end() == occurrence.start():
+                return None
+            first = self._token_at(spans, occurrence.start())
+            last = self._token_at(spans, occurrence.end() - 1)
+            if first is None or last is None:
+                return None
+            if segments and segments[-1][0] == first and segments[-1][1] == last:
+                segments[-1][2].append(value)
+            elif segments and first <= segments[-1][1]:
+                return None
+            else:
+                segments.append([first, last, [value]])
+
+        for first, last, segment_values in segments:
+            if self.guard.findall(winner, line[spans[first][0]:spans[last][1]]) != segment_values:
+                return None
+        return segments
+
+    def _build(self, lookup: PlanLookup, line: str, log_type: Optional[str]) -> Optional[ParsePlan]:
+        spans = lookup.spans
+        variable = [line[start:end] != token for (start, end), token in zip(spans, lookup.template)]
+        runs = self._runs(variable)
+        words = [match.span() for match in _TOKEN.finditer(line)]
+        starts = [start for start, _ in words]
+        claims: Dict[int, set] = {}
+        claimed = set()
+        windowed = set()
+        fields = {}
+
+        for field_type, rules in self.compiled_patterns.items():
+            winner = None
+            for index, rule in enumerate(rules):
+                found = self.guard.findall(rule, line)
+                if found:
+                    winner, winner_index, values = rule, index, found
+            if winner is None:
+                continue
+            claimed.update(rule.name for rule in rules[:winner_index + 1])
+            segments = self._segments(winner, values, line, spans)
+
+            # A spanning winner keeps constant segments only while it stays out of
+            # the variable windows; otherwise it is re-run on the whole line
+            if winner.name in self._spanning:
+                texts = self._window_texts(line, spans, words, starts, runs, self._reach[winner.name])
+                if segments is not None and not any(any(variable[first:last + 1]) for first, last, _ in segments) \
+                        and not any(self.guard.search(winner, text) for text in texts):
+                    fields[field_type] = (winner, [tuple(segment) for segment in segments])
+                    windowed.add(winner.name)
+                else:
+                    fields[field_type] = (winner, [(0, len(spans) - 1, None)])
+                continue
+            if segments is None:
+                return None
+
+            planned = []
+            for first, last, segment_values in segments:
+                if any(variable[first:last + 1]):
+                    planned.append((first, last, None))
+                    excluded = {rule.name for rule in rules[:winner_index + 1]}
+                    for index in range(first, last + 1):
+                        if variable[index]:
+                            claims.setdefault(index, set()).update(excluded)
+                else:
+                    planned.append((first, last, segment_values))
+            fields[field_type] = (winner, planned)
+
+        guarded: Dict[frozenset, List[int]] = {}
+        for index, is_variable in enumerate(variable):
+            if is_variable:
+                guarded.setdefault(frozenset(claims.get(index, ())) | self._spanning, []).append(index)
+        checks = [(self._prefilter(excluded), indexes) for excluded, indexes in guarded.items()]
+
+        # Spanning rules that missed this line, or matched only constant text,
+        # are looked for around the variable runs, grouped by their reach
+        by_reach: Dict[Optional[int], set] = {}
+        for name in (self._spanning - claimed) | windowed:
+            by_reach.setdefault(self._reach[name], set()).add(name)
+        window_checks = [(self._prefilter(self._rule_names - names), context)
+                         for context, names in by_reach.items()] if runs else []
+        return ParsePlan(lookup.template, log_type, fields, checks, window_checks, runs)
+
+    def _prefilter(self, excluded: frozenset):
+        """One alternation of every rule not already explained by a plan segment"""
+        prefilter = self._prefilters.get(excluded)
+        if prefilter is None:
+            sources = [
+                f'(?:{rule.pattern.pattern})'
+                for rules in self.compiled_patterns.values()
+                for rule in rules if rule.name not in excluded
+            ]
+            prefilter = re.compile('|'.join(sources) or r'(?!)', re.IGNORECASE)
+            self._prefilters[excluded] = prefilter
+            self._verdicts.setdefault(prefilter, {})
+        return prefilter
+
+    def clear(self) -> None:
+        with self._lock:
+            self._plans.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'enabled': self.enabled,
+            'plans': sum(1 for plan in self._plans.values() if plan is not self.UNPLANNABLE),
+            'unplannable_templates': sum(1 for plan in self._plans.values() if plan is self.UNPLANNABLE),
+            'matched': self.matched,
+            'applied': self.applied,
+            'built': self.built,
+            'fallbacks': self.fallbacks,
+            'unplannable': self.unplannable,
+            'invalidations': self.invalidations,
+        }
@@ -0,0 +1,291 @@
+"""
+Parser Packs for MARSLOG-ClickHouse
+Compiled named-group log patterns with prefix/source dispatch, hot reload and per-pattern timing
+"""
+
+import os
+import re
+import json
+import time
+import logging
+import ipaddress
+import threading
+from pathlib import Path
+from typing import Dict, List, Any, Optional, Tuple
+
+from .utils import DATA_DIR, LOG_PATTERNS_FILE, load_log_patterns
+from .rule_safety import RuleSafetyGuard, dispatch_hint, load_rule_safety
+from .vendor_packs import VENDOR_PACKS
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PARSER_PACKS = {
+    'enabled': True,
+    'user_packs_path': str(DATA_DIR / 'parser_packs.json'),   # user packs, same format as log_patterns.json
+    'reload_check_sec': 5,       # how often the pack files are checked for changes
+    'slow_pattern_us': 200,      # mean time per attempt above which a pack is reported slow
+}
+
+# Resolved source-IP lookups kept per compiled pack set
+_SOURCE_CACHE_SIZE = 4096
+
+
+def load_parser_packs(config_path: Optional[Path] = None) -> Dict[str, Any]:
+    """Load the parser pack settings, falling back to the built-in defaults"""
+    settings = dict(DEFAULT_PARSER_PACKS)
+    if config_path is None or not Path(config_path).exists():
+        return settings
+
+    try:
+        with open(config_path, 'r') as f:
+            settings.update(json.load(f).get('parser_packs', {}))
+    except (json.JSONDecodeError, OSError) as e:
+        logger.error(f"Error loading parser pack settings from {config_path}: {e}")
+
+    return settings
+
+
+class ParserPack:
+    """One compiled pattern (or vendor extractor) with its dispatch keys and timing counters"""
+
+    __slots__ = ('name', 'origin', 'source', 'rule', 'extract', 'fields', 'first_chars', 'prefixes', 'sources',
+                 'attempts', 'hits', 'total_ns', 'max_ns')
+
+    def __init__(self, name: str, origin: str, source: str, rule, extract, fields: List[str],
+                 first_chars: Optional[frozenset], prefixes: Tuple[str, ...], sources: list):
+        self.name = name
+        self.origin = origin
+        self.source = source
+        self.rule = rule
+        self.extract = extract
+        self.fields = frozenset(fields)
+        self.first_chars = first_chars
+        self.prefixes = prefixes
+        self.sources = sources
+        self.attempts = 0
+        self.hits = 0
+        self.total_ns = 0
+        self.max_ns = 0
+
+    def inherit(self, old: 'ParserPack') -> None:
+        """Keep the counters of the same pattern across a reload"""
+        if old.source == self.source:
+            self.attempts, self.hits = old.attempts, old.hits
+            self.total_ns, self.max_ns = old.total_ns, old.max_ns
+
+
+class ParserPackRegistry:
+    """Routes log lines to named-group patterns and returns the fields they capture.
+
+    Packs come from ``log_patterns.json`` (the built-in syslog, Apache and
+    nginx definitions), from the vendor extractors in ``vendor_packs`` and
+    from ``user_packs_path``; a user pack replaces a built-in one of the same
+    name, packs are tried user, vendor, then pattern file, and
+    ``"enabled": false`` drops a pack. Besides ``pattern`` (or ``vendor``, the
+    name of a vendor extractor) and ``fields`` a pack may list literal
+    ``prefixes`` a line must start with and the ``sources`` (IPs or CIDRs) it
+    applies to.
+
+    Every pattern is compiled once through ``RuleSafetyGuard``. A line is
+    only tried against the source packs of its sender and the generic packs
+    whose anchored start can match its first character; declared or derived
+    literal prefixes are checked with ``startswith`` before the regex runs.
+    The compiled set is rebuilt when either file changes and swapped in as
+    one tuple, so ingest threads see the old or the new set, never a mix.
+    """
+
+    def __init__(self, rule_safety: Optional[RuleSafetyGuard] = None,
+                 enabled: bool = DEFAULT_PARSER_PACKS['enabled'],
+                 user_packs_path: Optional[str] = DEFAULT_PARSER_PACKS['user_packs_path'],
+                 reload_check_sec: float = DEFAULT_PARSER_PACKS['reload_check_sec'],
+                 slow_pattern_us: float = DEFAULT_PARSER_PACKS['slow_pattern_us']):
+        self.rule_safety = rule_safety or RuleSafetyGuard()
+        self.enabled = enabled
+        self.paths = [Path(LOG_PATTERNS_FILE)] + ([Path(user_packs_path)] if user_packs_path else [])
+        self.reload_check_sec = reload_check_sec
+        self.slow_pattern_us = slow_pattern_us
+        self.mtimes = None
+        self.checked = 0.0
+        self.lock = threading.Lock()
+        self.errors: Dict[str, str] = {}
+        self.reloads = 0
+        self.lines = 0
+        self.matched = 0
+        self.prefix_skips = 0
+        self.compiled = ((), {}, (), {}, [], {})
+        if enabled:
+            self.reload()
+
+    def _file_mtimes(self) -> Tuple[Optional[float], ...]:
+        mtimes = []
+        for path in self.paths:
+            try:
+                mtimes.append(os.stat(path).st_mtime)
+            except OSError:
+                mtimes.append(None)
+        return tuple(mtimes)
+
+    def load_definitions(self) -> List[Tuple[str, str, Dict[str, Any]]]:
+        """(name, origin, definition) of every enabled pack, in the order they are tried"""
+        builtin = load_log_patterns()
+        user = {}
+        if len(self.paths) > 1 and self.paths[1].exists():
+            try:
+                with open(self.paths[1], 'r') as f:
+                    user = json.load(f)
+            except (json.JSONDecodeError, OSError) as e:
+                logger.error(f"Error loading parser packs from {self.paths[1]}: {e}")
+
+        definitions = [(name, 'user', spec) for name, spec in user.items()]
+        definitions += [(name, 'vendor', {'vendor': name}) for name in VENDOR_PACKS if name not in user]
+        definitions += [(name, 'builtin', spec) for name, spec in builtin.items()
+                        if name not in user and name not in VENDOR_PACKS]
+        return [(name, origin, spec) for name, origin, spec in definitions
+                if isinstance(spec, dict) and spec.get('enabled', True)]
+
+    def compile_pack(self, name: str, origin: str, spec: Dict[str, Any]) -> ParserPack:
+        if 'vendor' in spec:
+            source = f"vendor:{spec['vendor']}"
+            rule, extract = None, VENDOR_PACKS[spec['vendor']]
+            first_chars, derived_prefix = None, ''
+        else:
+            flags = re.IGNORECASE if 'i' in spec.get('flags', '') else 0
+            source = spec['pattern']
+            rule, extract = self.rule_safety.compile(f"parser_pack:{name}", source, flags), None
+            first_chars, derived_prefix = dispatch_hint(source, flags)
+        prefixes = tuple(spec.get('prefixes') or ([derived_prefix] if derived_prefix else []))
+        if prefixes:
+            declared = frozenset(ord(prefix[0]) for prefix in prefixes if prefix)
+            first_chars = declared if first_chars is None else first_chars & declared
+        sources = [ipaddress.ip_network(source, strict=False) for source in spec.get('sources', [])]
+        return ParserPack(name, origin, source, rule, extract, spec.get('fields', []),
+                          first_chars, prefixes, sources)
+
+    def reload(self) -> None:
+        self.mtimes = self._file_mtimes()
+        old = {pack.name: pack for pack in self.compiled[0]}
+        packs, errors = [], {}
+        for name, origin, spec in self.load_definitions():
+            try:
+                pack = self.compile_pack(name, origin, spec)
+            except (KeyError, TypeError, ValueError, re.error) as e:
+                errors[name] = str(e)
+                logger.error(f"Skipping parser pack {name}: {e}")
+                continue
+            if name in old:
+                pack.inherit(old[name])
+            packs.append(pack)
+
+        generic = tuple(pack for pack in packs if not pack.sources)
+        by_char = {chr(c): tuple(pack for pack in generic if pack.first_chars is None or c in pack.first_chars)
+                   for c in range(128)}
+        exact, networks = {}, []
+        for pack in packs:
+            for network in pack.sources:
+                if network.num_addresses == 1:
+                    exact.setdefault(str(network.network_address), []).append(pack)
+                else:
+                    networks.append((network, pack))
+
+        # One tuple swap, so concurrent parse calls see old or new, never a mix
+        self.compiled = (tuple(packs), by_char, generic, exact, networks, {})
+        self.errors = errors
+        self.reloads += 1
+        logger.info(f"Parser packs compiled: {len(packs)} packs, {len(packs) - len(generic)} source-bound")
+
+    def maybe_reload(self) -> None:
+        now = time.monotonic()
+        if now - self.checked < self.reload_check_sec:
+            return
+        with self.lock:
+            if now - self.checked < self.reload_check_sec:
+                return
+            self.checked = now
+            if self._file_mtimes() != self.mtimes:
+                self.reload()
+
+    @staticmethod
+    def _source_packs(source_ip: Optional[str], exact: Dict[str, list], networks: list,
+                      cache: Dict[str, tuple]) -> tuple:
+        if not source_ip or not (exact or networks):
+            return ()
+        found = cache.get(source_ip)
+        if found is None:
+            found = list(exact.get(source_ip, ()))
+            try:
+                address = ipaddress.ip_address(source_ip)
+                found += [pack for network, pack in networks
+                          if address.version == network.version and address in network and pack not in found]
+            except ValueError:
+                pass
+            found = tuple(found)
+            if len(cache) >= _SOURCE_CACHE_SIZE:
+                cache.clear()
+            cache[source_ip] = found
+        return found
+
+    def parse(self, text: str, source_ip: Optional[str] = None) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """(pack name, captured fields) of the first pack matching ``text``, or None.
+
+        Pattern packs capture strings; vendor packs return typed values.
+        """
+        if not self.enabled or not text:
+            return None
+        self.maybe_reload()
+        _, by_char, generic, exact, networks, cache = self.compiled
+        self.lines += 1
+        text = self.rule_safety.clip(text)
+        candidates = self._source_packs(source_ip, exact, networks, cache) + by_char.get(text[0], generic)
+
+        search = self.rule_safety.search
+        for pack in candidates:
+            if pack.prefixes and not text.startswith(pack.prefixes):
+                self.prefix_skips += 1
+                continue
+            start = time.perf_counter_ns()
+            if pack.rule is None:
+                fields = pack.extract(text)
+            else:
+                match = search(pack.rule, text)
+                fields = match.groupdict() if match else None
+            elapsed = time.perf_counter_ns() - start
+            pack.attempts += 1
+            pack.total_ns += elapsed
+            if elapsed > pack.max_ns:
+                pack.max_ns = elapsed
+            if fields is not None:
+                pack.hits += 1
+                self.matched += 1
+                return pack.name, {key: value for key, value in fields.items()
+                                   if value is not None and (not pack.fields or key in pack.fields)}
+        return None
+
+    def get_stats(self) -> Dict[str, Any]:
+        packs = []
+        for pack in self.compiled[0]:
+            mean_us = pack.total_ns / pack.attempts / 1000 if pack.attempts else 0.0
+            packs.append({
+                'name': pack.name,
+                'origin': pack.origin,
+                'attempts': pack.attempts,
+                'hits': pack.hits,
+                'mean_us': round(mean_us, 2),
+                'max_us': round(pack.max_ns / 1000, 2),
+                'total_ms': round(pack.total_ns / 1e6, 3),
+                'slow': mean_us > self.slow_pattern_us,
+                'dispatch': 'source' if pack.sources else ('prefix' if pack.prefixes else
+                                                           ('first_char' if pack.first_chars is not None else 'all')),
+                'findings': pack.rule.findings if pack.rule is not None else [],
+            })
+        packs.sort(key=lambda item: item['total_ms'], reverse=True)
+        return {
+            'enabled': self.enabled,
+            'files': [str(path) for path in self.paths],
+            'reloads': self.reloads,
+            'lines': self.lines,
+            'matched': self.matched,
+            'prefix_skips': self.prefix_skips,
+            'errors': dict(self.errors),
+            'slow_packs': [item['name'] for item in packs if item['slow']],
+            'packs': packs,
+        }
@@ -0,0 +1,213 @@
+"""
+Windowed Rate Statistics for MARSLOG-ClickHouse
+Per-source and per-user sliding-window counters for live anomaly thresholds
+"""
+
+import json
+import time
+import threading
+import logging
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RATE_WINDOWS = {
+    'failed_auth_window': 60,      # seconds, matches failed_auth_threshold (per minute)
+    'buckets': 60,                 # ring buffer slots per window
+    'max_keys': 100000,            # tracked sources + users
+    'idle_ttl': 3600,              # seconds before an idle key is evicted
+}
+
+
+def load_rate_windows(config_path: Optional[Path] = None) -> Dict[str, Any]:
+    """Load the rate window settings, falling back to the built-in defaults"""
+    settings = dict(DEFAULT_RATE_WINDOWS)
+    if config_path is None or not Path(config_path).exists():
+        return settings
+
+    try:
+        with open(config_path, 'r') as f:
+            settings.update(json.load(f).get('rate_windows', {}))
+    except (json.JSONDecodeError, OSError) as e:
+        logger.error(f"Error loading rate window settings from {config_path}: {e}")
+
+    return settings
+
+
+class RingCounter:
+    """Event count over a sliding window kept in a fixed ring of time buckets"""
+
+    __slots__ = ('counts', 'width', 'head', 'head_bucket', 'total')
+
+    def __init__(self, window: float, buckets: int):
+        self.counts = [0] * buckets
+        self.width = window / buckets
+        self.head = 0
+        self.head_bucket = None
+        self.total = 0
+
+    def _advance(self, now: float) -> None:
+        bucket = int(now // self.width)
+        if self.head_bucket is None:
+            self.head_bucket = bucket
+            return
+        steps = bucket - self.head_bucket
+        if steps <= 0:
+            return  # late or same-bucket events count into the current bucket
+
+        size = len(self.counts)
+        if steps >= size:
+            self.counts = [0] * size
+            self.total = 0
+        else:
+            for _ in range(steps):
+                self.head = (self.head + 1) % size
+                self.total -= self.counts[self.head]
+                self.counts[self.head] = 0
+        self.head_bucket = bucket
+
+    def add(self, now: float, amount: int = 1) -> int:
+        self._advance(now)
+        self.counts[self.head] += amount
+        self.total += amount
+        return self.total
+
+    def count(self, now: float) -> int:
+        self._advance(now)
+        return self.total
+
+
+class KeyWindow:
+    """Live state of one source or user"""
+
+    __slots__ = ('last_seen', 'failures')
+
+    def __init__(self):
+        self.last_seen = None
+        self.failures = None
+
+
+class WindowObservation:
+    """What the windows looked like right after recording one event"""
+
+    __slots__ = ('gap', 'source_failures', 'user_failures')
+
+    def __init__(self):
+        self.gap = None
+        self.source_failures = 0
+        self.user_failures = 0
+
+
+class WindowedStats:
+    """Thread-safe per-key sliding windows with bounded memory.
+
+    Every source IP and user gets its own entry, kept in least-recently-seen
+    order so idle keys are evicted from the front in O(1). Failure counts
+    live in a ring of buckets, so an update costs at most one pass over the
+    ring regardless of traffic.
+    """
+
+    def __init__(self, failed_auth_window: float = DEFAULT_RATE_WINDOWS['failed_auth_window'],
+                 buckets: int = DEFAULT_RATE_WINDOWS['buckets'],
+                 max_keys: int = DEFAULT_RATE_WINDOWS['max_keys'],
+                 idle_ttl: float = DEFAULT_RATE_WINDOWS['idle_ttl']):
+        self.failed_auth_window = failed_auth_window
+        self.buckets = buckets
+        self.max_keys = max_keys
+        self.idle_ttl = idle_ttl
+        self._keys: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def _touch(self, key: tuple) -> KeyWindow:
+        """Fetch or create the window for ``key`` and mark it most recent"""
+        window = self._keys.get(key)
+        if window is None:
+            window = self._keys[key] = KeyWindow()
+        else:
+            self._keys.move_to_end(key)
+        return window
+
+    def _evict(self, now: float) -> None:
+        while self._keys:
+            key, window = next(iter(self._keys.items()))
+            if len(self._keys) <= self.max_keys and now - window.last_seen <= self.idle_ttl:
+                break
+            del self._keys[key]
+            self.evictions += 1
+
+    def _record_failure(self, window: KeyWindow, now: float) -> int:
+        if window.failures is None:
+            window.failures = RingCounter(self.failed_auth_window, self.buckets)
+        return window.failures.add(now)
+
+    def observe(self, source: Optional[str], user: Optional[str], failed_auth: bool,
+                now: Optional[float] = None) -> WindowObservation:
+        """Record one parsed event and return the windows it updated"""
+        now = time.time() if now is None else now
+        observation = WindowObservation()
+
+        with self._lock:
+            if source:
+                window = self._touch(('source', source))
+                if window.last_seen is not None:
+                    observation.gap = now - window.last_seen
+                window.last_seen = now
+                if failed_auth:
+                    observation.source_failures = self._record_failure(window, now)
+
+            if user:
+                window = self._touch(('user', user))
+                window.last_seen = now
+                if failed_auth:
+                    observation.user_failures = self._record_failure(window, now)
+
+            self._evict(now)
+
+        return observation
+
+    def merge(self, other: 'WindowedStats') -> None:
+        """Fold another worker's windows into this one (e.g. restored from a snapshot)"""
+        if (self.failed_auth_window, self.buckets) != (other.failed_auth_window, other.buckets):
+            raise ValueError("Rate windows of different size cannot be merged")
+        with self._lock:
+            for key, theirs in list(other._keys.items()):
+                mine = self._keys.get(key)
+                if mine is None:
+                    mine = self._keys[key] = KeyWindow()
+                if theirs.last_seen is not None and (mine.last_seen is None or theirs.last_seen > mine.last_seen):
+                    mine.last_seen = theirs.last_seen
+                if theirs.failures is None or theirs.failures.head_bucket is None:
+                    continue
+                if mine.failures is None or mine.failures.head_bucket is None:
+                    mine.failures = RingCounter(self.failed_auth_window, self.buckets)
+                    mine.failures.head_bucket = theirs.failures.head_bucket
+                # Align both rings on the later head bucket, then add slot by slot
+                head_bucket = max(mine.failures.head_bucket, theirs.failures.head_bucket)
+                mine.failures._advance((head_bucket + 0.5) * mine.failures.width)
+                theirs.failures._advance((head_bucket + 0.5) * theirs.failures.width)
+                shift = theirs.failures.head - mine.failures.head
+                size = len(mine.failures.counts)
+                for slot in range(size):
+                    mine.failures.counts[slot] += theirs.failures.counts[(slot + shift) % size]
+                mine.failures.total += theirs.failures.total
+
+            self._keys = OrderedDict(sorted(self._keys.items(), key=lambda item: item[1].last_seen or 0.0))
+            self._evict(time.time())
+
+    def clear(self) -> None:
+        with self._lock:
+            self._keys.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            sources = sum(1 for kind, _ in self._keys if kind == 'source')
+            return {
+                'tracked_sources': sources,
+                'tracked_users': len(self._keys) - sources,
+                'evictions': self.evictions,
+                'max_keys': self.max_keys,
+                'idle_ttl': self.idle_ttl,
+            }
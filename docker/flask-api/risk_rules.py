@@ -0,0 +1,369 @@
+"""
+Risk Rule Matcher for MARSLOG-ClickHouse
+Config-driven indicator rules compiled into a single-pass keyword automaton
+"""
+
+import json
+import re
+import logging
+from pathlib import Path
+from typing import Dict, List, Any, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Default rule table. Each rule fires at most once per line and contributes
+# its weight to the risk score and/or its anomaly name to the indicators.
+#   any             - literal keywords, any occurrence fires the rule
+#   sequences       - ordered keyword lists that must appear on one line
+#                     (the equivalent of ``a.*b``); a list inside a sequence
+#                     is a set of alternatives for that position
+#   word_bound      - require a word boundary before and after the match
+#   unless_followed - suppress a hit when one of these follows on the line
+#   match_empty     - fire on an empty line
+DEFAULT_RISK_SCORING = {
+    'rules': [
+        {
+            'id': 'attack_malware',
+            'weight': 35,
+            'word_bound': True,
+            'any': ['exploit', 'attack', 'malware', 'virus', 'trojan', 'backdoor',
+                    'shellcode', 'injection', 'xss', 'sqli'],
+        },
+        {
+            'id': 'attack_access',
+            'weight': 35,
+            'word_bound': True,
+            'any': ['unauthorized', 'forbidden', 'denied', 'blocked', 'failed', 'breach'],
+        },
+        {
+            'id': 'attack_suspicious',
+            'weight': 35,
+            'word_bound': True,
+            'any': ['suspicious', 'anomaly', 'anomalous', 'unusual', 'unexpected'],
+        },
+        {
+            'id': 'attack_intrusion',
+            'weight': 35,
+            'word_bound': True,
+            'any': ['intrusion', 'penetration', 'dos', 'ddos'],
+            'sequences': [['brute', 'force']],
+        },
+        {
+            'id': 'error_keyword',
+            'weight': 20,
+            'word_bound': True,
+            'any': ['error', 'fail', 'exception', 'timeout', 'refused', 'unreachable', 'denied'],
+        },
+        {
+            'id': 'error_status',
+            'weight': 20,
+            'word_bound': True,
+            'any': ['404', '500', '503', '502', '501', '401', '403', '407', '408', '429'],
+        },
+        {
+            'id': 'privileged_account',
+            'weight': 15,
+            'any': ['root', 'admin', 'administrator'],
+        },
+        {
+            'id': 'access_failure',
+            'weight': 20,
+            'any': ['failed', 'denied', 'unauthorized', 'blocked'],
+        },
+        {
+            'id': 'sql_injection',
+            'weight': 40,
+            'any': ['<script'],
+            'sequences': [['union', 'select'], ['drop', 'table'], ['exec', 'sp_']],
+        },
+        {
+            'id': 'auth_failure',
+            'any': ['authentication failure', 'invalid user', 'login failed', 'login incorrect'],
+            'sequences': [['failed', ['password', 'login', 'auth']], ['access denied', 'user']],
+        },
+        {
+            'id': 'multiple_failures',
+            'anomaly': 'multiple_failures',
+            'sequences': [['failed', list('0123456789'), 'time']],
+        },
+        {
+            'id': 'brute_force',
+            'anomaly': 'brute_force_attempt',
+            'sequences': [['brute', 'force'], ['dictionary', 'attack'], ['password', 'spray']],
+        },
+        {
+            'id': 'scanner_user_agent',
+            'anomaly': 'suspicious_user_agent',
+            'any': ['sqlmap', 'nmap', 'nikto', 'dirb', 'gobuster', 'wfuzz'],
+        },
+        {
+            'id': 'crawler_user_agent',
+            'anomaly': 'suspicious_user_agent',
+            'any': ['bot', 'crawler', 'spider'],
+            'unless_followed': ['google'],
+        },
+        {
+            'id': 'empty_user_agent',
+            'anomaly': 'suspicious_user_agent',
+            'match_empty': True,
+        },
+    ],
+    'status_weights': {
+        '401': 25, '403': 25,
+        '404': 15, '500': 15, '502': 15, '503': 15,
+        '429': 30,
+    },
+    'internal_ip_weight': -5,
+    'external_ip_weight': 10,
+    'large_transfer_weight': 25,
+    'max_score': 100,
+}
+
+
+def load_risk_scoring(config_path: Optional[Path] = None) -> Dict[str, Any]:
+    """Load the risk scoring table, falling back to the built-in defaults"""
+    scoring = dict(DEFAULT_RISK_SCORING)
+    if config_path is None or not Path(config_path).exists():
+        return scoring
+
+    try:
+        with open(config_path, 'r') as f:
+            overrides = json.load(f).get('risk_scoring', {})
+        scoring.update(overrides)
+    except (json.JSONDecodeError, OSError) as e:
+        logger.error(f"Error loading risk scoring rules from {config_path}: {e}")
+
+    return scoring
+
+
+def _is_word(ch: str) -> bool:
+    """Mirror of the regex engine's word-character test"""
+    return ch.isalnum() or ch == '_'
+
+
+def _at_boundary(text: str, pos: int) -> bool:
+    """Equivalent of ``\\b`` at position ``pos``"""
+    before = pos > 0 and _is_word(text[pos - 1])
+    after = pos < len(text) and _is_word(text[pos])
+    return before != after
+
+
+class IndicatorHits:
+    """Result of a single scan: fired rules, summed weight and anomaly names"""
+
+    __slots__ = ('rules', 'weight', 'anomalies')
+
+    def __init__(self):
+        self.rules = set()
+        self.weight = 0
+        self.anomalies = set()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'rules': sorted(self.rules),
+            'weight': self.weight,
+            'anomalies': sorted(self.anomalies),
+        }
+
+
+class RiskRuleMatcher:
+    """Compiles a rule table into one case-insensitive keyword automaton.
+
+    Every keyword of every rule is inserted into a trie which is rendered as
+    a single regex. The regex is applied as a lookahead at each position of
+    the line, so one ``finditer`` pass reports every (overlapping) keyword
+    occurrence. Rules are then resolved from the occurrence table without
+    touching the line again.
+    """
+
+    NEWLINE = '\n'
+
+    def __init__(self, rules: List[Dict[str, Any]]):
+        self.rules = rules
+        self.keywords: List[str] = []
+        self._keyword_ids: Dict[str, int] = {}
+
+        self._intern(self.NEWLINE)
+        for rule in rules:
+            for keyword in rule.get('any', []):
+                self._intern(keyword)
+            for sequence in rule.get('sequences', []):
+                for token in sequence:
+                    for keyword in self._alternatives(token):
+                        self._intern(keyword)
+            for keyword in rule.get('unless_followed', []):
+                self._intern(keyword)
+
+        self._compile()
+        self._compile_rules()
+
+    @staticmethod
+    def _alternatives(token) -> List[str]:
+        return [token] if isinstance(token, str) else list(token)
+
+    def _intern(self, keyword: str) -> int:
+        keyword = keyword.lower()
+        if keyword not in self._keyword_ids:
+            self._keyword_ids[keyword] = len(self.keywords)
+            self.keywords.append(keyword)
+        return self._keyword_ids[keyword]
+
+    def _compile(self) -> None:
+        """Render the keyword trie as one regex with a marker group per keyword"""
+        trie: Dict[str, Any] = {}
+        for keyword in self.keywords:
+            node = trie
+            for ch in keyword:
+                node = node.setdefault(ch, {})
+            node[''] = keyword
+
+        group_keywords: List[str] = []
+
+        def render(node: Dict[str, Any]) -> str:
+            terminal = node.get('')
+            mark = ''
+            if terminal is not None:
+                group_keywords.append(terminal)
+                mark = f'(?P<k{len(group_keywords)}>)'
+
+            branches = [re.escape(ch) + render(child)
+                        for ch, child in sorted(node.items()) if ch]
+            if not branches:
+                return mark
+
+            body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+            return f'{mark}(?:{body})?' if terminal is not None else body
+
+        self._scanner = re.compile('(?=' + render(trie) + ')', re.IGNORECASE)
+
+        # The deepest marker reached at a position identifies the longest
+        # keyword; every shorter keyword on the same trie path matched too.
+        self._group_paths: Dict[int, List[int]] = {}
+        for group, keyword in enumerate(group_keywords, start=1):
+            self._group_paths[group] = [
+                self._keyword_ids[keyword[:n]]
+                for n in range(1, len(keyword) + 1)
+                if keyword[:n] in self._keyword_ids
+            ]
+
+    def find_occurrences(self, text: str) -> Dict[int, List[tuple]]:
+        """Single pass over ``text``: keyword id -> [(start, end, line_no)]"""
+        occurrences: Dict[int, List[tuple]] = {}
+        newline_id = self._keyword_ids[self.NEWLINE]
+        line_no = 0
+        for match in self._scanner.finditer(text):
+            start = match.start()
+            for keyword_id in self._group_paths[match.lastindex]:
+                if keyword_id == newline_id:
+                    line_no += 1
+                    continue
+                end = start + len(self.keywords[keyword_id])
+                occurrences.setdefault(keyword_id, []).append((start, end, line_no))
+        return occurrences
+
+    def _ids(self, tokens) -> Tuple[int, ...]:
+        return tuple(self._keyword_ids[keyword.lower()]
+                     for token in tokens for keyword in self._alternatives(token))
+
+    def _compile_rules(self) -> None:
+        """Resolve rule keywords to ids once so scans work on integer sets"""
+        self._compiled = []
+        for rule in self.rules:
+            any_ids = frozenset(self._ids(rule.get('any', [])))
+            sequences = tuple(
+                tuple(self._ids([token]) for token in sequence)
+                for sequence in rule.get('sequences', [])
+            )
+            triggers = any_ids.union(*(sequence[0] for sequence in sequences))
+            self._compiled.append((
+                rule,
+                triggers,
+                any_ids,
+                sequences,
+                rule.get('word_bound', False),
+                self._ids(rule.get('unless_followed', [])),
+                rule.get('match_empty', False),
+            ))
+
+    @staticmethod
+    def _collect(occurrences, keyword_ids) -> List[tuple]:
+        found = []
+        for keyword_id in keyword_ids:
+            found.extend(occurrences.get(keyword_id, ()))
+        return found
+
+    def _match_any(self, text, occurrences, any_ids, bound, blocker_ids) -> bool:
+        present = any_ids.intersection(occurrences)
+        if not present:
+            return False
+        if not bound and not blocker_ids:
+            return True
+
+        # Last blocker start per line: a hit survives only if it ends after it
+        last_blocker: Dict[int, int] = {}
+        for start, _, line_no in self._collect(occurrences, blocker_ids):
+            if start > last_blocker.get(line_no, -1):
+                last_blocker[line_no] = start
+
+        for start, end, line_no in self._collect(occurrences, present):
+            if bound and not (_at_boundary(text, start) and _at_boundary(text, end)):
+                continue
+            if last_blocker.get(line_no, -1) >= end:
+                continue
+            return True
+        return False
+
+    def _match_sequence(self, text, occurrences, sequence, bound) -> bool:
+        """Ordered match in linear time: keep the earliest feasible end per line"""
+        first, middle, last = sequence[0], sequence[1:-1], sequence[-1]
+        tails = self._collect(occurrences, last)
+        if not tails:
+            return False
+
+        cursors: Dict[int, int] = {}
+        for start, end, line_no in self._collect(occurrences, first):
+            if bound and not _at_boundary(text, start):
+                continue
+            if end < cursors.get(line_no, end + 1):
+                cursors[line_no] = end
+
+        for token in middle:
+            following: Dict[int, int] = {}
+            for start, end, line_no in self._collect(occurrences, token):
+                cursor = cursors.get(line_no)
+                if cursor is not None and start >= cursor and end < following.get(line_no, end + 1):
+                    following[line_no] = end
+            cursors = following
+            if not cursors:
+                return False
+
+        for start, end, line_no in tails:
+            cursor = cursors.get(line_no)
+            if cursor is not None and start >= cursor and (not bound or _at_boundary(text, end)):
+                return True
+        return False
+
+    def scan(self, text: str) -> IndicatorHits:
+        """Evaluate every rule against ``text`` with one automaton pass"""
+        hits = IndicatorHits()
+        occurrences = self.find_occurrences(text)
+        empty = text in ('', self.NEWLINE)
+
+        for rule, triggers, any_ids, sequences, bound, blocker_ids, match_empty in self._compiled:
+            if match_empty and empty:
+                fired = True
+            elif triggers.isdisjoint(occurrences):
+                continue
+            else:
+                fired = (
+                    self._match_any(text, occurrences, any_ids, bound, blocker_ids)
+                    or any(self._match_sequence(text, occurrences, sequence, bound)
+                           for sequence in sequences)
+                )
+            if fired:
+                hits.rules.add(rule['id'])
+                hits.weight += rule.get('weight', 0)
+                if rule.get('anomaly'):
+                    hits.anomalies.add(rule['anomaly'])
+
+        return hits
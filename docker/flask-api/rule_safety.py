@@ -0,0 +1,456 @@
+"""
+Rule Safety Guard for MARSLOG-ClickHouse
+Static ReDoS audit, quantifier bounding and per-line scan budgets for parser rules
+"""
+
+import json
+import re
+import logging
+from pathlib import Path
+from typing import Dict, List, Any, Optional, Tuple
+
+try:
+    from re import _parser as sre_parse, _constants as sre_constants
+except ImportError:  # Python < 3.11
+    import sre_parse
+    import sre_constants
+
+# The third-party ``regex`` engine supports match timeouts; without it the
+# guard falls back to bounding the quantifiers of flagged rules.
+try:
+    import regex
+    REGEX_TIMEOUT_AVAILABLE = True
+except ImportError:
+    regex = None
+    REGEX_TIMEOUT_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RULE_SAFETY = {
+    'max_scan_length': 8192,   # characters of a line handed to regex families
+    'max_repeat': 128,         # repeat bound for flagged rules when ``regex`` is missing
+    'match_timeout': 0.05,     # seconds per flagged rule per line (needs ``regex``)
+}
+
+_REPEATS = {sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT,
+            getattr(sre_constants, 'POSSESSIVE_REPEAT', sre_constants.MAX_REPEAT)}
+_SINGLE_CHAR = {sre_constants.LITERAL, sre_constants.NOT_LITERAL,
+                sre_constants.ANY, sre_constants.IN}
+_LOOKAROUND = {sre_constants.ASSERT, sre_constants.ASSERT_NOT}
+_BEGINNING = {sre_constants.AT_BEGINNING, sre_constants.AT_BEGINNING_STRING}
+
+# Overlap between character classes is decided on this sample alphabet
+_ALPHABET = frozenset(range(128))
+_CATEGORIES = {
+    sre_constants.CATEGORY_DIGIT: frozenset(c for c in _ALPHABET if chr(c).isdigit()),
+    sre_constants.CATEGORY_SPACE: frozenset(c for c in _ALPHABET if chr(c).isspace()),
+    sre_constants.CATEGORY_WORD: frozenset(c for c in _ALPHABET if chr(c).isalnum() or c == ord('_')),
+}
+_CATEGORIES[sre_constants.CATEGORY_NOT_DIGIT] = _ALPHABET - _CATEGORIES[sre_constants.CATEGORY_DIGIT]
+_CATEGORIES[sre_constants.CATEGORY_NOT_SPACE] = _ALPHABET - _CATEGORIES[sre_constants.CATEGORY_SPACE]
+_CATEGORIES[sre_constants.CATEGORY_NOT_WORD] = _ALPHABET - _CATEGORIES[sre_constants.CATEGORY_WORD]
+_WHITESPACE = _CATEGORIES[sre_constants.CATEGORY_SPACE]
+
+
+def _is_unbounded(item) -> bool:
+    op, av = item
+    return op in _REPEATS and av[1] == sre_constants.MAXREPEAT
+
+
+def _charset(items, ignore_case: bool) -> frozenset:
+    """ASCII characters any element of ``items`` can consume"""
+    chars = set()
+    for op, av in items:
+        if op == sre_constants.LITERAL:
+            chars.add(av)
+        elif op == sre_constants.NOT_LITERAL:
+            chars |= _ALPHABET - {av}
+        elif op == sre_constants.ANY:
+            chars |= _ALPHABET - {ord('\n')}
+        elif op == sre_constants.IN:
+            members, negate = set(), False
+            for in_op, in_av in av:
+                if in_op == sre_constants.NEGATE:
+                    negate = True
+                elif in_op == sre_constants.LITERAL:
+                    members.add(in_av)
+                elif in_op == sre_constants.RANGE:
+                    members |= set(range(in_av[0], min(in_av[1], 127) + 1))
+                elif in_op == sre_constants.CATEGORY:
+                    members |= _CATEGORIES.get(in_av, _ALPHABET)
+            chars |= (_ALPHABET - members) if negate else members
+        elif op in _REPEATS:
+            chars |= _charset(av[2], ignore_case)
+        elif op == sre_constants.SUBPATTERN:
+            chars |= _charset(av[-1], ignore_case)
+        elif op == sre_constants.BRANCH:
+            for branch in av[1]:
+                chars |= _charset(branch, ignore_case)
+
+    if ignore_case:
+        chars |= {ord(chr(c).swapcase()) for c in chars if c < 128 and chr(c).isalpha()}
+    return frozenset(c for c in chars if c < 128)
+
+
+def _min_width(items) -> int:
+    width = 0
+    for op, av in items:
+        if op in _SINGLE_CHAR:
+            width += 1
+        elif op in _REPEATS:
+            width += av[0] * _min_width(av[2])
+        elif op == sre_constants.SUBPATTERN:
+            width += _min_width(av[-1])
+        elif op == sre_constants.BRANCH:
+            width += min(_min_width(branch) for branch in av[1])
+    return width
+
+
+def _first_chars(items, ignore_case: bool) -> frozenset:
+    """Characters that can start a match of ``items``"""
+    chars = frozenset()
+    for item in _inline_groups(items):
+        if item[0] == sre_constants.BRANCH:
+            for branch in item[1][1]:
+                chars |= _first_chars(branch, ignore_case)
+        else:
+            chars |= _charset([item], ignore_case)
+        if _min_width([item]) > 0:
+            break
+    return chars
+
+
+def _branches_overlap(branches, ignore_case: bool) -> bool:
+    seen = frozenset()
+    for branch in branches:
+        first = _first_chars(branch, ignore_case)
+        if seen & first:
+            return True
+        seen |= first
+    return False
+
+
+def _inline_groups(items) -> list:
+    """Flatten plain groups so sequences are analysed element by element"""
+    flat = []
+    for op, av in items:
+        if op == sre_constants.SUBPATTERN:
+            flat.extend(_inline_groups(av[-1]))
+        else:
+            flat.append((op, av))
+    return flat
+
+
+def _audit_sequence(items, findings: set, anchored: bool, ignore_case: bool,
+                    in_repeat: bool = False, in_lookaround: bool = False,
+                    leading: bool = True) -> None:
+    items = _inline_groups(items)
+    previous_repeat = None  # (charset, only zero-width items since)
+
+    for index, (op, av) in enumerate(items):
+        if _is_unbounded((op, av)):
+            body = av[2]
+            chars = _charset(body, ignore_case)
+            rest_width = _min_width(items[index + 1:])
+
+            if in_repeat:
+                findings.add('nested_quantifier')
+            if in_lookaround:
+                findings.add('lookaround_scan')
+            if (not anchored and rest_width > 0
+                    and len(body) == 1 and body[0][0] == sre_constants.ANY):
+                findings.add('wildcard_gap')
+            if (previous_repeat and previous_repeat[1] and previous_repeat[0] & chars
+                    and rest_width > 0):
+                findings.add('adjacent_overlap')
+            if not anchored and leading and rest_width > 0:
+                # At most one overlapping character before the repeat means
+                # every position inside a long run is a fresh start
+                prefix = items[:index]
+                if (_min_width(prefix) <= 1
+                        and all(not _charset([item], ignore_case) or _charset([item], ignore_case) & chars
+                                for item in prefix)):
+                    findings.add('leading_repeat')
+
+            for b_op, b_av in _inline_groups(body)[:1]:
+                if b_op == sre_constants.BRANCH and _branches_overlap(b_av[1], ignore_case):
+                    findings.add('ambiguous_alternation')
+            _audit_sequence(body, findings, anchored, ignore_case,
+                            in_repeat=True, in_lookaround=in_lookaround, leading=False)
+            previous_repeat = (chars, True)
+            continue
+
+        if op in _REPEATS:
+            _audit_sequence(av[2], findings, anchored, ignore_case,
+                            in_repeat=in_repeat, in_lookaround=in_lookaround, leading=False)
+        elif op == sre_constants.BRANCH:
+            for branch in av[1]:
+                _audit_sequence(branch, findings, anchored, ignore_case,
+                                in_repeat=in_repeat, in_lookaround=in_lookaround,
+                                leading=leading and index == 0)
+        elif op in _LOOKAROUND:
+            _audit_sequence(av[1], findings, anchored, ignore_case,
+                            in_repeat=in_repeat, in_lookaround=True, leading=False)
+
+        if previous_repeat and _min_width([(op, av)]) > 0:
+            previous_repeat = (previous_repeat[0], False)
+
+
+def audit_pattern(pattern: str, flags: int = 0) -> List[str]:
+    """Flag constructs that make a pattern super-linear in the line length.
+
+    nested_quantifier  - unbounded repeat inside an unbounded repeat
+    adjacent_overlap   - two unbounded repeats over overlapping characters
+                         with nothing mandatory between them (``.*\\d+``)
+    leading_repeat     - unanchored pattern that opens with an unbounded
+                         class repeat, rescanned from every start position
+    wildcard_gap       - unanchored ``.*`` followed by more pattern
+                         (``union.*select``), one full scan per prefix hit
+    lookaround_scan    - unbounded repeat inside a lookaround
+    ambiguous_alternation - repeated alternation whose branches can start
+                         with the same character (``(a|ab)*``)
+    """
+    parsed = sre_parse.parse(pattern, flags)
+    items = list(parsed.data)
+    anchored = bool(items) and items[0][0] == sre_constants.AT and items[0][1] in _BEGINNING
+    findings = set()
+    _audit_sequence(items, findings, anchored, bool(flags & re.IGNORECASE))
+    return sorted(findings)
+
+
+def dispatch_hint(pattern: str, flags: int = 0) -> Tuple[Optional[frozenset], str]:
+    """(possible first characters, literal prefix) of an anchored pattern.
+
+    Lines starting with an ASCII character outside the set cannot match. The
+    set is None when the pattern is unanchored or can match the empty string,
+    and the prefix is empty when the pattern does not open with literals or
+    ignores case.
+    """
+    parsed = sre_parse.parse(pattern, flags)
+    items = list(parsed.data)
+    if not items or items[0][0] != sre_constants.AT or items[0][1] not in _BEGINNING:
+        return None, ''
+    if _min_width(items) == 0:
+        return None, ''
+    ignore_case = bool(parsed.state.flags & re.IGNORECASE)
+
+    prefix = []
+    if not ignore_case:
+        for op, av in _inline_groups(items[1:]):
+            if op != sre_constants.LITERAL:
+                break
+            prefix.append(chr(av))
+    return _first_chars(items[1:], ignore_case), ''.join(prefix)
+
+
+def _whitespace_gaps(items) -> Optional[int]:
+    gaps = 0
+    for op, av in items:
+        if op in _SINGLE_CHAR:
+            gaps += 1 if _charset([(op, av)], False) & _WHITESPACE else 0
+            continue
+        if op in _REPEATS:
+            body_gaps = _whitespace_gaps(av[2])
+            if body_gaps is None:
+                return None
+            if not body_gaps:
+                continue
+            if not _charset(av[2], False) - _WHITESPACE:
+                item_gaps = 1           # a run of whitespace is one gap
+            elif av[1] == sre_constants.MAXREPEAT:
+                return None
+            else:
+                item_gaps = av[1] * body_gaps
+        elif op == sre_constants.SUBPATTERN:
+            item_gaps = _whitespace_gaps(av[-1])
+        elif op == sre_constants.BRANCH:
+            branch_gaps = [_whitespace_gaps(branch) for branch in av[1]]
+            item_gaps = None if None in branch_gaps else max(branch_gaps)
+        else:
+            continue
+        if item_gaps is None:
+            return None
+        gaps += item_gaps
+    return gaps
+
+
+def consumable_chars(pattern: str, flags: int = 0) -> frozenset:
+    """ASCII characters a match of ``pattern`` can contain (lookarounds excluded)"""
+    parsed = sre_parse.parse(pattern, flags)
+    return _charset(list(parsed.data), bool(parsed.state.flags & re.IGNORECASE))
+
+
+def whitespace_gaps(pattern: str, flags: int = 0) -> Optional[int]:
+    """Most whitespace runs a match of ``pattern`` can contain, None if unbounded"""
+    return _whitespace_gaps(list(sre_parse.parse(pattern, flags).data))
+
+
+def load_rule_safety(config_path: Optional[Path] = None) -> Dict[str, Any]:
+    """Load the rule safety budgets, falling back to the built-in defaults"""
+    safety = dict(DEFAULT_RULE_SAFETY)
+    if config_path is None or not Path(config_path).exists():
+        return safety
+
+    try:
+        with open(config_path, 'r') as f:
+            safety.update(json.load(f).get('rule_safety', {}))
+    except (json.JSONDecodeError, OSError) as e:
+        logger.error(f"Error loading rule safety budgets from {config_path}: {e}")
+
+    return safety
+
+
+_OPEN_BOUND = re.compile(r'\{(\d*),\}')
+
+
+def bound_pattern(pattern: str, max_repeat: int) -> str:
+    """Rewrite ``*``, ``+`` and ``{m,}`` into ``{0,N}``, ``{1,N}`` and ``{m,N}``"""
+    out = []
+    i, in_class, after_quantifier = 0, False, False
+    while i < len(pattern):
+        ch = pattern[i]
+        if ch == '\\':
+            out.append(pattern[i:i + 2])
+            i += 2
+            after_quantifier = False
+            continue
+        if in_class:
+            out.append(ch)
+            in_class = ch != ']'
+            i += 1
+            continue
+        if ch == '[':
+            out.append(ch)
+            i += 1
+            if pattern.startswith('^', i):
+                out.append('^')
+                i += 1
+            if pattern.startswith(']', i):
+                out.append(']')
+                i += 1
+            in_class, after_quantifier = True, False
+            continue
+
+        if ch in '*+' and not after_quantifier:
+            out.append(f'{{{0 if ch == "*" else 1},{max_repeat}}}')
+            after_quantifier = True
+        elif ch == '{' and _OPEN_BOUND.match(pattern, i):
+            match = _OPEN_BOUND.match(pattern, i)
+            out.append(f'{{{match.group(1) or 0},{max(max_repeat, int(match.group(1) or 0))}}}')
+            i = match.end()
+            after_quantifier = True
+            continue
+        elif ch == '{' and re.match(r'\{\d*,?\d*\}', pattern[i:]):
+            end = pattern.index('}', i) + 1
+            out.append(pattern[i:end])
+            i = end
+            after_quantifier = True
+            continue
+        elif ch in '+?' and after_quantifier:
+            # Possessive or lazy suffix of the quantifier just emitted
+            out.append(ch)
+            after_quantifier = False
+        else:
+            out.append(ch)
+            after_quantifier = ch == '?'
+        i += 1
+    return ''.join(out)
+
+
+class GuardedPattern:
+    """A compiled rule together with its audit result"""
+
+    __slots__ = ('name', 'source', 'pattern', 'findings', 'timed')
+
+    def __init__(self, name: str, source: str, pattern, findings: List[str], timed: bool):
+        self.name = name
+        self.source = source
+        self.pattern = pattern
+        self.findings = findings
+        self.timed = timed
+
+
+class RuleSafetyGuard:
+    """Audits rules when they are loaded and enforces per-line scan budgets"""
+
+    def __init__(self, max_scan_length: int = DEFAULT_RULE_SAFETY['max_scan_length'],
+                 max_repeat: int = DEFAULT_RULE_SAFETY['max_repeat'],
+                 match_timeout: Optional[float] = DEFAULT_RULE_SAFETY['match_timeout']):
+        self.max_scan_length = max_scan_length
+        self.max_repeat = max_repeat
+        self.match_timeout = match_timeout if REGEX_TIMEOUT_AVAILABLE else None
+        self.flagged: Dict[str, Dict[str, Any]] = {}
+        self.clipped_lines = 0
+        self.budget_exceeded: Dict[str, int] = {}
+
+    def compile(self, name: str, pattern: str, flags: int = 0) -> GuardedPattern:
+        """Audit ``pattern``; time-limit it when it is super-linear.
+
+        A flagged rule keeps its pattern as written and runs under the match
+        timeout, so long values (paths, e-mail addresses) still match in full.
+        Only without the ``regex`` engine, and so without a timeout, are its
+        repeats bounded to ``max_repeat`` instead.
+        """
+        findings = audit_pattern(pattern, flags)
+        if not findings:
+            return GuardedPattern(name, pattern, re.compile(pattern, flags), [], False)
+
+        if self.match_timeout:
+            logger.warning(f"Rule {name} may backtrack super-linearly ({', '.join(findings)}); "
+                           f"limiting it to {self.match_timeout}s per line")
+            self.flagged[name] = {'pattern': pattern, 'bounded': None, 'findings': findings}
+            return GuardedPattern(name, pattern, regex.compile(pattern, flags), findings, True)
+
+        bounded = bound_pattern(pattern, self.max_repeat)
+        logger.warning(f"Rule {name} may backtrack super-linearly ({', '.join(findings)}); "
+                       f"bounding repeats to {self.max_repeat}")
+        self.flagged[name] = {'pattern': pattern, 'bounded': bounded, 'findings': findings}
+        return GuardedPattern(name, pattern, re.compile(bounded, flags), findings, False)
+
+    def clip(self, text: str) -> str:
+        """Apply the per-line scan-length budget"""
+        if len(text) > self.max_scan_length:
+            self.clipped_lines += 1
+            return text[:self.max_scan_length]
+        return text
+
+    def _exceeded(self, rule: GuardedPattern) -> None:
+        self.budget_exceeded[rule.name] = self.budget_exceeded.get(rule.name, 0) + 1
+        logger.warning(f"Rule {rule.name} exceeded its {self.match_timeout}s budget; skipped")
+
+    def findall(self, rule: GuardedPattern, text: str) -> list:
+        if not rule.timed:
+            return rule.pattern.findall(text)
+        try:
+            return rule.pattern.findall(text, timeout=self.match_timeout)
+        except TimeoutError:
+            self._exceeded(rule)
+            return []
+
+    def finditer(self, rule: GuardedPattern, text: str) -> list:
+        if not rule.timed:
+            return list(rule.pattern.finditer(text))
+        try:
+            return list(rule.pattern.finditer(text, timeout=self.match_timeout))
+        except TimeoutError:
+            self._exceeded(rule)
+            return []
+
+    def search(self, rule: GuardedPattern, text: str):
+        if not rule.timed:
+            return rule.pattern.search(text)
+        try:
+            return rule.pattern.search(text, timeout=self.match_timeout)
+        except TimeoutError:
+            self._exceeded(rule)
+            return None
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'max_scan_length': self.max_scan_length,
+            'max_repeat': self.max_repeat,
+            'match_timeout': self.match_timeout,
+            'flagged_rules': self.flagged,
+            'clipped_lines': self.clipped_lines,
+            'budget_exceeded': dict(self.budget_exceeded),
+        }
@@ -0,0 +1,249 @@
+"""
+Shared Learned State for MARSLOG-ClickHouse
+Redis-backed learned pattern counts shared by all workers, flushed in pipelined batches
+"""
+
+import os
+import json
+import time
+import atexit
+import threading
+import logging
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Any, Optional, Tuple
+
+try:
+    import redis
+except ImportError:  # shared state is optional
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SHARED_STATE = {
+    'enabled': False,
+    'redis_host': os.getenv('REDIS_HOST', 'redis'),
+    'redis_port': int(os.getenv('REDIS_PORT', 6379)),
+    'redis_db': 0,
+    'key_prefix': 'marslog:ai',
+    'flush_interval_sec': 5,     # how often local deltas are pushed
+    'cache_ttl_sec': 2,          # how long cluster-wide reads are reused
+    'max_values': 1000,          # values kept per pattern key in Redis
+    'max_pending': 100000,       # distinct (key, value) deltas buffered locally
+}
+
+
+def load_shared_state(config_path: Optional[Path] = None) -> Dict[str, Any]:
+    """Load the shared state settings, falling back to the built-in defaults"""
+    settings = dict(DEFAULT_SHARED_STATE)
+    if config_path is None or not Path(config_path).exists():
+        return settings
+
+    try:
+        with open(config_path, 'r') as f:
+            settings.update(json.load(f).get('shared_state', {}))
+    except (json.JSONDecodeError, OSError) as e:
+        logger.error(f"Error loading shared state settings from {config_path}: {e}")
+
+    return settings
+
+
+class SharedPatternState:
+    """Cluster-wide learned pattern counts kept in Redis.
+
+    Workers never talk to Redis per log line: ``add`` only bumps a local
+    delta. A background thread pushes the deltas every
+    ``flush_interval_sec`` in one pipeline (``HINCRBY`` for per-key totals,
+    ``ZINCRBY`` for per-value counts, trimmed to ``max_values``). Reads are
+    answered from a local copy refreshed at most every ``cache_ttl_sec``.
+
+    Redis layout under ``key_prefix``:
+        <prefix>:pattern_totals      hash  key -> events
+        <prefix>:pattern:<key>       zset  value -> count
+    """
+
+    def __init__(self, enabled: bool = DEFAULT_SHARED_STATE['enabled'],
+                 redis_host: str = DEFAULT_SHARED_STATE['redis_host'],
+                 redis_port: int = DEFAULT_SHARED_STATE['redis_port'],
+                 redis_db: int = DEFAULT_SHARED_STATE['redis_db'],
+                 key_prefix: str = DEFAULT_SHARED_STATE['key_prefix'],
+                 flush_interval_sec: float = DEFAULT_SHARED_STATE['flush_interval_sec'],
+                 cache_ttl_sec: float = DEFAULT_SHARED_STATE['cache_ttl_sec'],
+                 max_values: int = DEFAULT_SHARED_STATE['max_values'],
+                 max_pending: int = DEFAULT_SHARED_STATE['max_pending']):
+        if enabled and redis is None:
+            logger.warning("Shared learned state requested but the redis package is not installed")
+            enabled = False
+        self.enabled = enabled
+        self.redis_host = redis_host
+        self.redis_port = redis_port
+        self.redis_db = redis_db
+        self.key_prefix = key_prefix
+        self.flush_interval_sec = flush_interval_sec
+        self.cache_ttl_sec = cache_ttl_sec
+        self.max_values = max_values
+        self.max_pending = max_pending
+
+        self._pending: Dict[str, Counter] = {}
+        self._pending_size = 0
+        self._lock = threading.Lock()
+        self._client = None
+        self._cache: Dict[Any, Tuple[float, Any]] = {}
+        self._owner_pid = None
+        self._stop = threading.Event()
+
+        self.flushes = 0
+        self.flush_errors = 0
+        self.flushed_deltas = 0
+        self.dropped_deltas = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.last_flush = None
+
+    def _totals_key(self) -> str:
+        return f"{self.key_prefix}:pattern_totals"
+
+    def _values_key(self, key: str) -> str:
+        return f"{self.key_prefix}:pattern:{key}"
+
+    def get_client(self):
+        """Get the Redis client, connecting on first use"""
+        if self._client is None:
+            self._client = redis.Redis(
+                host=self.redis_host,
+                port=self.redis_port,
+                db=self.redis_db,
+                decode_responses=True,
+                socket_connect_timeout=5,
+                socket_timeout=5
+            )
+        return self._client
+
+    def _ensure_flusher(self) -> None:
+        # Started lazily and per process, so workers forked after import get their own
+        if self._owner_pid != os.getpid():
+            self._owner_pid = os.getpid()
+            self._stop = threading.Event()
+            thread = threading.Thread(target=self._run, name='ai-shared-state', daemon=True)
+            thread.start()
+            atexit.register(self.stop)
+
+    def add(self, key: str, value: str, count: int = 1) -> None:
+        """Record a learned value locally; it reaches Redis on the next flush"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._ensure_flusher()
+            deltas = self._pending.get(key)
+            if deltas is None:
+                deltas = self._pending[key] = Counter()
+            if value not in deltas:
+                if self._pending_size >= self.max_pending:
+                    self.dropped_deltas += 1
+                    return
+                self._pending_size += 1
+            deltas[value] += count
+
+    def _take_pending(self) -> Dict[str, Counter]:
+        with self._lock:
+            pending, self._pending, self._pending_size = self._pending, {}, 0
+        return pending
+
+    def _restore_pending(self, pending: Dict[str, Counter]) -> None:
+        """Put back deltas whose flush failed so they are retried"""
+        with self._lock:
+            for key, deltas in pending.items():
+                for value, count in deltas.items():
+                    mine = self._pending.setdefault(key, Counter())
+                    if value not in mine:
+                        if self._pending_size >= self.max_pending:
+                            self.dropped_deltas += 1
+                            continue
+                        self._pending_size += 1
+                    mine[value] += count
+
+    def flush(self) -> int:
+        """Push buffered deltas to Redis in one pipeline; returns deltas sent"""
+        pending = self._take_pending()
+        if not pending:
+            return 0
+
+        sent = sum(len(deltas) for deltas in pending.values())
+        try:
+            pipe = self.get_client().pipeline(transaction=False)
+            for key, deltas in pending.items():
+                values_key = self._values_key(key)
+                pipe.hincrby(self._totals_key(), key, sum(deltas.values()))
+                for value, count in deltas.items():
+                    pipe.zincrby(values_key, count, value)
+                # Keep only the max_values highest counts of this key
+                pipe.zremrangebyrank(values_key, 0, -(self.max_values + 1))
+            pipe.execute()
+        except Exception as e:
+            logger.error(f"Error flushing shared learned state to Redis: {e}")
+            self.flush_errors += 1
+            self._restore_pending(pending)
+            return 0
+
+        self.flushes += 1
+        self.flushed_deltas += sent
+        self.last_flush = time.time()
+        return sent
+
+    def _run(self) -> None:
+        stop = self._stop
+        while not stop.wait(self.flush_interval_sec):
+            self.flush()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self.enabled:
+            self.flush()
+
+    def _cached(self, cache_key, load):
+        now = time.monotonic()
+        entry = self._cache.get(cache_key)
+        if entry is not None and entry[0] > now:
+            self.cache_hits += 1
+            return entry[1]
+        self.cache_misses += 1
+        value = load()
+        self._cache[cache_key] = (now + self.cache_ttl_sec, value)
+        return value
+
+    def get_totals(self) -> Dict[str, int]:
+        """Events learned per pattern key across all workers"""
+        def load():
+            totals = self.get_client().hgetall(self._totals_key())
+            return {key: int(count) for key, count in totals.items()}
+        return self._cached('totals', load)
+
+    def get_summary(self, n: int = 5) -> Dict[str, Dict[str, int]]:
+        """Top ``n`` values of every pattern key across all workers"""
+        def load():
+            keys = sorted(self.get_totals())
+            pipe = self.get_client().pipeline(transaction=False)
+            for key in keys:
+                pipe.zrevrange(self._values_key(key), 0, n - 1, withscores=True)
+            return {
+                key: {value: int(score) for value, score in ranked}
+                for key, ranked in zip(keys, pipe.execute())
+            }
+        return self._cached(('summary', n), load)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'enabled': self.enabled,
+            'redis': f"{self.redis_host}:{self.redis_port}/{self.redis_db}",
+            'flush_interval_sec': self.flush_interval_sec,
+            'cache_ttl_sec': self.cache_ttl_sec,
+            'pending_deltas': self._pending_size,
+            'flushes': self.flushes,
+            'flush_errors': self.flush_errors,
+            'flushed_deltas': self.flushed_deltas,
+            'dropped_deltas': self.dropped_deltas,
+            'cache_hits': self.cache_hits,
+            'cache_misses': self.cache_misses,
+            'last_flush': datetime.fromtimestamp(self.last_flush).isoformat() if self.last_flush else None,
+        }
@@ -0,0 +1,247 @@
+"""
+Streaming Sketches for MARSLOG-ClickHouse
+Fixed-memory heavy-hitter and frequency sketches for learned field patterns
+"""
+
+import heapq
+import json
+import hashlib
+import threading
+import logging
+from array import array
+from pathlib import Path
+from typing import Dict, List, Any, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PATTERN_SKETCHES = {
+    'top_k': 64,        # heavy hitters tracked exactly per field
+    'cm_width': 1024,   # Count-Min counters per row
+    'cm_depth': 4,      # Count-Min rows
+    'max_keys': 512,    # distinct "<log_type>_<field>" keys
+}
+
+
+def load_pattern_sketches(config_path: Optional[Path] = None) -> Dict[str, Any]:
+    """Load the pattern sketch settings, falling back to the built-in defaults"""
+    settings = dict(DEFAULT_PATTERN_SKETCHES)
+    if config_path is None or not Path(config_path).exists():
+        return settings
+
+    try:
+        with open(config_path, 'r') as f:
+            settings.update(json.load(f).get('pattern_sketches', {}))
+    except (json.JSONDecodeError, OSError) as e:
+        logger.error(f"Error loading pattern sketch settings from {config_path}: {e}")
+
+    return settings
+
+
+def _hash_pair(value: str) -> Tuple[int, int]:
+    """Two independent 32-bit hashes; stable across processes so state can merge"""
+    digest = hashlib.blake2b(value.encode('utf-8', 'surrogatepass'), digest_size=8).digest()
+    return int.from_bytes(digest[:4], 'little'), int.from_bytes(digest[4:], 'little') | 1
+
+
+class CountMinSketch:
+    """Frequency estimates that never undercount, in width * depth counters"""
+
+    __slots__ = ('width', 'depth', 'rows')
+
+    def __init__(self, width: int = DEFAULT_PATTERN_SKETCHES['cm_width'],
+                 depth: int = DEFAULT_PATTERN_SKETCHES['cm_depth']):
+        self.width = width
+        self.depth = depth
+        self.rows = [array('Q', bytes(8 * width)) for _ in range(depth)]
+
+    def _columns(self, value: str):
+        first, step = _hash_pair(value)
+        return [(first + row * step) % self.width for row in range(self.depth)]
+
+    def add(self, value: str, count: int = 1) -> int:
+        estimate = None
+        for row, column in zip(self.rows, self._columns(value)):
+            row[column] += count
+            if estimate is None or row[column] < estimate:
+                estimate = row[column]
+        return estimate
+
+    def estimate(self, value: str) -> int:
+        return min(row[column] for row, column in zip(self.rows, self._columns(value)))
+
+    def merge(self, other: 'CountMinSketch') -> None:
+        if (self.width, self.depth) != (other.width, other.depth):
+            raise ValueError("Count-Min sketches of different shape cannot be merged")
+        for row, other_row in zip(self.rows, other.rows):
+            for column, count in enumerate(other_row):
+                if count:
+                    row[column] += count
+
+
+class SpaceSaving:
+    """Top-k heavy hitters (Metwally et al.) with a per-item overestimate bound.
+
+    Holds at most ``k`` counters. An unseen item replaces the current minimum
+    and inherits its count as the error bound. The minimum is found through a
+    lazily-invalidated heap that is rebuilt when it fills with stale entries.
+    """
+
+    __slots__ = ('k', 'counts', 'errors', '_heap')
+
+    def __init__(self, k: int = DEFAULT_PATTERN_SKETCHES['top_k']):
+        self.k = k
+        self.counts: Dict[str, int] = {}
+        self.errors: Dict[str, int] = {}
+        self._heap: List[Tuple[int, str]] = []
+
+    def _pop_minimum(self) -> Tuple[str, int]:
+        while True:
+            count, value = heapq.heappop(self._heap)
+            if self.counts.get(value) == count:
+                return value, count
+
+    def add(self, value: str, count: int = 1) -> None:
+        if value in self.counts:
+            self.counts[value] += count
+        elif len(self.counts) < self.k:
+            self.counts[value] = count
+            self.errors[value] = 0
+        else:
+            evicted, floor = self._pop_minimum()
+            del self.counts[evicted]
+            del self.errors[evicted]
+            self.counts[value] = floor + count
+            self.errors[value] = floor
+
+        heapq.heappush(self._heap, (self.counts[value], value))
+        if len(self._heap) > 4 * self.k:
+            self._heap = [(count, item) for item, count in self.counts.items()]
+            heapq.heapify(self._heap)
+
+    def most_common(self, n: Optional[int] = None) -> List[Tuple[str, int]]:
+        ranked = sorted(self.counts.items(), key=lambda item: item[1], reverse=True)
+        return ranked if n is None else ranked[:n]
+
+    def merge(self, other: 'SpaceSaving') -> None:
+        """Combine two summaries; items missing from one side get its floor as error"""
+        floor = min(self.counts.values()) if len(self.counts) >= self.k else 0
+        other_floor = min(other.counts.values()) if len(other.counts) >= other.k else 0
+
+        counts = {}
+        errors = {}
+        for value in set(self.counts) | set(other.counts):
+            counts[value] = self.counts.get(value, floor) + other.counts.get(value, other_floor)
+            errors[value] = self.errors.get(value, floor) + other.errors.get(value, other_floor)
+
+        kept = heapq.nlargest(self.k, counts.items(), key=lambda item: item[1])
+        self.counts = dict(kept)
+        self.errors = {value: errors[value] for value in self.counts}
+        self._heap = [(count, value) for value, count in self.counts.items()]
+        heapq.heapify(self._heap)
+
+
+class FieldSketch:
+    """Learned distribution of one field: heavy hitters plus frequency estimates"""
+
+    __slots__ = ('total', 'top', 'frequencies')
+
+    def __init__(self, top_k: int = DEFAULT_PATTERN_SKETCHES['top_k'],
+                 cm_width: int = DEFAULT_PATTERN_SKETCHES['cm_width'],
+                 cm_depth: int = DEFAULT_PATTERN_SKETCHES['cm_depth']):
+        self.total = 0
+        self.top = SpaceSaving(top_k)
+        self.frequencies = CountMinSketch(cm_width, cm_depth)
+
+    def add(self, value: str, count: int = 1) -> None:
+        self.total += count
+        self.top.add(value, count)
+        self.frequencies.add(value, count)
+
+    def __getitem__(self, value: str) -> int:
+        if value in self.top.counts:
+            return min(self.top.counts[value], self.frequencies.estimate(value))
+        return self.frequencies.estimate(value)
+
+    def most_common(self, n: Optional[int] = None) -> List[Tuple[str, int]]:
+        return self.top.most_common(n)
+
+    def merge(self, other: 'FieldSketch') -> None:
+        self.total += other.total
+        self.top.merge(other.top)
+        self.frequencies.merge(other.frequencies)
+
+
+class PatternSketches:
+    """Bounded replacement for ``defaultdict(Counter)`` of learned field values"""
+
+    def __init__(self, top_k: int = DEFAULT_PATTERN_SKETCHES['top_k'],
+                 cm_width: int = DEFAULT_PATTERN_SKETCHES['cm_width'],
+                 cm_depth: int = DEFAULT_PATTERN_SKETCHES['cm_depth'],
+                 max_keys: int = DEFAULT_PATTERN_SKETCHES['max_keys']):
+        self.top_k = top_k
+        self.cm_width = cm_width
+        self.cm_depth = cm_depth
+        self.max_keys = max_keys
+        self._fields: Dict[str, FieldSketch] = {}
+        self._lock = threading.Lock()
+        self.dropped_keys = 0
+
+    def _sketch(self, key: str) -> Optional[FieldSketch]:
+        sketch = self._fields.get(key)
+        if sketch is None:
+            if len(self._fields) >= self.max_keys:
+                self.dropped_keys += 1
+                return None
+            sketch = self._fields[key] = FieldSketch(self.top_k, self.cm_width, self.cm_depth)
+        return sketch
+
+    def add(self, key: str, value: str, count: int = 1) -> None:
+        with self._lock:
+            sketch = self._sketch(key)
+            if sketch is not None:
+                sketch.add(value, count)
+
+    def estimate(self, key: str, value: str) -> int:
+        sketch = self._fields.get(key)
+        return sketch[value] if sketch is not None else 0
+
+    def merge(self, other: 'PatternSketches') -> None:
+        if (self.cm_width, self.cm_depth) != (other.cm_width, other.cm_depth):
+            raise ValueError("Pattern sketches of different Count-Min shape cannot be merged")
+        with self._lock:
+            for key, other_sketch in list(other._fields.items()):
+                sketch = self._sketch(key)
+                if sketch is not None:
+                    sketch.merge(other_sketch)
+
+    def items(self):
+        return list(self._fields.items())
+
+    def most_common(self, n: Optional[int] = None) -> Dict[str, List[Tuple[str, int]]]:
+        """Top values of every key, ranked under the lock while ingest keeps adding"""
+        with self._lock:
+            return {key: sketch.most_common(n) for key, sketch in self._fields.items()}
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._fields
+
+    def __getitem__(self, key: str) -> FieldSketch:
+        return self._fields[key]
+
+    def __len__(self) -> int:
+        return len(self._fields)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._fields.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'keys': len(self._fields),
+            'max_keys': self.max_keys,
+            'dropped_keys': self.dropped_keys,
+            'top_k': self.top_k,
+            'cm_width': self.cm_width,
+            'cm_depth': self.cm_depth,
+            'bytes_per_key': self.cm_width * self.cm_depth * 8,
+        }
@@ -0,0 +1,514 @@
+"""
+Learned State Snapshots for MARSLOG-ClickHouse
+Versioned binary snapshots of AI parser learned state with atomic writes and merging
+"""
+
+import os
+import mmap
+import json
+import glob
+import time
+import struct
+import atexit
+import threading
+import logging
+from array import array
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Any, Optional, Tuple
+
+from .sketches import PatternSketches, FieldSketch, DEFAULT_PATTERN_SKETCHES
+from .baselines import (TrafficBaselines, RateBaseline, DEFAULT_TRAFFIC_BASELINES,
+                        WEEK_SLOTS, HOUR_SLOTS, _FIELDS)
+from .cardinality import SourceCardinality, HostWindow, DEFAULT_SOURCE_CARDINALITY
+from .rate_windows import WindowedStats, KeyWindow, RingCounter, DEFAULT_RATE_WINDOWS
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'MLST'
+STATE_VERSION = 1
+
+DEFAULT_STATE_SNAPSHOTS = {
+    'enabled': True,
+    'directory': '/app/data/ai_state',
+    'interval_sec': 300,
+}
+
+# Header: magic, version, section count, created_at
+_HEADER = struct.Struct('<4sHHd')
+# Section: name (8 bytes, NUL padded), payload length
+_SECTION = struct.Struct('<8sQ')
+_U32 = struct.Struct('<I')
+_SKETCH_SHAPE = struct.Struct('<IIII')        # top_k, cm_width, cm_depth, keys
+_FIELD_HEAD = struct.Struct('<QI')            # total, heavy hitter entries
+_HITTER = struct.Struct('<QQ')                # count, error
+_BASELINE_HEAD = struct.Struct('<II')         # bucket_seconds, keys
+_BASELINE = struct.Struct('<qQHddQd')         # bucket, count, week_slot, ewma mean/var/n, last_seen
+_WEEK_BYTES = 8 * _FIELDS * WEEK_SLOTS
+_SOURCES_HEAD = struct.Struct('<IIIIQQIQ')    # precision, window_seconds, history, hosts, seen capacity/bits/hashes/inserted
+_HOST_WINDOW = struct.Struct('<qQI')          # window, new_sources, history entries
+_HISTORY = struct.Struct('<qQQ')              # window_start, distinct_sources, new_sources
+_WINDOWS_HEAD = struct.Struct('<dIQ')         # failed_auth_window, buckets, keys
+_KEY_WINDOW = struct.Struct('<dB')            # last_seen, has failure ring
+_RING = struct.Struct('<Iqq')                 # head, head_bucket, total
+_HOUR_BYTES = 8 * _FIELDS * HOUR_SLOTS
+
+
+def load_state_snapshots(config_path: Optional[Path] = None) -> Dict[str, Any]:
+    """Load the snapshot settings, falling back to the built-in defaults"""
+    settings = dict(DEFAULT_STATE_SNAPSHOTS)
+    if config_path is None or not Path(config_path).exists():
+        return settings
+
+    try:
+        with open(config_path, 'r') as f:
+            settings.update(json.load(f).get('state_snapshots', {}))
+    except (json.JSONDecodeError, OSError) as e:
+        logger.error(f"Error loading state snapshot settings from {config_path}: {e}")
+
+    return settings
+
+
+def _array(typecode: str, buffer) -> array:
+    values = array(typecode)
+    values.frombytes(buffer)
+    return values
+
+
+def _pack_str(out: List[bytes], value: str) -> None:
+    encoded = value.encode('utf-8', 'surrogatepass')
+    out.append(_U32.pack(len(encoded)))
+    out.append(encoded)
+
+
+def _unpack_str(buffer, offset: int) -> Tuple[str, int]:
+    (length,) = _U32.unpack_from(buffer, offset)
+    offset += _U32.size
+    return bytes(buffer[offset:offset + length]).decode('utf-8', 'surrogatepass'), offset + length
+
+
+def _encode_patterns(patterns: PatternSketches) -> bytes:
+    with patterns._lock:
+        out = [_SKETCH_SHAPE.pack(patterns.top_k, patterns.cm_width, patterns.cm_depth, len(patterns))]
+        for key, sketch in patterns.items():
+            _pack_str(out, key)
+            out.append(_FIELD_HEAD.pack(sketch.total, len(sketch.top.counts)))
+            for value, count in sketch.top.counts.items():
+                _pack_str(out, value)
+                out.append(_HITTER.pack(count, sketch.top.errors[value]))
+            for row in sketch.frequencies.rows:
+                out.append(row.tobytes())
+    return b''.join(out)
+
+
+def _decode_patterns(buffer) -> PatternSketches:
+    top_k, cm_width, cm_depth, keys = _SKETCH_SHAPE.unpack_from(buffer, 0)
+    patterns = PatternSketches(top_k, cm_width, cm_depth,
+                               max_keys=max(keys, DEFAULT_PATTERN_SKETCHES['max_keys']))
+    offset = _SKETCH_SHAPE.size
+    row_bytes = 8 * cm_width
+    for _ in range(keys):
+        key, offset = _unpack_str(buffer, offset)
+        total, entries = _FIELD_HEAD.unpack_from(buffer, offset)
+        offset += _FIELD_HEAD.size
+
+        sketch = FieldSketch(top_k, cm_width, cm_depth)
+        sketch.total = total
+        for _ in range(entries):
+            value, offset = _unpack_str(buffer, offset)
+            count, error = _HITTER.unpack_from(buffer, offset)
+            offset += _HITTER.size
+            sketch.top.counts[value] = count
+            sketch.top.errors[value] = error
+        sketch.top._heap = sorted((count, value) for value, count in sketch.top.counts.items())
+        for row in range(cm_depth):
+            sketch.frequencies.rows[row] = _array('Q', buffer[offset:offset + row_bytes])
+            offset += row_bytes
+        patterns._fields[key] = sketch
+    return patterns
+
+
+def _encode_baselines(baselines: TrafficBaselines) -> bytes:
+    with baselines._lock:
+        out = [_BASELINE_HEAD.pack(baselines.bucket_seconds, len(baselines._keys))]
+        for (log_type, host), baseline in baselines._keys.items():
+            _pack_str(out, log_type)
+            _pack_str(out, host)
+            out.append(_BASELINE.pack(baseline.bucket or 0, baseline.count, baseline.week_slot,
+                                      baseline.ewma_mean, baseline.ewma_var, baseline.ewma_n,
+                                      baseline.last_seen))
+            out.append(baseline.week.tobytes())
+            out.append(baseline.hours.tobytes())
+    return b''.join(out)
+
+
+def _decode_baselines(buffer) -> TrafficBaselines:
+    bucket_seconds, keys = _BASELINE_HEAD.unpack_from(buffer, 0)
+    baselines = TrafficBaselines(bucket_seconds=bucket_seconds,
+                                 max_keys=max(keys, DEFAULT_TRAFFIC_BASELINES['max_keys']))
+    offset = _BASELINE_HEAD.size
+    for _ in range(keys):
+        log_type, offset = _unpack_str(buffer, offset)
+        host, offset = _unpack_str(buffer, offset)
+        baseline = RateBaseline()
+        (baseline.bucket, baseline.count, baseline.week_slot, baseline.ewma_mean,
+         baseline.ewma_var, baseline.ewma_n, baseline.last_seen) = _BASELINE.unpack_from(buffer, offset)
+        offset += _BASELINE.size
+        baseline.week = _array('d', buffer[offset:offset + _WEEK_BYTES])
+        offset += _WEEK_BYTES
+        baseline.hours = _array('d', buffer[offset:offset + _HOUR_BYTES])
+        offset += _HOUR_BYTES
+        baselines._keys[(log_type, host)] = baseline
+    return baselines
+
+
+def _encode_host_window(out: List[bytes], host_window: HostWindow) -> None:
+    out.append(_HOST_WINDOW.pack(host_window.window, host_window.new_sources, len(host_window.history)))
+    out.append(bytes(host_window.sources.registers))
+    for entry in host_window.history:
+        out.append(_HISTORY.pack(entry['window_start'], entry['distinct_sources'], entry['new_sources']))
+
+
+def _decode_host_window(buffer, offset: int, sources: SourceCardinality) -> Tuple[HostWindow, int]:
+    window, new_sources, entries = _HOST_WINDOW.unpack_from(buffer, offset)
+    offset += _HOST_WINDOW.size
+    host_window = HostWindow(window, sources.precision, sources.history_windows)
+    host_window.new_sources = new_sources
+    size = len(host_window.sources.registers)
+    host_window.sources.registers = bytearray(buffer[offset:offset + size])
+    host_window.sources._recount()
+    offset += size
+    for _ in range(entries):
+        window_start, distinct_sources, new_sources = _HISTORY.unpack_from(buffer, offset)
+        offset += _HISTORY.size
+        host_window.history.append({'window_start': window_start, 'distinct_sources': distinct_sources,
+                                    'new_sources': new_sources})
+    return host_window, offset
+
+
+def _encode_sources(sources: SourceCardinality) -> bytes:
+    with sources._lock:
+        seen = sources.seen
+        out = [_SOURCES_HEAD.pack(sources.precision, sources.window_seconds, sources.history_windows,
+                                  len(sources._hosts), seen.capacity, seen.bits, seen.hashes, seen.inserted),
+               bytes(seen.current), bytes(seen.previous)]
+        _encode_host_window(out, sources._all)
+        for host, host_window in sources._hosts.items():
+            _pack_str(out, host)
+            _encode_host_window(out, host_window)
+    return b''.join(out)
+
+
+def _decode_sources(buffer) -> SourceCardinality:
+    (precision, window_seconds, history_windows, hosts,
+     capacity, bits, hashes, inserted) = _SOURCES_HEAD.unpack_from(buffer, 0)
+    sources = SourceCardinality(precision, window_seconds, history_windows,
+                                max_hosts=max(hosts, DEFAULT_SOURCE_CARDINALITY['max_hosts']),
+                                seen_capacity=capacity)
+    offset = _SOURCES_HEAD.size
+    seen = sources.seen
+    seen.bits, seen.hashes, seen.inserted = bits, hashes, inserted
+    size = (bits + 7) // 8
+    seen.current = bytearray(buffer[offset:offset + size])
+    seen.previous = bytearray(buffer[offset + size:offset + 2 * size])
+    offset += 2 * size
+    sources._all, offset = _decode_host_window(buffer, offset, sources)
+    for _ in range(hosts):
+        host, offset = _unpack_str(buffer, offset)
+        sources._hosts[host], offset = _decode_host_window(buffer, offset, sources)
+    return sources
+
+
+def _encode_windows(windows: WindowedStats) -> bytes:
+    with windows._lock:
+        out = [_WINDOWS_HEAD.pack(windows.failed_auth_window, windows.buckets, len(windows._keys))]
+        for (kind, name), window in windows._keys.items():
+            _pack_str(out, kind)
+            _pack_str(out, name)
+            failures = window.failures
+            has_ring = failures is not None and failures.head_bucket is not None
+            out.append(_KEY_WINDOW.pack(window.last_seen or 0.0, has_ring))
+            if has_ring:
+                out.append(_RING.pack(failures.head, failures.head_bucket, failures.total))
+                out.append(array('q', failures.counts).tobytes())
+    return b''.join(out)
+
+
+def _decode_windows(buffer) -> WindowedStats:
+    failed_auth_window, buckets, keys = _WINDOWS_HEAD.unpack_from(buffer, 0)
+    windows = WindowedStats(failed_auth_window, buckets,
+                            max_keys=max(keys, DEFAULT_RATE_WINDOWS['max_keys']))
+    offset = _WINDOWS_HEAD.size
+    ring_bytes = 8 * buckets
+    for _ in range(keys):
+        kind, offset = _unpack_str(buffer, offset)
+        name, offset = _unpack_str(buffer, offset)
+        window = KeyWindow()
+        window.last_seen, has_ring = _KEY_WINDOW.unpack_from(buffer, offset)
+        offset += _KEY_WINDOW.size
+        if has_ring:
+            failures = window.failures = RingCounter(failed_auth_window, buckets)
+            failures.head, failures.head_bucket, failures.total = _RING.unpack_from(buffer, offset)
+            offset += _RING.size
+            failures.counts = _array('q', buffer[offset:offset + ring_bytes]).tolist()
+            offset += ring_bytes
+        windows._keys[(kind, name)] = window
+    return windows
+
+
+class LearnedState:
+    """The part of an AILogParser that is learned rather than configured.
+
+    ``sources`` and ``windows`` are None for snapshots written before they
+    were added; merging such a snapshot leaves them as they are.
+    """
+
+    def __init__(self, patterns: PatternSketches, baselines: TrafficBaselines,
+                 sources: Optional[SourceCardinality] = None, windows: Optional[WindowedStats] = None):
+        self.patterns = patterns
+        self.baselines = baselines
+        self.sources = sources
+        self.windows = windows
+
+    @classmethod
+    def of(cls, parser) -> 'LearnedState':
+        return cls(parser.learned_patterns, parser.baseline_metrics,
+                   parser.source_cardinality, parser.rate_windows)
+
+    def merge(self, other: 'LearnedState') -> None:
+        """Combine another worker's state into this one; counts and rates add"""
+        try:
+            self.patterns.merge(other.patterns)
+        except ValueError as e:
+            logger.warning(f"Skipping learned patterns from snapshot: {e}")
+        try:
+            self.baselines.merge(other.baselines)
+        except ValueError as e:
+            logger.warning(f"Skipping traffic baselines from snapshot: {e}")
+        if other.sources is not None:
+            if self.sources is None:
+                self.sources = other.sources
+            else:
+                try:
+                    self.sources.merge(other.sources)
+                except ValueError as e:
+                    logger.warning(f"Skipping source cardinality from snapshot: {e}")
+        if other.windows is not None:
+            if self.windows is None:
+                self.windows = other.windows
+            else:
+                try:
+                    self.windows.merge(other.windows)
+                except ValueError as e:
+                    logger.warning(f"Skipping rate windows from snapshot: {e}")
+
+    def encode(self) -> bytes:
+        sections = [(b'patterns', _encode_patterns(self.patterns)),
+                    (b'baseline', _encode_baselines(self.baselines))]
+        if self.sources is not None:
+            sections.append((b'sources', _encode_sources(self.sources)))
+        if self.windows is not None:
+            sections.append((b'windows', _encode_windows(self.windows)))
+        out = [_HEADER.pack(MAGIC, STATE_VERSION, len(sections), time.time())]
+        for name, payload in sections:
+            out.append(_SECTION.pack(name, len(payload)))
+            out.append(payload)
+        return b''.join(out)
+
+    @classmethod
+    def decode(cls, buffer) -> 'LearnedState':
+        magic, version, sections, _ = _HEADER.unpack_from(buffer, 0)
+        if magic != MAGIC:
+            raise ValueError("not a MARSLOG learned state snapshot")
+        if version > STATE_VERSION:
+            raise ValueError(f"snapshot version {version} is newer than supported {STATE_VERSION}")
+
+        patterns, baselines = PatternSketches(), TrafficBaselines()
+        sources = windows = None
+        offset = _HEADER.size
+        for _ in range(sections):
+            name, length = _SECTION.unpack_from(buffer, offset)
+            offset += _SECTION.size
+            payload = buffer[offset:offset + length]
+            offset += length
+            name = name.rstrip(b'\0')
+            if name == b'patterns':
+                patterns = _decode_patterns(payload)
+            elif name == b'baseline':
+                baselines = _decode_baselines(payload)
+            elif name == b'sources':
+                sources = _decode_sources(payload)
+            elif name == b'windows':
+                windows = _decode_windows(payload)
+            # Unknown sections from later versions are skipped
+        return cls(patterns, baselines, sources, windows)
+
+
+def write_snapshot(path: Path, state: LearnedState) -> int:
+    """Write ``state`` to ``path`` atomically (temp file, fsync, rename)"""
+    data = state.encode()
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = path.with_name(f'.{path.name}.{os.getpid()}.tmp')
+    with open(temp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+    return len(data)
+
+
+def read_snapshot(path: Path) -> LearnedState:
+    """Decode a snapshot straight from a read-only memory map of the file"""
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            raise ValueError("empty snapshot")
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            view = memoryview(mapped)
+            try:
+                return LearnedState.decode(view)
+            finally:
+                view.release()
+
+
+def merge_snapshots(paths: List[Path], output_path: Optional[Path] = None) -> LearnedState:
+    """Combine per-worker snapshots into one state, optionally writing it out"""
+    merged = None
+    for path in paths:
+        try:
+            state = read_snapshot(path)
+        except (OSError, ValueError, struct.error) as e:
+            logger.error(f"Skipping unreadable snapshot {path}: {e}")
+            continue
+        if merged is None:
+            merged = state
+        else:
+            merged.merge(state)
+    if merged is None:
+        merged = LearnedState(PatternSketches(), TrafficBaselines())
+    if output_path is not None:
+        write_snapshot(output_path, merged)
+    return merged
+
+
+class StateSnapshotter:
+    """Periodic per-worker snapshots with restore-by-claim at startup.
+
+    Every worker owns one snapshot file. On startup a worker claims the
+    newest file of a worker that is no longer running by renaming it, so
+    each file is restored by exactly one worker and nothing is counted
+    twice across restarts. A worker sees only its share of the stream, so
+    it takes over one predecessor's share rather than the sum of all of
+    them; files left over after a scale-down are claimed by later starts.
+    The claimed file is merged into the (empty) state, the worker writes
+    its own snapshot and then drops the claimed one.
+    """
+
+    def __init__(self, parser, directory: str = DEFAULT_STATE_SNAPSHOTS['directory'],
+                 interval_sec: float = DEFAULT_STATE_SNAPSHOTS['interval_sec'],
+                 enabled: bool = DEFAULT_STATE_SNAPSHOTS['enabled']):
+        self.parser = parser
+        self.directory = Path(directory)
+        self.interval_sec = interval_sec
+        self.enabled = enabled
+        self.path = self.directory / f'worker-{os.getpid()}-{int(time.time())}.bin'
+        self._stop = threading.Event()
+        self._thread = None
+        self.last_write = None
+        self.last_bytes = 0
+        self.restored_files = 0
+        self.restore_ms = 0.0
+
+    @staticmethod
+    def _owner_alive(candidate: str) -> bool:
+        try:
+            pid = int(Path(candidate).name.split('-')[1])
+        except (IndexError, ValueError):
+            return False
+        if pid == os.getpid():
+            return False  # left over from an earlier process with our pid
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            return True
+        return True
+
+    @staticmethod
+    def _mtime(candidate: str) -> float:
+        try:
+            return os.stat(candidate).st_mtime
+        except OSError:
+            return 0.0
+
+    def _claim(self) -> List[Path]:
+        for candidate in sorted(glob.glob(str(self.directory / '*.bin')), key=self._mtime, reverse=True):
+            if self._owner_alive(candidate):
+                continue  # snapshot of a running sibling worker
+            target = Path(f'{candidate}.claimed-{os.getpid()}')
+            try:
+                os.rename(candidate, target)
+                return [target]
+            except OSError:
+                continue  # another worker claimed it first
+        return []
+
+    def restore(self) -> None:
+        start = time.perf_counter()
+        claimed = self._claim()
+        if claimed:
+            LearnedState.of(self.parser).merge(merge_snapshots(claimed))
+            self.save()
+            for path in claimed:
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+        self.restored_files = len(claimed)
+        self.restore_ms = round((time.perf_counter() - start) * 1000, 2)
+        if claimed:
+            logger.info(f"Restored learned state from {len(claimed)} snapshot(s) in {self.restore_ms} ms")
+
+    def save(self) -> None:
+        try:
+            self.last_bytes = write_snapshot(self.path, LearnedState.of(self.parser))
+            self.last_write = time.time()
+        except OSError as e:
+            logger.error(f"Error writing learned state snapshot {self.path}: {e}")
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval_sec):
+            self.save()
+
+    def start(self) -> None:
+        if not self.enabled:
+            return
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            self.restore()
+        except OSError as e:
+            logger.error(f"Learned state snapshots disabled: {e}")
+            self.enabled = False
+            return
+        self._thread = threading.Thread(target=self._run, name='ai-state-snapshots', daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self) -> None:
+        if self._thread is not None:
+            self._stop.set()
+            self.save()
+            self._thread = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'enabled': self.enabled,
+            'path': str(self.path),
+            'version': STATE_VERSION,
+            'interval_sec': self.interval_sec,
+            'last_write': datetime.fromtimestamp(self.last_write).isoformat() if self.last_write else None,
+            'last_bytes': self.last_bytes,
+            'restored_files': self.restored_files,
+            'restore_ms': self.restore_ms,
+        }
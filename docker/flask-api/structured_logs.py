@@ -0,0 +1,140 @@
+"""
+Structured Logs for MARSLOG-ClickHouse
+Fast JSON log decoding with dotted-key flattening and interned field names
+"""
+
+import sys
+import json
+import logging
+from pathlib import Path
+from typing import Dict, Any, Optional
+
+try:
+    import orjson
+except ImportError:  # the standard library decoder is the fallback
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_STRUCTURED_LOGS = {
+    'enabled': True,
+    'max_depth': 4,         # nesting levels flattened into dotted keys
+    'max_fields': 256,      # flattened fields kept per line
+    'max_keys': 16384,      # distinct dotted keys interned
+}
+
+# Keys that carry the event time, in order of preference
+TIMESTAMP_KEYS = ('timestamp', '@timestamp', 'time', 'ts', 'datetime')
+
+_WHITESPACE = ' \t\r\n'
+
+if orjson is not None:
+    DECODER = 'orjson'
+    _loads = orjson.loads
+    _decode_errors = (orjson.JSONDecodeError,)
+else:
+    DECODER = 'json'
+    _loads = json.loads
+    _decode_errors = (json.JSONDecodeError, RecursionError)
+
+
+def load_structured_logs(config_path: Optional[Path] = None) -> Dict[str, Any]:
+    """Load the structured log settings, falling back to the built-in defaults"""
+    settings = dict(DEFAULT_STRUCTURED_LOGS)
+    if config_path is None or not Path(config_path).exists():
+        return settings
+
+    try:
+        with open(config_path, 'r') as f:
+            settings.update(json.load(f).get('structured_logs', {}))
+    except (json.JSONDecodeError, OSError) as e:
+        logger.error(f"Error loading structured log settings from {config_path}: {e}")
+
+    return settings
+
+
+def looks_like_json(line: str) -> bool:
+    """Cheap check on the first and last non-blank characters"""
+    start = len(line) - len(line.lstrip(_WHITESPACE))
+    end = len(line.rstrip(_WHITESPACE)) - 1
+    return end > start and line[start] == '{' and line[end] == '}'
+
+
+class StructuredLogParser:
+    """Decodes JSON log lines straight into flat ``parsed_fields``.
+
+    Nested objects become dotted keys (``user.name``) down to ``max_depth``;
+    deeper values are kept as compact JSON text. Lists of scalars stay lists.
+    Dotted keys are interned once and looked up by (prefix, key) afterwards,
+    so repeated lines of the same shape do not rebuild key strings.
+    """
+
+    def __init__(self, enabled: bool = DEFAULT_STRUCTURED_LOGS['enabled'],
+                 max_depth: int = DEFAULT_STRUCTURED_LOGS['max_depth'],
+                 max_fields: int = DEFAULT_STRUCTURED_LOGS['max_fields'],
+                 max_keys: int = DEFAULT_STRUCTURED_LOGS['max_keys']):
+        self.enabled = enabled
+        self.max_depth = max_depth
+        self.max_fields = max_fields
+        self.max_keys = max_keys
+        self._keys: Dict[tuple, str] = {}
+        self.parsed = 0
+        self.decode_errors = 0
+        self.truncated = 0
+
+    def _key(self, prefix: Optional[str], key: str) -> str:
+        cache_key = (prefix, key)
+        dotted = self._keys.get(cache_key)
+        if dotted is None:
+            dotted = key if prefix is None else f'{prefix}.{key}'
+            if len(self._keys) < self.max_keys:
+                dotted = sys.intern(dotted)
+                self._keys[cache_key] = dotted
+        return dotted
+
+    def _flatten(self, obj: Dict[str, Any], prefix: Optional[str], depth: int, out: Dict[str, Any]) -> bool:
+        """Add the leaves of ``obj`` to ``out``; False once max_fields is reached"""
+        for key, value in obj.items():
+            if len(out) >= self.max_fields:
+                return False
+            dotted = self._key(prefix, key)
+            if isinstance(value, dict):
+                if depth < self.max_depth:
+                    if not self._flatten(value, dotted, depth + 1, out):
+                        return False
+                else:
+                    out[dotted] = json.dumps(value, separators=(',', ':'))
+            elif isinstance(value, list) and any(isinstance(item, (dict, list)) for item in value):
+                out[dotted] = json.dumps(value, separators=(',', ':'))
+            else:
+                out[dotted] = value
+        return True
+
+    def parse(self, line: str) -> Optional[Dict[str, Any]]:
+        """Flat fields of a JSON object line, or None when the line is not one"""
+        if not self.enabled or not looks_like_json(line):
+            return None
+        try:
+            data = _loads(line)
+        except _decode_errors:
+            self.decode_errors += 1
+            return None
+        if not isinstance(data, dict):
+            return None
+
+        fields = {}
+        if not self._flatten(data, None, 1, fields):
+            self.truncated += 1
+        self.parsed += 1
+        return fields
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'enabled': self.enabled,
+            'decoder': DECODER,
+            'max_depth': self.max_depth,
+            'parsed': self.parsed,
+            'decode_errors': self.decode_errors,
+            'truncated': self.truncated,
+            'interned_keys': len(self._keys),
+        }
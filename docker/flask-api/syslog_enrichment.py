@@ -0,0 +1,381 @@
+"""
+Syslog Enrichment for MARSLOG-ClickHouse
+Background AI parsing of stored syslog messages into batched parsed_logs/access_logs inserts
+"""
+
+import os
+import re
+import json
+import time
+import zlib
+import queue
+import threading
+import logging
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Any, Optional, Tuple
+
+from .ai_log_parser import AILogParser, PARSED_LOG_COLUMNS
+from .access_logs import ACCESS_LOG_COLUMNS, ACCESS_LOG_TYPES, access_log_row
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SYSLOG_ENRICHMENT = {
+    'enabled': True,
+    'workers': 0,               # parser processes, one per source shard; 0 leaves one core to the ingest path
+    'queue_size': 20000,        # stored messages waiting for a worker; more are shed
+    'chunk_size': 200,          # messages parsed per worker task
+    'max_inflight': 0,          # chunks handed to the pool at once; 0 means two per worker
+    'batch_size': 2000,         # parsed_logs rows per insert
+    'flush_interval_sec': 2,    # longest a partial batch waits for more rows
+    'max_lag_sec': 300,         # queued messages older than this are shed, not parsed
+}
+
+_PRIORITY = re.compile(r'^<\d{1,3}>')
+# First address of a line, the source the parser's rate windows are keyed on
+_FIRST_IP = re.compile(r'\b(?:\d{1,3}\.){3}\d{1,3}\b')
+
+# Columns of the tables enrichment writes to
+TABLE_COLUMNS = {
+    'parsed_logs': list(PARSED_LOG_COLUMNS),
+    'access_logs': list(ACCESS_LOG_COLUMNS),
+}
+
+# Parser of a pool worker process, built once by _init_worker
+_worker_parser = None
+_worker_route_access = False
+
+
+def load_syslog_enrichment(config_path: Optional[Path] = None) -> Dict[str, Any]:
+    """Load the syslog enrichment settings, falling back to the built-in defaults"""
+    settings = dict(DEFAULT_SYSLOG_ENRICHMENT)
+    if config_path is None or not Path(config_path).exists():
+        return settings
+
+    try:
+        with open(config_path, 'r') as f:
+            settings.update(json.load(f).get('syslog_enrichment', {}))
+    except (json.JSONDecodeError, OSError) as e:
+        logger.error(f"Error loading syslog enrichment settings from {config_path}: {e}")
+
+    return settings
+
+
+def _init_worker(route_access_logs: bool = False) -> None:
+    global _worker_parser, _worker_route_access
+    _worker_parser = AILogParser()
+    _worker_route_access = route_access_logs
+
+
+def _to_datetime(value: Any) -> datetime:
+    if isinstance(value, str):
+        try:
+            return datetime.fromisoformat(value.replace('Z', '+00:00'))
+        except ValueError:
+            pass
+    return datetime.now()
+
+
+def _to_int(value: Any) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+def _parse_chunk(messages: List[Tuple[str, str, float]], model=None) -> Tuple[Dict[str, List[list]], int]:
+    """Rows per table (in TABLE_COLUMNS order) for (line, syslog timestamp, ingest time) triples,
+    and the number of lines that failed to parse.
+
+    ``model`` is a newly trained batch scoring model to use from this chunk on.
+    """
+    if model is not None:
+        _worker_parser.batch_scorer.model = model
+
+    # Rate windows and baselines see ingest time, not the burst the chunk is parsed in
+    records, failed = [], 0
+    for line, timestamp, ingested in messages:
+        try:
+            records.append((_worker_parser.extract_record(line, now=ingested), timestamp))
+        except Exception as e:
+            logger.warning(f"Error enriching syslog message, skipped: {e}")
+            failed += 1
+    try:
+        _worker_parser.batch_scorer.score([record for record, _ in records])
+    except Exception as e:
+        logger.error(f"Error scoring enriched syslog chunk: {e}")
+
+    rows = {table: [] for table in TABLE_COLUMNS}
+    for record, timestamp in records:
+        fields = record.fields
+        # The syslog header time stands in when the AI parser found none
+        fields['timestamp'] = fields.get('timestamp') or timestamp
+        if _worker_route_access and fields['log_type'] in ACCESS_LOG_TYPES:
+            rows['access_logs'].append(access_log_row(fields))
+            continue
+        row = _worker_parser.parsed_log_row(fields)
+        row['timestamp'] = _to_datetime(row['timestamp'])
+        row['created_at'] = datetime.now()
+        row['status_code'] = _to_int(row['status_code'])
+        row['bytes_sent'] = _to_int(row['bytes_sent'])
+        rows['parsed_logs'].append([row[column] for column in PARSED_LOG_COLUMNS])
+    return rows, failed
+
+
+class SyslogEnricher:
+    """Runs stored syslog messages through ``AILogParser`` off the ingest path.
+
+    ``submit`` is called after a message reached the ``logs`` table and only
+    does a non-blocking put on a bounded queue; when the queue is full the
+    message is shed and counted, so enrichment never slows raw ingest. A
+    dispatcher thread hands chunks to parser processes (one per spare core,
+    each with its own parser), keeps at most ``max_inflight`` chunks
+    outstanding and writes the results to ``parsed_logs`` in batches; with
+    ``route_access_logs`` Apache/nginx access lines go to ``access_logs``.
+
+    Messages are sharded on their source address, so the rate windows,
+    baselines and first-seen filter of one source live in one process, and
+    are parsed with their ingest time as the clock. A model trained on
+    ``model_source`` (the API's ``BatchScorer``) is shipped to each process
+    with its next chunk.
+
+    Lag is reported as the ingest-time distance between the newest accepted
+    message and the newest message whose row has been written.
+    """
+
+    def __init__(self, clickhouse_client=None, enabled: bool = DEFAULT_SYSLOG_ENRICHMENT['enabled'],
+                 workers: int = DEFAULT_SYSLOG_ENRICHMENT['workers'],
+                 queue_size: int = DEFAULT_SYSLOG_ENRICHMENT['queue_size'],
+                 chunk_size: int = DEFAULT_SYSLOG_ENRICHMENT['chunk_size'],
+                 max_inflight: int = DEFAULT_SYSLOG_ENRICHMENT['max_inflight'],
+                 batch_size: int = DEFAULT_SYSLOG_ENRICHMENT['batch_size'],
+                 flush_interval_sec: float = DEFAULT_SYSLOG_ENRICHMENT['flush_interval_sec'],
+                 max_lag_sec: float = DEFAULT_SYSLOG_ENRICHMENT['max_lag_sec'],
+                 route_access_logs: bool = False, model_source=None):
+        if enabled and clickhouse_client is None:
+            logger.warning("Syslog enrichment requested but no ClickHouse client is available")
+            enabled = False
+        self.clickhouse_client = clickhouse_client
+        self.enabled = enabled
+        self.workers = workers or max(1, (os.cpu_count() or 2) - 1)
+        self.chunk_size = chunk_size
+        self.max_inflight = max_inflight or 2 * self.workers
+        self.batch_size = batch_size
+        self.flush_interval_sec = flush_interval_sec
+        self.max_lag_sec = max_lag_sec
+        self.route_access_logs = route_access_logs
+        self.model_source = model_source
+
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._inflight: deque = deque()
+        self._pools: List[ProcessPoolExecutor] = []
+        self._model_versions: List[Optional[int]] = []
+        self._thread = None
+        self._stop = threading.Event()
+
+        self.accepted = 0
+        self.shed_full = 0
+        self.shed_stale = 0
+        self.parsed = 0
+        self.parse_errors = 0
+        self.inserted = 0
+        self.insert_errors = 0
+        self.batches = 0
+        self.last_accepted = None    # ingest time of the newest queued message
+        self.last_written = None     # ingest time of the newest message whose rows are written
+        self.last_flush = None
+
+    def start(self) -> None:
+        if not self.enabled or self._thread is not None:
+            return
+        self._stop.clear()
+        self.last_written = time.time()
+        self._pools = [self._new_pool() for _ in range(self.workers)]
+        self._model_versions = [None] * self.workers
+        self._thread = threading.Thread(target=self._run, name='syslog-enrichment', daemon=True)
+        self._thread.start()
+        logger.info(f"Syslog enrichment started with {self.workers} parser processes")
+
+    def stop(self, timeout: float = 30) -> None:
+        """Finish the chunks already handed out, flush them and stop the pool"""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+        self._thread = None
+        for pool in self._pools:
+            pool.shutdown(wait=False, cancel_futures=True)
+        self._pools = []
+
+    def submit(self, parsed_log: Dict[str, Any]) -> bool:
+        """Queue a stored syslog message for enrichment; never blocks"""
+        if self._thread is None:
+            return False
+        ingested = time.time()
+        line = _PRIORITY.sub('', parsed_log['raw_message'], count=1)
+        timestamp = parsed_log['timestamp']
+        if isinstance(timestamp, datetime):
+            timestamp = timestamp.isoformat()
+        try:
+            self._queue.put_nowait((ingested, line, timestamp, self.shard_of(parsed_log, line)))
+        except queue.Full:
+            self.shed_full += 1
+            return False
+        self.accepted += 1
+        self.last_accepted = ingested
+        return True
+
+    def shard_of(self, parsed_log: Dict[str, Any], line: str) -> int:
+        """Parser process of a message, by its source address (else its sending host)"""
+        source = (parsed_log.get('columns') or {}).get('src_ip')
+        if not source:
+            match = _FIRST_IP.search(line)
+            source = match.group(0) if match else parsed_log.get('host', '')
+        return zlib.crc32(source.encode('utf-8', errors='ignore')) % self.workers
+
+    def _take_chunk(self) -> List[Tuple[float, str, str, int]]:
+        try:
+            first = self._queue.get(timeout=min(0.5, self.flush_interval_sec))
+        except queue.Empty:
+            return []
+        chunk = [first]
+        while len(chunk) < self.chunk_size:
+            try:
+                chunk.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+
+        # Messages that waited past max_lag_sec are dropped to catch up with ingest
+        cutoff = time.time() - self.max_lag_sec
+        fresh = [item for item in chunk if item[0] >= cutoff]
+        self.shed_stale += len(chunk) - len(fresh)
+        return fresh
+
+    def _new_pool(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(max_workers=1, initializer=_init_worker,
+                                   initargs=(self.route_access_logs,))
+
+    def _model_for(self, shard: int):
+        """The trained model if ``shard`` has not received this version yet, else None"""
+        source = self.model_source
+        if source is None or source.model is None or self._model_versions[shard] == source.model_version:
+            return None
+        self._model_versions[shard] = source.model_version
+        return source.model
+
+    def _collect(self, batch: Dict[str, List[list]], newest: Optional[float]) -> Optional[float]:
+        """Wait for the oldest chunk and add its rows; returns the newest ingest time now handled"""
+        future, chunk_newest, size, shard = self._inflight.popleft()
+        try:
+            rows, failed = future.result()
+            for table, table_rows in rows.items():
+                batch[table].extend(table_rows)
+            self.parsed += size - failed
+            self.parse_errors += failed
+        except BrokenProcessPool as e:
+            logger.error(f"Syslog enrichment worker {shard} died, restarting it: {e}")
+            self.parse_errors += size
+            self._restart_pool(shard)
+        except Exception as e:
+            logger.error(f"Error enriching syslog messages: {e}")
+            self.parse_errors += size
+        return chunk_newest if chunk_newest is not None else newest
+
+    def _restart_pool(self, shard: int) -> None:
+        self._pools[shard].shutdown(wait=False, cancel_futures=True)
+        self._pools[shard] = self._new_pool()
+        self._model_versions[shard] = None
+
+    def _dispatch(self, chunk: List[Tuple[float, str, str, int]]) -> None:
+        """Hand each shard its part of a chunk"""
+        parts: Dict[int, list] = {}
+        for ingested, line, timestamp, shard in chunk:
+            parts.setdefault(shard, []).append((line, timestamp, ingested))
+        # Only the last part carries the chunk's ingest time, so lag advances
+        # once every part of the chunk is collected
+        last = len(parts) - 1
+        for i, (shard, messages) in enumerate(parts.items()):
+            try:
+                future = self._pools[shard].submit(_parse_chunk, messages, self._model_for(shard))
+            except BrokenProcessPool:
+                self.parse_errors += len(messages)
+                self._restart_pool(shard)
+            else:
+                self._inflight.append((future, chunk[-1][0] if i == last else None, len(messages), shard))
+
+    def flush(self, batch: Dict[str, List[list]], newest: Optional[float]) -> None:
+        """Insert a batch of rows, one insert per table"""
+        failed = False
+        for table, rows in batch.items():
+            if not rows:
+                continue
+            try:
+                self.clickhouse_client.insert(table, rows, column_names=TABLE_COLUMNS[table])
+            except Exception as e:
+                logger.error(f"Error inserting {len(rows)} enriched syslog rows into {table}: {e}")
+                self.insert_errors += 1
+                failed = True
+                continue
+            self.inserted += len(rows)
+            self.batches += 1
+            self.last_flush = time.time()
+        if newest is not None and not failed:
+            self.last_written = newest
+
+    def _run(self) -> None:
+        batch: Dict[str, List[list]] = {table: [] for table in TABLE_COLUMNS}
+        newest = None
+        flushed_at = time.monotonic()
+
+        while True:
+            stopping = self._stop.is_set()
+            if not stopping:
+                chunk = self._take_chunk()
+                if chunk:
+                    # A full pool blocks here, so the queue fills and submit starts shedding
+                    while len(self._inflight) >= self.max_inflight:
+                        newest = self._collect(batch, newest)
+                    self._dispatch(chunk)
+
+            while self._inflight and (stopping or self._inflight[0][0].done()):
+                newest = self._collect(batch, newest)
+
+            pending = sum(len(rows) for rows in batch.values())
+            if pending >= self.batch_size or stopping or \
+                    (pending and time.monotonic() - flushed_at >= self.flush_interval_sec):
+                self.flush(batch, newest)
+                batch = {table: [] for table in TABLE_COLUMNS}
+                flushed_at = time.monotonic()
+
+            if stopping:
+                return
+
+    def get_lag(self) -> float:
+        """Seconds of ingest not yet written to parsed_logs/access_logs"""
+        if self.last_accepted is None or self.last_written is None:
+            return 0.0
+        return round(max(0.0, self.last_accepted - self.last_written), 3)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'enabled': self.enabled,
+            'running': self._thread is not None,
+            'workers': self.workers,
+            'route_access_logs': self.route_access_logs,
+            'queue_depth': self._queue.qsize(),
+            'queue_size': self._queue.maxsize,
+            'inflight_chunks': len(self._inflight),
+            'accepted': self.accepted,
+            'shed_full': self.shed_full,
+            'shed_stale': self.shed_stale,
+            'parsed': self.parsed,
+            'parse_errors': self.parse_errors,
+            'inserted': self.inserted,
+            'insert_errors': self.insert_errors,
+            'batches': self.batches,
+            'lag_sec': self.get_lag(),
+            'last_flush': datetime.fromtimestamp(self.last_flush).isoformat() if self.last_flush else None,
+        }
@@ -14,6 +14,13 @@ from typing import Dict, List, Optional, Tuple
 from flask import Blueprint, request, jsonify
 import clickhouse_connect
 import logging
+from .utils import CONFIG_DIR
+from .syslog_enrichment import SyslogEnricher, load_syslog_enrichment
+from .ai_log_parser import ai_parser
+from .access_logs import load_access_logs
+from .parser_packs import ParserPackRegistry, load_parser_packs
+from .vendor_packs import typed_columns
+from .rule_safety import RuleSafetyGuard, load_rule_safety
 
 # Create blueprint for syslog routes
 syslog_bp = Blueprint('syslog', __name__)
@@ -33,6 +40,20 @@ class ClickHouseSyslogServer:
         self.socket = None
         self.threads = []
         
+        # Stored messages are AI-parsed into parsed_logs (access lines into access_logs) in the background;
+        # the model /train fits in this process is shipped to the parser processes
+        self.enrichment = SyslogEnricher(
+            clickhouse_client, **load_syslog_enrichment(CONFIG_DIR / 'ai_config.json'),
+            route_access_logs=load_access_logs(CONFIG_DIR / 'ai_config.json')['enabled'],
+            model_source=ai_parser.batch_scorer
+        )
+        
+        # Named-group parser packs add structured fields to every stored message
+        self.parser_packs = ParserPackRegistry(
+            RuleSafetyGuard(**load_rule_safety(CONFIG_DIR / 'ai_config.json')),
+            **load_parser_packs(CONFIG_DIR / 'ai_config.json')
+        )
+        
         # Syslog patterns for parsing
         self.syslog_patterns = {
             'rfc3164': re.compile(
@@ -203,6 +224,26 @@ class ClickHouseSyslogServer:
         parsed['parsed_fields']['syslog_format'] = 'plain'
         return parsed
     
+    def apply_parser_packs(self, parsed_log: Dict, client_ip: str) -> None:
+        """Add the fields of the first matching parser pack to parsed_fields and the typed columns"""
+        message = parsed_log['message']
+        result = self.parser_packs.parse(message, client_ip)
+        if result is None:
+            # Packs for whole lines (e.g. a bare syslog header) see the line without its PRI
+            line = re.sub(r'^<\d{1,3}>', '', parsed_log['raw_message'], count=1)
+            if line != message:
+                result = self.parser_packs.parse(line, client_ip)
+        if result is None:
+            parsed_log['columns'] = typed_columns(None)
+            return
+        
+        name, fields = result
+        parsed_fields = parsed_log['parsed_fields']
+        for key, value in fields.items():
+            parsed_fields.setdefault(key, str(value))
+        parsed_fields['parser_pack'] = name
+        parsed_log['columns'] = typed_columns(fields)
+    
     def store_log(self, parsed_log: Dict) -> bool:
         """Store parsed log in ClickHouse"""
         if not self.clickhouse_client:
@@ -222,7 +263,8 @@ class ClickHouseSyslogServer:
                 'program': parsed_log['program'][:255] if parsed_log['program'] else '',
                 'pid': parsed_log['pid'] if parsed_log['pid'] else 0,
                 'raw_message': parsed_log['raw_message'][:65535],
-                'parsed_fields': parsed_log['parsed_fields']
+                'parsed_fields': parsed_log['parsed_fields'],
+                **(parsed_log.get('columns') or typed_columns(None))
             }
             
             # Insert into ClickHouse
@@ -244,9 +286,12 @@ class ClickHouseSyslogServer:
             
             # Parse the syslog message
             parsed_log = self.parse_syslog_message(raw_message, client_ip)
+            self.apply_parser_packs(parsed_log, client_ip)
             
             # Store in ClickHouse
             success = self.store_log(parsed_log)
+            if success:
+                self.enrichment.submit(parsed_log)
             
             # Log the received message
             logger.info(f"Received from {client_ip}: {parsed_log['level']} - {parsed_log['message'][:100]}")
@@ -267,6 +312,7 @@ class ClickHouseSyslogServer:
             
             logger.info(f"Syslog server started on {self.host}:{self.port}")
             self.running = True
+            self.enrichment.start()
             
             while self.running:
                 try:
@@ -295,6 +341,7 @@ class ClickHouseSyslogServer:
         self.running = False
         if self.socket:
             self.socket.close()
+        self.enrichment.stop()
         logger.info("Syslog server stopped")
 
 # Global syslog server instance
@@ -337,6 +384,8 @@ def get_syslog_status():
             'status': 'running',
             'host': syslog_server.host,
             'port': syslog_server.port,
+            'enrichment': syslog_server.enrichment.get_stats(),
+            'parser_packs': syslog_server.parser_packs.get_stats(),
             'message': 'Syslog server is running'
         })
     else:
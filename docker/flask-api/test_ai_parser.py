@@ -6,7 +6,72 @@ Tests parsing functionality with sample log entries
 
 import requests
 import json
+import os
+import re
 import time
+import sys
+import types
+import random
+import tempfile
+import subprocess
+import importlib.util
+from pathlib import Path
+
+# The directory name is not a valid module name, so it is registered as the package flask_api
+_PACKAGE = types.ModuleType('flask_api')
+_PACKAGE.__path__ = [str(Path(__file__).resolve().parent)]
+sys.modules.setdefault('flask_api', _PACKAGE)
+
+BACKEND_DIR = Path(__file__).resolve().parents[2] / 'backend'
+
+# The regex scorer the compiled rule matcher replaced: (pattern, weight) of
+# calculate_risk_score and (pattern, anomaly) of detect_anomalies
+LEGACY_WEIGHTS = [
+    (r'\b(?:exploit|attack|malware|virus|trojan|backdoor|shellcode|injection|xss|sqli)\b', 35),
+    (r'\b(?:unauthorized|forbidden|denied|blocked|failed|breach)\b', 35),
+    (r'\b(?:suspicious|anomaly|anomalous|unusual|unexpected)\b', 35),
+    (r'\b(?:intrusion|penetration|brute.*force|dos|ddos)\b', 35),
+    (r'\b(?:error|fail|exception|timeout|refused|unreachable|denied)\b', 20),
+    (r'\b(?:404|500|503|502|501|401|403|407|408|429)\b', 20),
+    (r'(root|admin|administrator)', 15),
+    (r'(failed|denied|unauthorized|blocked)', 20),
+    (r'(union.*select|drop.*table|exec.*sp_|<script)', 40),
+]
+LEGACY_ANOMALIES = [
+    (r'failed.*(\d+).*times?', 'multiple_failures'),
+    (r'(brute.*force|dictionary.*attack|password.*spray)', 'brute_force_attempt'),
+    (r'(sqlmap|nmap|nikto|dirb|gobuster|wfuzz)', 'suspicious_user_agent'),
+    (r'(bot|crawler|spider)(?!.*google)', 'suspicious_user_agent'),
+    (r'^$', 'suspicious_user_agent'),
+]
+
+# Lines around the edges of the rules: word boundaries, line breaks, case
+EDGE_LOGS = [
+    '', '\n', 'brute force', 'BRUTE  FORCE', 'brute\nforce', 'abrute force', 'brute forcex',
+    'failed 3 times', 'Failed login 12 time', 'failed\n3 times', 'failedx 3 times',
+    'union all select', 'UNION\nSELECT', 'drop table users', 'exec xp_cmdshell sp_help', '<SCRIPT>alert(1)',
+    'googlebot', 'bot from google', 'bot\ngoogle', 'spider then GoOgLe', 'crawler bot google spider',
+    'dos', 'dosage', 'ddos attack', 'administrator root admin', 'HTTP 4040 500x 503',
+    'access denied for user', 'unauthorized_access', 'sqlmap/1.7 nikto', 'password spray dictionary attack',
+]
+
+
+def _load_backend(name: str):
+    """A backend service module, or None when its dependencies are not installed"""
+    if str(BACKEND_DIR) not in sys.path:
+        sys.path.append(str(BACKEND_DIR))
+    module_name = f'marslog_backend_{name}'
+    if module_name in sys.modules:
+        return sys.modules[module_name]
+    spec = importlib.util.spec_from_file_location(module_name, BACKEND_DIR / f'{name}.py')
+    module = importlib.util.module_from_spec(spec)
+    try:
+        spec.loader.exec_module(module)
+    except ImportError as e:
+        print(f"   ⚠️  Skipped: backend {name}.py needs {e.name}")
+        return None
+    sys.modules[module_name] = module
+    return module
 
 # Sample log entries for testing
 sample_logs = [
@@ -187,7 +252,224 @@ def test_individual_parsing():
         except Exception as e:
             print(f"  ❌ Error: {e}")
 
+def test_rule_matcher_matches_legacy_scorer():
+    """The compiled rule matcher gives the old regex scorer's weights and anomalies"""
+    from bench_ai_parser import synthetic_corpus
+    from flask_api.risk_rules import RiskRuleMatcher, DEFAULT_RISK_SCORING
+
+    print("\n⚖️  Rule Matcher vs Legacy Scorer Test")
+    print("=" * 50)
+
+    matcher = RiskRuleMatcher(DEFAULT_RISK_SCORING['rules'])
+    lines = sample_logs + EDGE_LOGS + [line for group in synthetic_corpus(50).values() for line in group]
+    for line in lines:
+        hits = matcher.scan(line)
+        weight = sum(weight for pattern, weight in LEGACY_WEIGHTS if re.search(pattern, line, re.IGNORECASE))
+        anomalies = {name for pattern, name in LEGACY_ANOMALIES if re.search(pattern, line, re.IGNORECASE)}
+        assert hits.weight == weight, (line, hits.to_dict(), weight)
+        assert hits.anomalies == anomalies, (line, hits.to_dict(), anomalies)
+    print(f"   ✅ {len(lines)} lines scored identically")
+
+def test_rule_audit_findings():
+    """Super-linear rules are flagged and timed, but still match long values in full"""
+    from flask_api.rule_safety import audit_pattern, RuleSafetyGuard, REGEX_TIMEOUT_AVAILABLE
+
+    print("\n🛡️  Rule Safety Audit Test")
+    print("=" * 50)
+
+    expected = {
+        r'(a+)+$': ['nested_quantifier'],
+        r'.*\d+x': ['adjacent_overlap', 'leading_repeat', 'wildcard_gap'],
+        r'\s+x': ['leading_repeat'],
+        r'union.*select': ['wildcard_gap'],
+        r'(?=.*secret)': ['lookaround_scan', 'wildcard_gap'],
+        r'^(?:ab|\wc)*$': ['ambiguous_alternation'],
+        r'^union.*select': [],
+        r'^\d+\s+\w+$': [],
+        r'\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}': [],
+    }
+    for pattern, findings in expected.items():
+        assert audit_pattern(pattern) == findings, (pattern, audit_pattern(pattern))
+    print(f"   ✅ {len(expected)} patterns audited as expected")
+
+    guard = RuleSafetyGuard()
+    path = '/' + 'a/' * 300 + 'backup.sql'
+    rule = guard.compile('file_path', r'(?:/[^/\s]+)+')
+    assert rule.findings == ['nested_quantifier'] and 'file_path' in guard.flagged
+    assert rule.timed == REGEX_TIMEOUT_AVAILABLE
+    assert guard.findall(rule, f'GET {path} 200') == [path]
+    clean = guard.compile('ip', r'\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}')
+    assert not clean.findings and not clean.timed and 'ip' not in guard.flagged
+    print("   ✅ Flagged rules keep matching long values in full")
+
+def test_cache_and_plans_match_full_parse():
+    """Parse cache hits and parse plans give the same output as the full regex cascade"""
+    from bench_ai_parser import AILogParser, synthetic_corpus, golden_view
+
+    print("\n🧩 Cache and Plan Equivalence Test")
+    print("=" * 50)
+
+    corpus = synthetic_corpus(40)
+    lines = [line for group in corpus.values() for line in group] + sample_logs
+    lines = lines + [line for line in lines if random.Random(len(line)).random() < 0.5]
+
+    full = AILogParser()
+    full.parse_cache.max_bytes = 0
+    full.parse_plans.enabled = False
+    fast = AILogParser()
+    fast.parse_cache.min_hit_ratio = 0.0  # never bypass, so every repeat is a hit
+
+    for line in lines:
+        assert golden_view(fast.extract_fields(line)) == golden_view(full.extract_fields(line)), line
+    cache, plans = fast.parse_cache.get_stats(), fast.parse_plans.get_stats()
+    assert cache['hits'] > 0 and (plans['applied'] > 0 or not plans['enabled'])
+    print(f"   ✅ {len(lines)} lines identical ({cache['hits']} cache hits, {plans['applied']} plans applied)")
+
+def test_state_snapshot_roundtrip():
+    """Source cardinality and rate windows survive a snapshot write and restore"""
+    from flask_api.sketches import PatternSketches
+    from flask_api.baselines import TrafficBaselines
+    from flask_api.cardinality import SourceCardinality
+    from flask_api.rate_windows import WindowedStats
+    from flask_api.state_store import LearnedState, write_snapshot, read_snapshot
+
+    print("\n💾 State Snapshot Round-Trip Test")
+    print("=" * 50)
+
+    now = time.time()
+    sources = SourceCardinality(precision=8, window_seconds=60, seen_capacity=1000)
+    windows = WindowedStats(failed_auth_window=60, buckets=6)
+    for i in range(200):
+        sources.observe(f'host-{i % 3}', f'203.0.113.{i % 50}', now - 90 + i * 0.5)
+        windows.observe(f'203.0.113.{i % 5}', f'user{i % 2}', failed_auth=i % 4 == 0, now=now - 30 + i * 0.1)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = Path(directory) / 'worker-1-0.bin'
+        write_snapshot(path, LearnedState(PatternSketches(), TrafficBaselines(), sources, windows))
+        restored = LearnedState(PatternSketches(), TrafficBaselines(),
+                                SourceCardinality(precision=8, window_seconds=60, seen_capacity=1000),
+                                WindowedStats(failed_auth_window=60, buckets=6))
+        restored.merge(read_snapshot(path))
+
+    assert restored.sources.get_cardinalities() == sources.get_cardinalities()
+    assert restored.sources.seen.current == sources.seen.current
+    assert restored.sources.seen.previous == sources.seen.previous
+    assert list(restored.windows._keys) == list(windows._keys)
+    for key, window in windows._keys.items():
+        assert restored.windows._keys[key].last_seen == window.last_seen
+        if window.failures is not None:
+            assert restored.windows._keys[key].failures.count(now) == window.failures.count(now)
+
+    # A restarted worker must not see known sources as first seen again
+    for source in ('203.0.113.7', '203.0.113.49'):
+        assert not restored.sources.observe('host-0', source, now).first_seen
+    assert restored.sources.observe('host-0', '198.51.100.1', now).first_seen
+    expected = windows.observe('203.0.113.0', None, failed_auth=True, now=now).source_failures
+    assert restored.windows.observe('203.0.113.0', None, failed_auth=True, now=now).source_failures == expected
+    print("   ✅ Seen filter, HyperLogLogs and rate windows restored")
+
+    # Snapshots written before these sections existed still load
+    legacy = LearnedState.decode(LearnedState(PatternSketches(), TrafficBaselines()).encode())
+    assert legacy.sources is None and legacy.windows is None
+    print("   ✅ Snapshots without source and window sections still load")
+
+def test_classification_priority():
+    """The keyword automaton picks the highest-priority category, as a plain scan would"""
+    print("\n🏷️  Log Classification Priority Test")
+    print("=" * 50)
+
+    log_classifier = _load_backend('log_classifier')
+    settings = {
+        'patterns': {
+            'network': ['connection', 'tcp'],
+            'security': ['login', 'auth', 'sudo'],
+            'error': ['error', 'failed', 'failure'],
+            'overlap': ['abcd', 'bc', 'cde'],
+        },
+        'priority': ['error', 'security', 'network'],
+    }
+    automaton, categories = log_classifier.build_automaton(settings)
+    assert categories == ['error', 'security', 'network', 'overlap']
+
+    def classify(message):
+        rank = automaton.best_rank(message.lower())
+        return categories[rank] if rank != log_classifier.NO_MATCH else 'application'
+
+    # Priority order wins over pattern order and over position in the line
+    assert classify('tcp connection reset after LOGIN error') == 'error'
+    assert classify('sudo: session opened, tcp') == 'security'
+    assert classify('authentication failure') == 'error'
+    # Keywords found through failure links (inside longer partial matches)
+    assert classify('xxabce') == 'overlap'
+    assert classify('abcdx') == 'overlap'
+    assert classify('nothing to see here') == 'application'
+
+    # Same answer as checking every keyword by substring search
+    rng = random.Random(7)
+    alphabet = 'abcdelogintcpsudrf '
+    for _ in range(2000):
+        message = ''.join(rng.choice(alphabet) for _ in range(rng.randint(0, 30)))
+        expected = next((category for category in categories
+                         if any(keyword in message for keyword in settings['patterns'][category])),
+                        'application')
+        assert classify(message) == expected, message
+    print("   ✅ Highest-priority category found in one pass")
+
+def test_template_shard_ids_stable():
+    """Shard routing ignores hash randomization and pattern ids survive a restart"""
+    print("\n🧭 Template Shard Id Stability Test")
+    print("=" * 50)
+
+    backend = _load_backend('app')
+    if backend is None or backend.TemplateMiner is None:
+        return
+
+    messages = [f'svc{i % 7} started worker {i} on port {8000 + i}' for i in range(60)]
+    messages += [f'sshd[{i}]: Failed password for user{i % 3} from 10.0.0.{i}' for i in range(40)]
+
+    miner = backend.ShardedTemplateMiner(shards=3)
+    routes = [miner.shard_of(message) for message in messages]
+    script = ("import sys, json; sys.path.insert(0, sys.argv[1]); import app; "
+              "m = app.ShardedTemplateMiner(shards=3); "
+              "print(json.dumps([m.shard_of(line) for line in json.loads(sys.stdin.read())]))")
+    for seed in ('1', '2'):
+        result = subprocess.run([sys.executable, '-c', script, str(BACKEND_DIR)], input=json.dumps(messages),
+                                capture_output=True, text=True, env=dict(os.environ, PYTHONHASHSEED=seed))
+        assert result.returncode == 0, result.stderr
+        assert json.loads(result.stdout.strip().splitlines()[-1]) == routes
+    assert len({miner.shard_of(f'svc1 started worker {i} on port {i}') for i in range(50)}) == 1
+    print("   ✅ Routing is the same in every process")
+
+    def mine(snapshot_dir):
+        sharded = backend.ShardedTemplateMiner(shards=3, snapshot_dir=snapshot_dir, snapshot_interval=0.2)
+        sharded.start()
+        ids = {}
+        for message in messages:
+            sharded.submit(message, lambda pattern_id, template, message=message: ids.__setitem__(message, pattern_id))
+        deadline = time.time() + 10
+        while len(ids) < len(messages) and time.time() < deadline:
+            time.sleep(0.05)
+        sharded.stop()
+        return ids
+
+    with tempfile.TemporaryDirectory() as directory:
+        first, second = mine(directory), mine(directory)
+        epochs = backend.template_id_epochs(directory, 3)
+        restored = [shard for shard in range(3) if (Path(directory) / f'drain3-shard-{shard}-of-3.bin').exists()]
+        assert restored and all(backend.template_id_epochs(directory, 3)[shard] == epochs[shard] for shard in restored)
+        # Another layout cannot restore these snapshots, so it must not reuse their epochs
+        assert not set(backend.template_id_epochs(directory, 4)) & set(epochs)
+    assert len(first) == len(messages) and 0 not in first.values()
+    assert second == first
+    print(f"   ✅ {len(set(first.values()))} pattern ids unchanged across a restart")
+
 if __name__ == "__main__":
     print("Starting AI Log Parser Tests...")
     test_ai_parser()
     test_individual_parsing()
+    test_rule_matcher_matches_legacy_scorer()
+    test_rule_audit_findings()
+    test_cache_and_plans_match_full_parse()
+    test_state_snapshot_roundtrip()
+    test_classification_priority()
+    test_template_shard_ids_stable()
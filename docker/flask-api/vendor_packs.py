@@ -0,0 +1,224 @@
+"""
+Vendor Parser Packs for MARSLOG-ClickHouse
+Cisco ASA message-id dispatch and PAN-OS positional CSV schemas for firewall logs
+"""
+
+import re
+import csv
+from typing import Dict, Any, Optional
+
+# ================================
+# CISCO ASA
+# ================================
+
+_ADDR = r'(?P<{0}_zone>[^:\s]+):(?P<{0}_ip>[^/\s]+)/(?P<{0}_port>\d+)'
+_SRC = _ADDR.format('source')
+_DST = _ADDR.format('dest')
+
+# Message id -> (body pattern, constant fields). Bodies are the text after
+# "%ASA-<severity>-<message id>: "; ids missing here keep the header fields only.
+ASA_MESSAGES = {
+    '106001': (r'Inbound TCP connection denied from (?P<source_ip>[^/\s]+)/(?P<source_port>\d+) '
+               r'to (?P<dest_ip>[^/\s]+)/(?P<dest_port>\d+) flags (?P<tcp_flags>.*?) on interface (?P<source_zone>\S+)',
+               {'action': 'deny', 'protocol': 'tcp'}),
+    '106006': (r'Deny inbound UDP from (?P<source_ip>[^/\s]+)/(?P<source_port>\d+) '
+               r'to (?P<dest_ip>[^/\s]+)/(?P<dest_port>\d+) on interface (?P<source_zone>\S+)',
+               {'action': 'deny', 'protocol': 'udp'}),
+    '106015': (r'Deny TCP \(no connection\) from (?P<source_ip>[^/\s]+)/(?P<source_port>\d+) '
+               r'to (?P<dest_ip>[^/\s]+)/(?P<dest_port>\d+) flags (?P<tcp_flags>.*?) on interface (?P<source_zone>\S+)',
+               {'action': 'deny', 'protocol': 'tcp'}),
+    '106023': (r'Deny (?P<protocol>\S+) src (?P<source_zone>[^:\s]+):(?P<source_ip>[^/\s]+)(?:/(?P<source_port>\d+))? '
+               r'dst (?P<dest_zone>[^:\s]+):(?P<dest_ip>[^/\s]+)(?:/(?P<dest_port>\d+))? '
+               r'(?:\(type \d+, code \d+\) )?by access-group "(?P<rule_name>[^"]*)"',
+               {'action': 'deny'}),
+    '106100': (r'access-list (?P<rule_name>\S+) (?P<action>permitted|denied|est-allowed) (?P<protocol>\S+) '
+               r'(?P<source_zone>[^/\s]+)/(?P<source_ip>[^(\s]+)\((?P<source_port>\d+)\)(?:\([^)]*\))? -> '
+               r'(?P<dest_zone>[^/\s]+)/(?P<dest_ip>[^(\s]+)\((?P<dest_port>\d+)\)',
+               {}),
+    '302013': (r'Built (?P<direction>inbound|outbound) (?P<protocol>TCP) connection (?P<session_id>\d+) for '
+               + _SRC + r' \([^)]*\)(?:\([^)]*\))? to ' + _DST,
+               {'action': 'built'}),
+    '302014': (r'Teardown (?P<protocol>TCP) connection (?P<session_id>\d+) for ' + _SRC + r'(?:\([^)]*\))? to '
+               + _DST + r'(?:\([^)]*\))? duration (?P<duration>\S+) bytes (?P<bytes>\d+)(?: (?P<reason>.+))?',
+               {'action': 'teardown'}),
+    '302015': (r'Built (?P<direction>inbound|outbound) (?P<protocol>UDP) connection (?P<session_id>\d+) for '
+               + _SRC + r' \([^)]*\)(?:\([^)]*\))? to ' + _DST,
+               {'action': 'built'}),
+    '302016': (r'Teardown (?P<protocol>UDP) connection (?P<session_id>\d+) for ' + _SRC + r'(?:\([^)]*\))? to '
+               + _DST + r'(?:\([^)]*\))? duration (?P<duration>\S+) bytes (?P<bytes>\d+)',
+               {'action': 'teardown'}),
+    '302020': (r'Built (?P<direction>inbound|outbound) (?P<protocol>ICMP) connection for '
+               r'faddr (?P<source_ip>[^/\s]+)/\d+(?:\([^)]*\))? gaddr \S+ laddr (?P<dest_ip>[^/\s]+)/\d+',
+               {'action': 'built'}),
+    '302021': (r'Teardown (?P<protocol>ICMP) connection for '
+               r'faddr (?P<source_ip>[^/\s]+)/\d+(?:\([^)]*\))? gaddr \S+ laddr (?P<dest_ip>[^/\s]+)/\d+',
+               {'action': 'teardown'}),
+    '113004': (r'AAA user authentication Successful : server = +(?P<dest_ip>\S+) : user = (?P<user>\S+)',
+               {'action': 'allow'}),
+    '113005': (r'AAA user authentication Rejected : reason = (?P<reason>[^:]+?) : server = (?P<dest_ip>\S+) '
+               r': user = (?P<user>\S+)(?: : user IP = (?P<source_ip>\S+))?',
+               {'action': 'deny'}),
+    '113019': (r'Group = (?P<group>[^,]+), Username = (?P<user>[^,]+), IP = (?P<source_ip>[^,]+), '
+               r'Session disconnected\. Session Type: (?P<session_type>[^,]+), Duration: (?P<duration>[^,]+), '
+               r'Bytes xmt: (?P<bytes_sent>\d+), Bytes rcv: (?P<bytes_received>\d+), Reason: (?P<reason>.*)',
+               {'action': 'disconnect'}),
+    '605004': (r'Login denied from (?P<source_ip>[^/\s]+)/(?P<source_port>\d+) to '
+               r'(?P<dest_zone>[^:\s]+):(?P<dest_ip>[^/\s]+)/(?P<service>\S+) for user "(?P<user>[^"]*)"',
+               {'action': 'deny'}),
+    '605005': (r'Login permitted from (?P<source_ip>[^/\s]+)/(?P<source_port>\d+) to '
+               r'(?P<dest_zone>[^:\s]+):(?P<dest_ip>[^/\s]+)/(?P<service>\S+) for user "(?P<user>[^"]*)"',
+               {'action': 'allow'}),
+    '710003': (r'(?P<protocol>TCP|UDP) access denied by ACL from (?P<source_ip>[^/\s]+)/(?P<source_port>\d+) to '
+               r'(?P<dest_zone>[^:\s]+):(?P<dest_ip>[^/\s]+)/(?P<dest_port>\d+)',
+               {'action': 'deny'}),
+}
+
+_ASA_EXTRACTORS = {msg_id: (re.compile(pattern), constants) for msg_id, (pattern, constants) in ASA_MESSAGES.items()}
+
+_ASA_ACTIONS = {'permitted': 'allow', 'est-allowed': 'allow', 'denied': 'deny'}
+
+# ================================
+# PALO ALTO PAN-OS
+# ================================
+
+# Positional CSV fields from the receive time on; the leading FUTURE_USE
+# column (and any syslog header glued to it) is skipped when present.
+_PANOS_COMMON = (
+    'receive_time', 'serial', 'type', 'subtype', 'config_version', 'generated_time',
+    'source_ip', 'dest_ip', 'nat_source_ip', 'nat_dest_ip', 'rule_name', 'source_user', 'dest_user',
+    'application', 'vsys', 'source_zone', 'dest_zone', 'inbound_interface', 'outbound_interface',
+    'log_action', None, 'session_id', 'repeat_count', 'source_port', 'dest_port',
+    'nat_source_port', 'nat_dest_port', 'flags', 'protocol', 'action',
+)
+
+PANOS_SCHEMAS = {
+    'TRAFFIC': _PANOS_COMMON + (
+        'bytes', 'bytes_sent', 'bytes_received', 'packets', 'start_time', 'elapsed', 'category', None,
+        'sequence_number', 'action_flags', 'source_location', 'dest_location', None,
+        'packets_sent', 'packets_received', 'session_end_reason',
+    ),
+    'THREAT': _PANOS_COMMON + (
+        'url', 'threat_id', 'category', 'severity', 'direction', 'sequence_number', 'action_flags',
+        'source_location', 'dest_location', None, 'content_type', 'pcap_id', 'file_digest', 'cloud',
+        'url_index', 'user_agent', 'file_type', 'x_forwarded_for', 'referer',
+    ),
+}
+
+_TYPE_INDEX = _PANOS_COMMON.index('type')
+
+# ================================
+# TYPED FIELDS
+# ================================
+
+INT_FIELDS = frozenset({
+    'source_port', 'dest_port', 'nat_source_port', 'nat_dest_port', 'session_id', 'repeat_count',
+    'bytes', 'bytes_sent', 'bytes_received', 'packets', 'packets_sent', 'packets_received', 'elapsed',
+})
+
+# logs column -> (parsed field, empty value); filled at ingest from any pack
+TYPED_COLUMNS = {
+    'src_ip': ('source_ip', ''),
+    'dst_ip': ('dest_ip', ''),
+    'src_port': ('source_port', 0),
+    'dst_port': ('dest_port', 0),
+    'action': ('action', ''),
+    'rule_name': ('rule_name', ''),
+    'bytes': ('bytes', 0),
+}
+
+
+def _typed(fields: Dict[str, Any]) -> Dict[str, Any]:
+    for key in INT_FIELDS.intersection(fields):
+        try:
+            fields[key] = int(fields[key])
+        except (TypeError, ValueError):
+            del fields[key]
+    return fields
+
+
+def parse_asa_message(message_id: str, body: str) -> Dict[str, Any]:
+    """Fields of an ASA message body, dispatched on its message id"""
+    extractor = _ASA_EXTRACTORS.get(message_id)
+    if extractor is None:
+        return {}
+    pattern, constants = extractor
+    match = pattern.match(body)
+    if not match:
+        return {}
+    fields = {key: value for key, value in match.groupdict().items() if value is not None}
+    fields.update(constants)
+    if 'action' in fields:
+        fields['action'] = _ASA_ACTIONS.get(fields['action'], fields['action'])
+    if 'protocol' in fields:
+        fields['protocol'] = fields['protocol'].lower()
+    return _typed(fields)
+
+
+def parse_asa(line: str) -> Optional[Dict[str, Any]]:
+    """Fields of a line carrying a %ASA-<severity>-<message id> tag, or None"""
+    start = line.find('%ASA-')
+    if start < 0:
+        return None
+    header = line[start + 5:start + 14]
+    if len(header) < 9 or not header[0].isdigit() or header[1] != '-' or not header[2:8].isdigit() \
+            or header[8] != ':':
+        return None
+    message_id = header[2:8]
+    fields = parse_asa_message(message_id, line[start + 14:].lstrip())
+    fields['severity'] = header[0]
+    fields['message_id'] = message_id
+    return fields
+
+
+def split_panos(line: str) -> list:
+    """CSV columns of a PAN-OS line; quoted values (URLs, user agents) may hold commas"""
+    if '"' not in line:
+        return line.split(',')
+    return next(csv.reader([line]))
+
+
+def parse_panos(line: str) -> Optional[Dict[str, Any]]:
+    """Fields of a PAN-OS TRAFFIC or THREAT CSV line, or None"""
+    if ',TRAFFIC,' not in line and ',THREAT,' not in line:
+        return None
+    columns = split_panos(line)
+    for offset in (0, 1):
+        if len(columns) > offset + _TYPE_INDEX and columns[offset + _TYPE_INDEX] in PANOS_SCHEMAS:
+            break
+    else:
+        return None
+
+    schema = PANOS_SCHEMAS[columns[offset + _TYPE_INDEX]]
+    fields = {name: value for name, value in zip(schema, columns[offset:]) if name and value}
+    if 'action' in fields:
+        fields['action'] = fields['action'].lower()
+    return _typed(fields)
+
+
+# Code packs for the parser-pack registry; each extractor rejects foreign lines itself
+VENDOR_PACKS = {
+    'cisco_asa': parse_asa,
+    'palo_alto': parse_panos,
+}
+
+
+def _int_or_zero(value: Any) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+def typed_columns(fields: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """TYPED_COLUMNS values of parsed fields, coerced to the column types"""
+    fields = fields or {}
+    columns = {}
+    for column, (key, empty) in TYPED_COLUMNS.items():
+        value = fields.get(key, empty)
+        columns[column] = _int_or_zero(value) if isinstance(empty, int) else str(value)
+    for column in ('src_port', 'dst_port'):
+        if not 0 <= columns[column] <= 65535:
+            columns[column] = 0
+    if not columns['bytes']:
+        columns['bytes'] = _int_or_zero(fields.get('bytes_sent')) + _int_or_zero(fields.get('bytes_received'))
+    return columns